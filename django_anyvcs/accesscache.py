@@ -0,0 +1,148 @@
+# Copyright (c) 2014-2016, Clemson University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Clemson University nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A cache of access decisions shared by ``django-anyvcs-ssh`` sessions.
+
+Decisions are kept in a sqlite database under ``VCSREPO_ROOT`` for
+``VCSREPO_ACCESS_CACHE_TTL`` seconds.  Entries are removed when repositories,
+their rights, or group memberships change (see ``models``), so the TTL only
+bounds how long changes made outside of those hooks go unnoticed.  Expired
+entries keep the ``ETag`` of the ``access`` view's response, so that they can
+be revalidated with a conditional request.
+"""
+
+from . import settings
+import json
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS access (
+  repo TEXT NOT NULL,
+  vcs TEXT NOT NULL,
+  username TEXT NOT NULL,
+  data TEXT NOT NULL,
+  expires REAL NOT NULL,
+  etag TEXT,
+  PRIMARY KEY (repo, vcs, username)
+)
+'''
+
+
+class AccessCache(object):
+  def __init__(self, path, ttl):
+    self.path = path
+    self.ttl = ttl
+
+  def _execute(self, sql, params=()):
+    conn = sqlite3.connect(self.path, timeout=5)
+    try:
+      with conn:
+        conn.execute(SCHEMA)
+        return conn.execute(sql, params).fetchall()
+    finally:
+      conn.close()
+
+  def get(self, repo, vcs, username):
+    '''Return cached access data, or None if there is none.'''
+    sql = ('SELECT data FROM access WHERE repo = ? AND vcs = ? AND '
+           'username = ? AND expires > ?')
+    try:
+      rows = self._execute(sql, (repo, vcs, username or '', time.time()))
+    except sqlite3.Error:
+      logger.warning('Access cache lookup failed', exc_info=True)
+      return None
+    if rows:
+      return json.loads(rows[0][0])
+    return None
+
+  def get_expired(self, repo, vcs, username):
+    '''
+    Return ``(data, etag)`` of an entry which can be revalidated, whether or
+    not it has expired, or None if there is none.
+    '''
+    sql = ('SELECT data, etag FROM access WHERE repo = ? AND vcs = ? AND '
+           'username = ? AND etag IS NOT NULL')
+    try:
+      rows = self._execute(sql, (repo, vcs, username or ''))
+    except sqlite3.Error:
+      logger.warning('Access cache lookup failed', exc_info=True)
+      return None
+    if rows:
+      return json.loads(rows[0][0]), rows[0][1]
+    return None
+
+  def set(self, repo, vcs, username, data, etag=None):
+    sql = 'INSERT OR REPLACE INTO access VALUES (?, ?, ?, ?, ?, ?)'
+    params = (repo, vcs, username or '', json.dumps(data),
+              time.time() + self.ttl, etag)
+    try:
+      self._execute(sql, params)
+    except sqlite3.Error:
+      logger.warning('Access cache update failed', exc_info=True)
+
+  def invalidate(self, repo=None, username=None):
+    '''
+    Remove the entries for a repository, a user, or both.  With no arguments
+    every entry is removed.
+    '''
+    where = []
+    params = []
+    if repo is not None:
+      where.append('repo = ?')
+      params.append(repo)
+    if username is not None:
+      where.append('username = ?')
+      params.append(username)
+    sql = 'DELETE FROM access'
+    if where:
+      sql += ' WHERE ' + ' AND '.join(where)
+    try:
+      self._execute(sql, params)
+    except sqlite3.Error:
+      logger.error('Access cache invalidation failed', exc_info=True)
+
+
+def get_access_cache():
+  '''Return the configured AccessCache, or None if caching is disabled.'''
+  if not settings.VCSREPO_ACCESS_CACHE_TTL:
+    return None
+  path = os.path.join(settings.VCSREPO_ROOT, '.access-cache.sqlite')
+  return AccessCache(path, settings.VCSREPO_ACCESS_CACHE_TTL)
+
+
+def invalidate(repo=None, username=None):
+  cache = get_access_cache()
+  if cache is not None:
+    cache.invalidate(repo, username)
@@ -0,0 +1,364 @@
+# Copyright (c) 2014-2016, Clemson University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Clemson University nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+An asyncio client for the web API, mirroring ``django_anyvcs.remote``.
+
+This module needs Python 3.5 or later.  ``AsyncGitRepo``, ``AsyncHgRepo`` and
+``AsyncSvnRepo`` have the methods of their ``remote`` counterparts as
+coroutines, and raise the same exceptions.  Repositories on the same host and
+event loop share an ``AsyncConnectionPool`` of HTTP/1.1 keep-alive
+connections, which also bounds the number of concurrent requests to the host.
+"""
+
+from .remote import (POOL_IDLE_TIMEOUT, POOL_SIZE, BadResponse,
+                     encode_revrange, log_entry, raise_error)
+from anyvcs.common import attrdict
+from urllib.parse import urlencode, urlparse
+import asyncio
+import json
+import time
+import weakref
+
+
+class Response(object):
+  def __init__(self, status, reason, headers, body, will_close):
+    self.status = status
+    self.reason = reason
+    self.headers = headers
+    self.body = body
+    self.will_close = will_close
+
+  def getheader(self, name, default=None):
+    return self.headers.get(name.lower(), default)
+
+
+async def read_response(reader):
+  '''Read an HTTP response from the stream `reader`.'''
+  line = await reader.readline()
+  if not line:
+    raise ConnectionResetError('Connection closed by server')
+  version, status, reason = (line.decode('latin-1').rstrip('\r\n') +
+                             '  ').split(' ', 2)
+  headers = {}
+  while True:
+    line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+    if not line:
+      break
+    name, value = line.split(':', 1)
+    headers[name.strip().lower()] = value.strip()
+  connection = headers.get('connection', '').lower()
+  will_close = (connection == 'close' or
+                version == 'HTTP/1.0' and connection != 'keep-alive')
+  if headers.get('transfer-encoding', '').lower() == 'chunked':
+    chunks = []
+    while True:
+      size = int((await reader.readline()).split(b';')[0], 16)
+      if not size:
+        break
+      chunks.append(await reader.readexactly(size))
+      await reader.readline()
+    while (await reader.readline()).strip():
+      pass  # Trailers
+    body = b''.join(chunks)
+  elif 'content-length' in headers:
+    body = await reader.readexactly(int(headers['content-length']))
+  else:
+    body = await reader.read()
+    will_close = True
+  return Response(int(status), reason.strip(), headers, body, will_close)
+
+
+class AsyncConnectionPool(object):
+  '''
+  Keep-alive connections to one host.  At most `size` requests run at once,
+  and idle connections are closed after `idle_timeout` seconds.
+  '''
+
+  def __init__(self, netloc, size=None, idle_timeout=None):
+    self.netloc = netloc
+    self.host, _, port = netloc.partition(':')
+    self.port = int(port or 80)
+    self.size = size or POOL_SIZE
+    self.idle_timeout = idle_timeout or POOL_IDLE_TIMEOUT
+    self._idle = []
+    self._slots = asyncio.Semaphore(self.size)
+
+  def reap(self):
+    '''Close connections which have been idle for too long.'''
+    expired = time.time() - self.idle_timeout
+    for reader, writer, used in self._idle:
+      if used < expired:
+        writer.close()
+    self._idle = [x for x in self._idle if x[2] >= expired]
+
+  def close(self):
+    '''Close all idle connections.'''
+    for reader, writer, used in self._idle:
+      writer.close()
+    self._idle = []
+
+  async def _send(self, reader, writer, method, url, body, headers):
+    lines = ['%s %s HTTP/1.1' % (method, url), 'Host: %s' % self.netloc,
+             'Content-Length: %d' % len(body)]
+    lines.extend('%s: %s' % x for x in headers.items())
+    head = '\r\n'.join(lines) + '\r\n\r\n'
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+    return await read_response(reader)
+
+  async def request(self, method, url, body=b'', headers={}, idempotent=True):
+    '''
+    Send a request and return its `Response`.  Idempotent requests which fail
+    because the server closed a reused connection are sent again on a new
+    one.
+    '''
+    async with self._slots:
+      self.reap()
+      if self._idle:
+        reader, writer, used = self._idle.pop()
+        reused = True
+      else:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        reused = False
+      try:
+        response = await self._send(reader, writer, method, url, body,
+                                    headers)
+      except (ConnectionError, asyncio.IncompleteReadError):
+        writer.close()
+        if not (reused and idempotent):
+          raise
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+          response = await self._send(reader, writer, method, url, body,
+                                      headers)
+        except BaseException:
+          writer.close()
+          raise
+      except BaseException:
+        writer.close()
+        raise
+      if response.will_close:
+        writer.close()
+      else:
+        self._idle.append((reader, writer, time.time()))
+      return response
+
+
+_pools = weakref.WeakKeyDictionary()
+
+
+def connection_pool(netloc):
+  '''
+  Return the connection pool shared by repositories on `netloc` in the
+  running event loop.
+  '''
+  pools = _pools.setdefault(asyncio.get_event_loop(), {})
+  try:
+    return pools[netloc]
+  except KeyError:
+    pool = pools[netloc] = AsyncConnectionPool(netloc)
+    return pool
+
+
+class LogIterator(object):
+  '''Iterate over log entries with ``async for``, a page at a time.'''
+
+  def __init__(self, repo, page_size, kwargs):
+    self._repo = repo
+    self._page_size = page_size
+    self._kwargs = kwargs
+    self._entries = []
+    self._cursor = None
+    self._started = False
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self):
+    while not self._entries:
+      if self._started and self._cursor is None:
+        raise StopAsyncIteration
+      self._entries, self._cursor = await self._repo.log_page(
+        self._cursor, self._page_size, **self._kwargs)
+      self._kwargs = {}
+      self._started = True
+    return self._entries.pop(0)
+
+
+class AsyncVCSRepo(object):
+  vcs = None
+
+  def __init__(self, api_url, pool=None):
+    url = urlparse(api_url)
+    assert url.scheme == 'http'
+    self._url = url
+    self._pool = pool
+    self._path = url.path.rstrip('/') + '/'
+
+  async def _request(self, method, url, body=b'', headers={}, raw=False,
+                     convert=None):
+    pool = self._pool or connection_pool(self._url.netloc)
+    response = await pool.request(method, url, body, headers)
+    ct = response.getheader('Content-Type')
+    body = response.body
+    if response.status == 200:
+      if ct == 'application/x-ndjson':
+        convert = convert or (lambda x: x)
+        return [convert(json.loads(line.decode('utf-8')))
+                for line in body.split(b'\n') if line]
+      if raw:
+        return body
+      if ct == 'application/json':
+        data = json.loads(body.decode('utf-8'))
+        if convert is not None and isinstance(data, list):
+          data = [convert(x) for x in data]
+        return data
+    if response.status == 400:
+      if ct == 'application/json':
+        raise_error(json.loads(body.decode('utf-8')))
+    raise BadResponse(response.status, response.reason, ct, body)
+
+  def _get(self, attr):
+    return self._request('GET', self._path + attr)
+
+  def _get_raw(self, attr, **params):
+    url = self._path + attr + '?' + urlencode(params)
+    return self._request('GET', url, raw=True)
+
+  def _post(self, attr, **kwargs):
+    body = json.dumps(kwargs).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    return self._request('POST', self._path + attr, body, headers)
+
+  def _post_list(self, attr, convert=None, **kwargs):
+    body = json.dumps(kwargs).encode('utf-8')
+    headers = {
+      'Content-Type': 'application/json',
+      'Accept': 'application/x-ndjson, application/json',
+    }
+    return self._request('POST', self._path + attr, body, headers,
+                         convert=convert)
+
+  @property
+  def path(self):
+    return self._get('path')
+
+  def ls(self, rev, path, recursive=False, recursive_dirs=False,
+         directory=False, report=[]):
+    if isinstance(report, (tuple, list)):
+      report = ','.join(report)
+    return self._post_list('ls', attrdict, rev=rev, path=path,
+                           recursive=recursive, recursive_dirs=recursive_dirs,
+                           directory=directory, report=report)
+
+  async def cat(self, rev, path):
+    try:
+      return await self._get_raw('cat-raw', rev=rev, path=path)
+    except BadResponse as e:
+      if e.status != 404 or e.content_type == 'text/plain':
+        raise
+    # The server predates the cat-raw view.
+    return (await self._post('cat', rev=rev, path=path)).encode('utf-8')
+
+  def readlink(self, rev, path):
+    return self._post('readlink', rev=rev, path=path)
+
+  def branches(self):
+    return self._post('branches')
+
+  def tags(self):
+    return self._post('tags')
+
+  def heads(self):
+    return self._post('heads')
+
+  def empty(self):
+    return self._post('empty')
+
+  async def log(self, revrange=None, limit=None, firstparent=False,
+                merges=None, path=None, follow=False):
+    result = await self._post_list('log', log_entry,
+                                   revrange=encode_revrange(revrange),
+                                   limit=limit, firstparent=firstparent,
+                                   merges=merges, path=path, follow=follow)
+    if isinstance(result, list):
+      return result
+    else:
+      return log_entry(result)
+
+  async def log_page(self, cursor=None, limit=100, revrange=None,
+                     firstparent=False, merges=None, path=None):
+    result = await self._post('log-page', cursor=cursor, limit=limit,
+                              revrange=revrange, firstparent=firstparent,
+                              merges=merges, path=path)
+    return [log_entry(x) for x in result['log']], result['cursor']
+
+  def iter_log(self, revrange=None, firstparent=False, merges=None, path=None,
+               page_size=100):
+    '''Return an asynchronous iterator over log entries.'''
+    kwargs = dict(revrange=revrange, firstparent=firstparent, merges=merges,
+                  path=path)
+    return LogIterator(self, page_size, kwargs)
+
+  def diff(self, rev_a, rev_b, path=None):
+    return self._post('diff', rev_a=rev_a, rev_b=rev_b, path=path)
+
+  def ancestor(self, rev1, rev2):
+    return self._post('ancestor', rev1=rev1, rev2=rev2)
+
+
+class AsyncGitRepo(AsyncVCSRepo):
+  """Mirrors the functionality of remote.GitRepo"""
+
+  vcs = 'git'
+
+
+class AsyncHgRepo(AsyncVCSRepo):
+  """Mirrors the functionality of remote.HgRepo"""
+
+  vcs = 'hg'
+
+  def bookmarks(self):
+    return self._post('bookmarks')
+
+
+class AsyncSvnRepo(AsyncVCSRepo):
+  """Mirrors the functionality of remote.SvnRepo"""
+
+  vcs = 'svn'
+
+  def proplist(self, rev, path=None):
+    return self._post('proplist', rev=rev, path=path)
+
+  def propget(self, prop, rev, path=None):
+    return self._post('propget', prop=prop, rev=rev, path=path)
+
+  def youngest(self):
+    return self._post('youngest')
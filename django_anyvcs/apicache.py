@@ -0,0 +1,130 @@
+# Copyright (c) 2014-2016, Clemson University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Clemson University nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A cache of ``api_call`` results which cannot change.
+
+Results are stored as encoded JSON in the Django cache named by
+``VCSREPO_API_CACHE``, keyed by the repository, the attribute and its
+arguments.  Only calls whose revision arguments name a fixed commit are
+cached: branch and tag names are first resolved to commit hashes for git and
+Mercurial, while Subversion revisions must be numbers.  Results larger than
+``VCSREPO_API_CACHE_MAX_ENTRY_SIZE`` bytes are not cached, and eviction is
+left to the cache backend.
+"""
+
+from . import settings
+from .remote import REVISION_ARGS, is_immutable
+import hashlib
+import json
+
+
+def get_cache():
+  '''Return the configured Django cache, or None if caching is disabled.'''
+  if not settings.VCSREPO_API_CACHE:
+    return None
+  try:
+    from django.core.cache import caches
+  except ImportError:
+    from django.core.cache import get_cache
+    return get_cache(settings.VCSREPO_API_CACHE)
+  return caches[settings.VCSREPO_API_CACHE]
+
+
+def resolve(repo, rev):
+  '''
+  Return `rev` if it names a fixed revision, the commit it resolves to, or
+  None if it cannot be resolved.
+  '''
+  if isinstance(rev, bool) or not isinstance(rev, (int, type(u''), str)):
+    return None
+  if isinstance(rev, int) and repo.vcs != 'svn':
+    rev = str(rev)
+  if is_immutable(repo.vcs, rev):
+    return rev
+  if repo.vcs == 'svn':
+    return None
+  try:
+    return str(repo.repo.canonical_rev(rev))
+  except Exception:
+    return None
+
+
+def resolve_kwargs(repo, attr, kwargs):
+  '''
+  Return a copy of `kwargs` with the revision arguments of `attr` resolved,
+  or None if the result of the call may change.
+  '''
+  if attr not in REVISION_ARGS:
+    return None
+  kwargs = dict(kwargs)
+  for name in REVISION_ARGS[attr]:
+    if name not in kwargs:
+      return None
+    rev = kwargs[name]
+    if name == 'revrange':
+      revs = rev if isinstance(rev, list) else [rev]
+      # A range must have a fixed end; (rev, None) means up to the heads.
+      if len(revs) not in (1, 2) or revs[-1] is None:
+        return None
+      resolved = []
+      for r in revs:
+        if r is not None:
+          r = resolve(repo, r)
+          if r is None:
+            return None
+        resolved.append(r)
+      kwargs[name] = resolved if isinstance(rev, list) else resolved[0]
+    elif rev is not None:
+      kwargs[name] = resolve(repo, rev)
+      if kwargs[name] is None:
+        return None
+  return kwargs
+
+
+def cache_key(repo, attr, kwargs):
+  data = json.dumps([repo.pk, repo.path, repo.vcs, attr, kwargs],
+                    sort_keys=True)
+  return 'django_anyvcs.api.' + hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def lookup(key):
+  cache = get_cache()
+  if cache is None:
+    return None
+  return cache.get(key)
+
+
+def store(key, content):
+  cache = get_cache()
+  if cache is None:
+    return
+  if len(content) > settings.VCSREPO_API_CACHE_MAX_ENTRY_SIZE:
+    return
+  cache.set(key, content)
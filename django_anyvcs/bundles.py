@@ -0,0 +1,141 @@
+# Copyright (c) 2014-2016, Clemson University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Clemson University nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Pre-generated clone bundles for git repositories.
+
+A fresh clone of a large repository makes ``git-upload-pack`` compute a pack
+of the whole history.  A bundle of all refs can be generated ahead of time and
+served as a static file, either through the ``bundle`` view or by any web
+server with access to the repository's private path.  If
+``VCSREPO_GIT_BUNDLE_URI`` is set, the bundle is also advertised to clients
+which support bundle URIs, so that they download it before fetching the
+remainder from ``git-upload-pack``.
+"""
+
+from . import handles, spool
+import logging
+import os
+import subprocess
+import tempfile
+
+GIT = os.getenv('GIT', 'git')
+
+logger = logging.getLogger(__name__)
+
+
+def bundle_path(path):
+  '''Return the path of the bundle for the git repository at `path`.'''
+  return os.path.join(handles.open(path, 'git').private_path, 'clone.bundle')
+
+
+def _config(repo, *args):
+  with open(os.devnull, 'wb') as devnull:
+    return subprocess.call([GIT, 'config'] + list(args), cwd=repo.abspath,
+                           stdout=devnull, stderr=devnull)
+
+
+def create_bundle(repo):
+  '''
+  Generate or refresh the clone bundle of a git repository.  Returns False if
+  the repository has no refs to bundle.
+  '''
+  from . import settings
+  path = bundle_path(repo.abspath)
+  if repo.repo.empty():
+    remove_bundle(repo)
+    return False
+  fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+  os.close(fd)
+  try:
+    cmd = [GIT, 'bundle', 'create', tmp, '--all']
+    with open(os.devnull, 'wb') as devnull:
+      subprocess.check_call(cmd, cwd=repo.abspath, stdout=devnull,
+                            stderr=devnull)
+    os.rename(tmp, path)
+  except Exception:
+    os.unlink(tmp)
+    raise
+  if settings.VCSREPO_GIT_BUNDLE_URI:
+    uri = settings.VCSREPO_GIT_BUNDLE_URI.format(name=repo.name)
+    _config(repo, 'uploadpack.advertiseBundleURIs', 'true')
+    _config(repo, 'bundle.version', '1')
+    _config(repo, 'bundle.mode', 'all')
+    _config(repo, 'bundle.clone.uri', uri)
+  return True
+
+
+def remove_bundle(repo):
+  path = bundle_path(repo.abspath)
+  if os.path.exists(path):
+    os.unlink(path)
+  _config(repo, '--unset', 'uploadpack.advertiseBundleURIs')
+  _config(repo, '--remove-section', 'bundle')
+  _config(repo, '--remove-section', 'bundle.clone')
+
+
+def schedule_refresh(name, path):
+  '''
+  Schedule a refresh of the bundle of the repository named `name` at `path`,
+  if it has one.
+  '''
+  if os.path.exists(bundle_path(path)):
+    spool.enqueue('git-bundle', name)
+
+
+def process(min_size=None, names=()):
+  '''
+  Refresh the bundles of repositories scheduled by `schedule_refresh()`, and
+  create bundles for git repositories named in `names` or at least `min_size`
+  bytes big which do not have one.  Returns the number of bundles written.
+  '''
+  from .models import Repo
+  # Entries already removed by another worker running at the same time are
+  # left to it.
+  refresh = set(name for path, name in spool.spooled('git-bundle')
+                if spool.claim(path))
+  wanted = refresh | set(names)
+  qs = Repo.objects.filter(vcs='git')
+  repos = list(qs.filter(name__in=wanted))
+  if min_size is not None:
+    for repo in qs.filter(disk_size__gte=min_size).exclude(name__in=wanted):
+      if not os.path.exists(bundle_path(repo.abspath)):
+        repos.append(repo)
+  count = 0
+  for repo in repos:
+    try:
+      created = create_bundle(repo)
+    except Exception:
+      logger.exception('Creating the bundle of %s failed', repo.name)
+      if repo.name in refresh:
+        spool.enqueue('git-bundle', repo.name)
+      continue
+    if created:
+      count += 1
+  return count
@@ -42,27 +42,40 @@ def path_function(repo):
 
 
 def rights_function(repo, user):
+  '''
+  User rights take precedence over group rights, which take precedence over
+  public read access.  If several of the user's groups have rights, the most
+  restrictive apply.  At most two queries are made.
+  '''
   from . import settings
   if user is not None:
     if settings.VCSREPO_USE_USER_RIGHTS:
       from .models import UserRights
-      try:
-        userrights = UserRights.objects.get(repo=repo, user=user)
-        return userrights.rights
-      except UserRights.DoesNotExist:
-        pass
-    if settings.VCSREPO_USE_GROUP_RIGHTS:
-      from .models import GroupRights
-      rights = None
-      for group in user.groups.all():
-        try:
-          grouprights = GroupRights.objects.get(repo=repo, group=group)
-          if rights is None or len(grouprights.rights) < rights:
-            rights = grouprights.rights
-        except GroupRights.DoesNotExist:
-          pass
-      if rights is not None:
+      qs = UserRights.objects.filter(repo=repo, user=user)
+      for rights in qs.values_list('rights', flat=True):
         return rights
+    if settings.VCSREPO_USE_GROUP_RIGHTS:
+      from .models import GroupRights, RIGHTS_CHOICES
+      qs = GroupRights.objects.filter(repo=repo, group__in=user.groups.all())
+      granted = set(qs.values_list('rights', flat=True).distinct())
+      for rights, label in RIGHTS_CHOICES:
+        if rights in granted:
+          return rights
+  if repo.public_read:
+    return 'r'
+  return '-'
+
+
+def materialized_rights_function(repo, user):
+  '''
+  Look up the rights maintained in ``EffectiveRights`` when
+  VCSREPO_MATERIALIZE_RIGHTS is enabled, with a single query.
+  '''
+  if user is not None:
+    from .models import EffectiveRights
+    qs = EffectiveRights.objects.filter(repo_id=repo.pk, user_id=user.pk)
+    for rights in qs.values_list('rights', flat=True):
+      return rights
   if repo.public_read:
     return 'r'
   return '-'
@@ -74,3 +87,16 @@ def user_acl_function(repo):
 
 def group_acl_function(repo):
   return dict((x.group, x.rights) for x in repo.grouprights_set.all())
+
+
+def disk_size_function(repo):
+  import os
+  from . import settings
+  disk_size = 0
+  for dirpath, dirnames, filenames in os.walk(repo.abspath, topdown=True):
+    if settings.VCSREPO_IGNORE_PRIVATE:
+      dirnames[:] = [d for d in dirnames if d != '.private']
+    for f in filenames:
+      abspath = os.path.join(dirpath, f)
+      disk_size += os.path.getsize(abspath)
+  return disk_size
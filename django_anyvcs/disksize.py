@@ -0,0 +1,160 @@
+# Copyright (c) 2014-2016, Clemson University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Clemson University nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Disk size calculation.
+
+Instead of walking a repository while the client waits, ``django-anyvcs-ssh``
+can leave a note in a spool directory under ``VCSREPO_ROOT``.  There is one
+file per repository, so repeated pushes to the same repository are coalesced
+until the ``anyvcs_disk_size`` management command processes the spool.
+
+``incremental_disk_size()`` can be used as ``VCSREPO_DISK_SIZE_FUNCTION``.
+This module can be imported from a Django settings file, so it must not
+import ``django_anyvcs.settings`` at the top level.
+"""
+
+from . import spool
+import json
+import logging
+import os
+import re
+import stat
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# Directories whose files are never modified in place, only added, renamed or
+# removed, all of which update the mtime of the directory.
+IMMUTABLE_DIRS = {
+  'git': re.compile(r'(?:^|/)objects/(?:[0-9a-f]{2}|pack)$'),
+  'svn': re.compile(r'^db/revs(?:/[0-9]+)?$'),
+}
+
+
+def incremental_disk_size(repo):
+  '''
+  Calculate the disk size of a repository, reusing the sizes from the
+  previous run for directories which are known to only gain or lose whole
+  files and whose mtime has not changed since.
+
+  These are git's loose object and pack directories and Subversion's revision
+  shards.  Everything else, including Mercurial's append-only store, is
+  stat()ed every time.  The index is kept in the repository's private path.
+  '''
+  from . import settings
+  index_path = os.path.join(repo.repo.private_path, 'disk-size-index.json')
+  try:
+    with open(index_path) as f:
+      index = json.load(f)
+  except (IOError, ValueError):
+    index = {}
+  immutable = IMMUTABLE_DIRS.get(repo.vcs)
+  start = time.time()
+  new_index = {}
+  disk_size = 0
+  stack = ['']
+  while stack:
+    relpath = stack.pop()
+    path = os.path.join(repo.abspath, relpath)
+    try:
+      mtime = os.stat(path).st_mtime
+    except OSError:
+      continue
+    entry = index.get(relpath)
+    unchanged = entry is not None and entry[0] == mtime
+    if immutable and immutable.search(relpath) and unchanged:
+      size, subdirs = entry[1], entry[2]
+    else:
+      size = 0
+      subdirs = []
+      for name in os.listdir(path):
+        st = os.lstat(os.path.join(path, name))
+        if stat.S_ISDIR(st.st_mode):
+          if not (settings.VCSREPO_IGNORE_PRIVATE and name == '.private'):
+            subdirs.append(name)
+        else:
+          size += st.st_size
+    # A directory changed within the last second may change again without a
+    # different mtime, so it is not trusted next time.
+    if mtime < start - 1:
+      new_index[relpath] = [mtime, size, subdirs]
+    disk_size += size
+    stack.extend(os.path.join(relpath, d) for d in subdirs)
+  fd, tmp = tempfile.mkstemp(dir=os.path.dirname(index_path), prefix='.tmp')
+  with os.fdopen(fd, 'w') as f:
+    json.dump(new_index, f)
+  os.rename(tmp, index_path)
+  return disk_size
+
+
+def enqueue(name):
+  '''Schedule a disk size recalculation for the repository named `name`.'''
+  spool.enqueue('disk-size', name)
+
+
+def pending():
+  '''Return the names of repositories waiting for recalculation.'''
+  return [name for path, name in spool.spooled('disk-size')]
+
+
+def process(batch_size=100):
+  '''
+  Recalculate the disk size of every spooled repository, saving the results
+  in batches of `batch_size`.  Returns the number of repositories updated.
+  '''
+  from .models import Repo
+  try:
+    from django.db.transaction import atomic
+  except ImportError:
+    from django.db.transaction import commit_on_success as atomic
+  spooled = spool.spooled('disk-size')
+  count = 0
+  for i in range(0, len(spooled), batch_size):
+    # Remove the entries first so that a push during the walk schedules
+    # another recalculation.  Entries already removed by another worker
+    # running at the same time are left to it.
+    names = [name for path, name in spooled[i:i + batch_size]
+             if spool.claim(path)]
+    sizes = {}
+    for repo in Repo.objects.filter(name__in=names):
+      try:
+        repo.recalculate_disk_size()
+      except Exception:
+        logger.exception('Recalculating the disk size of %s failed',
+                         repo.name)
+        enqueue(repo.name)
+        continue
+      sizes[repo.pk] = repo.disk_size
+    with atomic():
+      for pk, disk_size in sizes.items():
+        Repo.objects.filter(pk=pk).update(disk_size=disk_size)
+    count += len(sizes)
+  return count
@@ -27,12 +27,16 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from . import settings
-from .models import Repo
-
 import logging
 import os
 import sys
+import time
+
+# Taken before Django is loaded, for timing the startup phase.
+STARTED = time.time()
+
+from . import accesscache, bundles, disksize, limiter, settings, timing  # noqa
+from .models import Repo  # noqa
 
 logger = logging.getLogger(__name__)
 
@@ -46,8 +50,33 @@ class DispatchException(Exception):
   pass
 
 
+def _read(path):
+  try:
+    with open(path, 'rb') as f:
+      return f.read()
+  except IOError:
+    return None
+
+
+def _stat(path):
+  try:
+    st = os.stat(path)
+  except OSError:
+    return None
+  return (st.st_size, st.st_mtime)
+
+
 class Request(object):
   postprocess = None
+  queue_time = 0  # seconds spent waiting for process slots
+  # A string which postprocess() rewrites and which must not be split
+  # between the chunks it is given.
+  postprocess_token = None
+  # Output without line breaks is passed on once this much is buffered.
+  postprocess_bufsize = 65536
+  # Validator of the access view's response, and data to revalidate.
+  etag = None
+  stale_data = None
 
   def __init__(self, argv, username):
     self.argv = argv
@@ -69,16 +98,33 @@ class Request(object):
     self.write = self.write and ('w' in self.data['rights'])
 
   def load_data(self, url, params=None):
+    '''
+    Request access data from the access view.  If `etag` and `stale_data` are
+    set, the request is conditional and `stale_data` is used when the view
+    answers that it has not changed.  The ETag of the response is kept in
+    `etag`.
+    '''
     import json
     import urllib
+    import urllib2
     if params:
       url += '?' + urllib.urlencode(params)
-    response = urllib.urlopen(url)
+    headers = {}
+    if self.etag is not None and self.stale_data is not None:
+      headers['If-None-Match'] = self.etag
+    try:
+      response = urllib2.urlopen(urllib2.Request(url, headers=headers))
+    except urllib2.HTTPError as e:
+      response = e
     status = response.getcode()
+    if status == 304 and 'If-None-Match' in headers:
+      self.add_data(self.stale_data)
+      return
     content_type = response.info().gettype()
     if status == 200:
       data = json.load(response)
       self.add_data(data)
+      self.etag = response.info().getheader('ETag')
     else:
       if content_type == 'text/plain':
         raise DispatchException(response.readline().strip())
@@ -90,19 +136,98 @@ class Request(object):
           raise DispatchException(data)
       raise DispatchException('Backend failed', status)
 
+  def load_local(self):
+    '''
+    Resolve access rights in this process instead of asking the access view.
+    '''
+    from .views import get_user_model, repo_access_data
+    user = None
+    if self.username:
+      UserModel = get_user_model()
+      try:
+        user = UserModel.objects.get(username=self.username)
+      except UserModel.DoesNotExist:
+        raise DispatchException('User does not exist: %s' % self.username)
+    try:
+      self._repo = Repo.objects.get(name=self.repo_name, vcs=self.vcs)
+    except Repo.DoesNotExist:
+      raise DispatchException('Repository does not exist: %s' %
+                              self.repo_name)
+    self.add_data(repo_access_data(self._repo, user))
+
   def get_command(self):
     raise NotImplementedError
 
+  def snapshot(self):
+    '''
+    Return a cheap summary of the repository's state which changes whenever
+    something is written to it, or None if that is not known.
+    '''
+    return None
+
+  def iter_postprocess(self, fd):
+    '''
+    Read from the file descriptor `fd` until EOF, yielding postprocessed text
+    as soon as a line is complete.
+    '''
+    token = self.postprocess_token or ''
+    pending = ''
+    while True:
+      chunk = os.read(fd, 4096)
+      if not chunk:
+        break
+      pending += chunk
+      end = max(pending.rfind('\n'), pending.rfind('\r')) + 1
+      if not end and len(pending) > self.postprocess_bufsize:
+        # Keep back anything which could be the start of the token.
+        end = max(len(pending) - max(len(token) - 1, 0), 0)
+        if token:
+          start = pending.find(token, max(end - len(token) + 1, 0))
+          if start != -1 and start < end:
+            end = start
+      if end:
+        yield self.postprocess(pending[:end])
+        pending = pending[end:]
+    if pending:
+      yield self.postprocess(pending)
+
+  def acquire_slots(self):
+    '''
+    Wait until the configured process limits allow the command to run.
+    Returns file descriptors to close once the command has finished.
+    '''
+    def on_wait():
+      sys.stderr.write('Server busy, waiting in queue...\n')
+      sys.stderr.flush()
+    slots = []
+    try:
+      for semaphore in limiter.get_semaphores(self.repo_name):
+        timeout = settings.VCSREPO_DISPATCH_QUEUE_TIMEOUT
+        slots.append(semaphore.acquire(timeout, on_wait))
+    except limiter.QueueTimeout:
+      for fd in slots:
+        os.close(fd)
+      raise DispatchException('Server busy, try again later')
+    return slots
+
   def run_command(self):
     import subprocess
     cmd = self.get_command()
-    if not self.postprocess:
-      return subprocess.call(cmd)
-    p = subprocess.Popen(cmd, stderr=subprocess.PIPE)
-    stdout, stderr = p.communicate()
-    stderr = self.postprocess(stderr)
-    sys.stderr.write(stderr)
-    return p.returncode
+    start = time.time()
+    slots = self.acquire_slots()
+    self.queue_time = time.time() - start
+    try:
+      if not self.postprocess:
+        return subprocess.call(cmd)
+      p = subprocess.Popen(cmd, stderr=subprocess.PIPE)
+      for text in self.iter_postprocess(p.stderr.fileno()):
+        sys.stderr.write(text)
+        sys.stderr.flush()
+      p.stderr.close()
+      return p.wait()
+    finally:
+      for fd in slots:
+        os.close(fd)
 
 
 class GitRequest(Request):
@@ -134,6 +259,20 @@ class GitRequest(Request):
     cmd = [GIT, 'shell', '-c', "%s '%s'" % (self.argv[0], path)]
     return cmd
 
+  def snapshot(self):
+    gitdir = self.data['path']
+    if os.path.isdir(os.path.join(gitdir, '.git')):
+      gitdir = os.path.join(gitdir, '.git')
+    refs = []
+    for dirpath, dirnames, filenames in os.walk(os.path.join(gitdir, 'refs')):
+      for f in filenames:
+        path = os.path.join(dirpath, f)
+        refs.append((path, _read(path)))
+    refs.sort()
+    return (_read(os.path.join(gitdir, 'HEAD')),
+            _read(os.path.join(gitdir, 'packed-refs')),
+            refs)
+
 
 class HgRequest(Request):
   vcs = 'hg'
@@ -162,6 +301,21 @@ class HgRequest(Request):
       ]
     return cmd
 
+  def snapshot(self):
+    # Revlogs are only appended to, so their sizes change with every commit.
+    hgdir = os.path.join(self.data['path'], '.hg')
+    paths = [
+      os.path.join(hgdir, 'store', '00changelog.i'),
+      os.path.join(hgdir, 'store', '00changelog.d'),
+      os.path.join(hgdir, 'store', 'phaseroots'),
+      os.path.join(hgdir, 'bookmarks'),
+    ]
+    return [_stat(path) for path in paths]
+
+  @property
+  def postprocess_token(self):
+    return self.data['path']
+
   def postprocess(self, text):
     return text.replace(self.data['path'], self.repo_name)
 
@@ -169,6 +323,12 @@ class HgRequest(Request):
 class SvnRequest(Request):
   vcs = 'svn'
 
+  def __init__(self, argv, username):
+    super(SvnRequest, self).__init__(argv, username)
+    # svnserve serves every repository, so there is no way of knowing which
+    # one could have been written to.
+    self.write = False
+
   def get_command(self):
     assert VCSREPO_ROOT is not None, 'VCSREPO_ROOT is not set'
     svn_dir = os.path.join(VCSREPO_ROOT, 'svn')
@@ -199,21 +359,62 @@ def get_request(argv, username=None):
   raise DispatchException('Command not allowed', argv[0])
 
 
-def ssh_dispatch(access_url, username):
-  cmd = os.getenv('SSH_ORIGINAL_COMMAND', '')
+def load_access(request, access_url):
+  cache = accesscache.get_access_cache()
+  if cache is not None:
+    data = cache.get(request.repo_name, request.vcs, request.username)
+    if data is not None:
+      request.add_data(data)
+      return
+    if access_url is not None:
+      expired = cache.get_expired(request.repo_name, request.vcs,
+                                  request.username)
+      if expired is not None:
+        request.stale_data, request.etag = expired
+  if access_url is None:
+    request.load_local()
+  else:
+    url = '%s/%s' % (access_url, request.repo_name)
+    params = {'vcs': request.vcs}
+    if request.username:
+      params['u'] = request.username
+    request.load_data(url, params)
+  if cache is not None:
+    cache.set(request.repo_name, request.vcs, request.username, request.data,
+              request.etag)
+
+
+def ssh_dispatch(access_url, username, cmd=None, started=None):
+  '''
+  Dispatch an SSH session.  `started` is the time the process started, if
+  startup should be included in the timing records.
+  '''
+  if cmd is None:
+    cmd = os.getenv('SSH_ORIGINAL_COMMAND', '')
+  timer = timing.Timer(started)
+  request = None
+  rc = 1
   try:
     argv = parse_command(cmd)
     request = get_request(argv, username)
     if request.repo_name:
-      url = '%s/%s' % (access_url, request.repo_name)
-      params = {'vcs': request.vcs}
-      if username:
-        params['u'] = username
-      request.load_data(url, params)
-    rc = request.run_command()
-    if request.write and settings.VCSREPO_RECALCULATE_DISK_SIZE:
-      request.repo.recalculate_disk_size()
-      request.repo.save()
+      with timer.phase('access'):
+        load_access(request, access_url)
+    before = request.snapshot() if request.write else None
+    with timer.phase('command'):
+      rc = request.run_command()
+    timer.record('queue', request.queue_time)
+    if before is not None:
+      request.write = request.snapshot() != before
+    with timer.phase('post'):
+      if request.write and settings.VCSREPO_RECALCULATE_DISK_SIZE:
+        if settings.VCSREPO_DEFER_DISK_SIZE:
+          disksize.enqueue(request.repo_name)
+        else:
+          request.repo.recalculate_disk_size()
+          request.repo.save()
+      if request.write and request.vcs == 'git':
+        bundles.schedule_refresh(request.repo_name, request.data['path'])
     return rc
   except DispatchException as e:
     sys.stderr.write('Error: ' + str(e) + '\n')
@@ -223,19 +424,30 @@ def ssh_dispatch(access_url, username):
     logger.error(message, exc_info=True)
     sys.stderr.write('%s\n' % message)
     sys.exit(1)
+  finally:
+    timer.emit(
+      repo=request and request.repo_name,
+      vcs=request and request.vcs,
+      user=username,
+      status=rc,
+      write=bool(request and request.write),
+    )
 
 
 def main():
   argc = len(sys.argv)
   if argc < 2 or argc > 3:
-    sys.stderr.write('Usage: %s <access-url> [<username>]\n' % sys.argv[0])
+    sys.stderr.write('Usage: %s <access-url>|--local [<username>]\n' %
+                     sys.argv[0])
     sys.exit(1)
   url = sys.argv[1]
+  if url == '--local':
+    url = None
   username = None
   if argc == 3:
     username = sys.argv[2]
 
-  status = ssh_dispatch(url, username)
+  status = ssh_dispatch(url, username, started=STARTED)
   sys.exit(status)
 
 if __name__ == '__main__':
@@ -0,0 +1,192 @@
+# Copyright (c) 2014-2016, Clemson University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Clemson University nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A long-running dispatch server for ``django-anyvcs-ssh``.
+
+The server imports Django once and then forks a child for every SSH session,
+so sessions do not pay the cost of starting Python and loading Django.  The
+client is small and does not import Django; it hands the SSH session's
+command, username and stdio file descriptors to the server over a Unix socket
+and exits with the status of the dispatched command.
+"""
+
+import json
+import os
+import socket
+import sys
+
+try:
+  import socketserver
+except ImportError:
+  import SocketServer as socketserver
+
+
+def send_fds(sock, fds):
+  '''Send file descriptors over a Unix socket, one per message.'''
+  if hasattr(sock, 'sendmsg'):
+    import array
+    for fd in fds:
+      data = array.array('i', [fd])
+      sock.sendmsg([b'\0'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, data)])
+  else:
+    import _multiprocessing
+    for fd in fds:
+      _multiprocessing.sendfd(sock.fileno(), fd)
+
+
+def recv_fds(sock, count):
+  '''Receive `count` file descriptors sent with `send_fds()`.'''
+  fds = []
+  if hasattr(sock, 'recvmsg'):
+    import array
+    size = socket.CMSG_LEN(array.array('i').itemsize)
+    for i in range(count):
+      msg, ancdata, flags, addr = sock.recvmsg(1, size)
+      for level, type, data in ancdata:
+        if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+          fds.extend(array.array('i', data))
+  else:
+    import _multiprocessing
+    for i in range(count):
+      fds.append(_multiprocessing.recvfd(sock.fileno()))
+  if len(fds) != count:
+    raise IOError('Expected %d file descriptors, got %d' % (count, len(fds)))
+  return fds
+
+
+def run_session(access_url, username, cmd):
+  '''Run `dispatch.ssh_dispatch()` and return its exit status.'''
+  from . import dispatch
+  try:
+    status = dispatch.ssh_dispatch(access_url, username, cmd)
+  except SystemExit as e:
+    status = e.code
+  if status is None:
+    status = 0
+  elif not isinstance(status, int):
+    status = 1
+  sys.stdout.flush()
+  sys.stderr.flush()
+  return status
+
+
+class DispatchHandler(socketserver.StreamRequestHandler):
+  def handle(self):
+    fds = recv_fds(self.connection, 3)
+    header = json.loads(self.rfile.readline().decode('utf-8'))
+    for i, fd in enumerate(fds):
+      os.dup2(fd, i)
+      os.close(fd)
+    status = run_session(header['access_url'], header.get('username'),
+                         header.get('command', ''))
+    self.wfile.write(('%d\n' % status).encode('ascii'))
+
+
+class DispatchServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+  max_children = 64
+
+  def __init__(self, path, handler=DispatchHandler):
+    if os.path.exists(path):
+      os.unlink(path)
+    socketserver.UnixStreamServer.__init__(self, path, handler)
+    os.chmod(path, 0o600)
+
+
+def client_dispatch(path, access_url, username, cmd, fds=(0, 1, 2)):
+  '''
+  Hand a session over to the dispatch server listening at `path`.
+
+  Returns the exit status of the dispatched command.  Raises `socket.error` if
+  the server can not be reached.
+  '''
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(path)
+    send_fds(sock, fds)
+    header = {'access_url': access_url, 'username': username, 'command': cmd}
+    sock.sendall((json.dumps(header) + '\n').encode('utf-8'))
+    sock.shutdown(socket.SHUT_WR)
+    response = sock.makefile('rb').readline()
+  finally:
+    sock.close()
+  try:
+    return int(response)
+  except ValueError:
+    sys.stderr.write('Error: Dispatch server closed the connection\n')
+    return 1
+
+
+def setup_django():
+  import django
+  if hasattr(django, 'setup'):
+    django.setup()
+
+
+def server_main():
+  if len(sys.argv) != 2:
+    sys.stderr.write('Usage: %s <socket-path>\n' % sys.argv[0])
+    sys.exit(1)
+  setup_django()
+  # Load everything a session needs before forking any children.
+  from . import dispatch  # noqa
+  from django.db import connection
+  connection.close()
+  server = DispatchServer(sys.argv[1])
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    os.unlink(sys.argv[1])
+
+
+def client_main():
+  argc = len(sys.argv)
+  if argc < 3 or argc > 4:
+    sys.stderr.write('Usage: %s <socket-path> <access-url>|--local '
+                     '[<username>]\n' % sys.argv[0])
+    sys.exit(1)
+  path = sys.argv[1]
+  url = sys.argv[2]
+  if url == '--local':
+    url = None
+  username = None
+  if argc == 4:
+    username = sys.argv[3]
+  cmd = os.getenv('SSH_ORIGINAL_COMMAND', '')
+
+  try:
+    status = client_dispatch(path, url, username, cmd)
+  except socket.error:
+    # The server is not running; dispatch the session in this process.
+    setup_django()
+    status = run_session(url, username, cmd)
+  sys.exit(status)
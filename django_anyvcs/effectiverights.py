@@ -0,0 +1,184 @@
+# Copyright (c) 2014-2016, Clemson University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Clemson University nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A materialized table of the effective rights of users to repositories.
+
+When ``VCSREPO_MATERIALIZE_RIGHTS`` is enabled, ``EffectiveRights`` holds one
+row for each user with user or group rights to a repository.  The rows are
+kept up to date by the signal handlers in ``models``; users without a row fall
+back to public read access, so ``Repo.public_read`` needs no maintenance.  The
+``anyvcs_rebuild_rights`` management command rebuilds the table.
+"""
+
+from django.conf import settings as django_settings
+from django.core.exceptions import ImproperlyConfigured
+from . import settings
+
+try:
+  from django.db.transaction import atomic
+except ImportError:
+  from django.db.transaction import commit_on_success as atomic
+
+
+def check_models():
+  '''
+  Raise ``ImproperlyConfigured`` unless users and groups are ``auth.User`` and
+  ``auth.Group``, the only models whose membership changes are tracked.
+  '''
+  user_model = getattr(django_settings, 'AUTH_USER_MODEL', 'auth.User')
+  models = (user_model, settings.VCSREPO_USER_MODEL,
+            settings.VCSREPO_GROUP_MODEL)
+  if models != ('auth.User', 'auth.User', 'auth.Group'):
+    raise ImproperlyConfigured(
+      'VCSREPO_MATERIALIZE_RIGHTS requires auth.User and auth.Group')
+
+
+def _memberships():
+  from .views import get_user_model
+  field = get_user_model()._meta.get_field('groups')
+  through = field.rel.through
+  return through, field.m2m_field_name(), field.m2m_reverse_field_name()
+
+
+def _filter(qs, repo_field, repo_ids, user_field, user_ids):
+  if repo_ids is not None:
+    qs = qs.filter(**{repo_field + '__in': repo_ids})
+  if user_ids is not None:
+    qs = qs.filter(**{user_field + '__in': user_ids})
+  return qs
+
+
+def compute(repo_ids=None, user_ids=None):
+  '''
+  Return a dict mapping ``(repo_id, user_id)`` to the rights given by user
+  and group rights, following the precedence of
+  ``defaults.rights_function``.  ``repo_ids`` and ``user_ids`` may be lists or
+  querysets of primary keys; None means all of them.
+  '''
+  from .models import RIGHTS_CHOICES
+  rank = dict((rights, i) for i, (rights, label) in enumerate(RIGHTS_CHOICES))
+  result = {}
+  if settings.VCSREPO_USE_GROUP_RIGHTS:
+    from .models import GroupRights
+    through, user_field, group_field = _memberships()
+    members = _filter(through.objects.all(), None, None, user_field, user_ids)
+    qs = _filter(GroupRights.objects.all(), 'repo', repo_ids, None, None)
+    if user_ids is not None:
+      qs = qs.filter(group__in=members.values(group_field))
+    group_rights = {}
+    for repo_id, group_id, rights in qs.values_list('repo', 'group', 'rights'):
+      group_rights.setdefault(group_id, []).append((repo_id, rights))
+    members = members.filter(**{group_field + '__in': qs.values('group')})
+    for user_id, group_id in members.values_list(user_field, group_field):
+      for repo_id, rights in group_rights.get(group_id, ()):
+        key = (repo_id, user_id)
+        if key not in result or rank[rights] < rank[result[key]]:
+          result[key] = rights
+  if settings.VCSREPO_USE_USER_RIGHTS:
+    from .models import UserRights
+    qs = _filter(UserRights.objects.all(), 'repo', repo_ids, 'user', user_ids)
+    for repo_id, user_id, rights in qs.values_list('repo', 'user', 'rights'):
+      result[(repo_id, user_id)] = rights
+  return result
+
+
+def lookup(repo_ids, user_ids):
+  '''
+  Return a dict mapping ``(repo_id, user_id)`` to the rights in the table for
+  the given repositories and users.
+  '''
+  from .models import EffectiveRights
+  qs = _filter(EffectiveRights.objects.all(), 'repo_id', repo_ids,
+               'user_id', user_ids)
+  return dict(((repo_id, user_id), rights) for repo_id, user_id, rights
+              in qs.values_list('repo_id', 'user_id', 'rights'))
+
+
+def update(repo_ids=None, user_ids=None):
+  '''
+  Bring the rows for the given repositories and users up to date.  Does
+  nothing unless ``VCSREPO_MATERIALIZE_RIGHTS`` is enabled.
+  '''
+  if settings.VCSREPO_MATERIALIZE_RIGHTS:
+    check_models()
+    _update(repo_ids, user_ids)
+
+
+def _update(repo_ids, user_ids):
+  from .models import EffectiveRights
+  with atomic():
+    effective = compute(repo_ids, user_ids)
+    qs = _filter(EffectiveRights.objects.all(), 'repo_id', repo_ids,
+                 'user_id', user_ids)
+    stale = []
+    for pk, repo_id, user_id, rights in qs.values_list('pk', 'repo_id',
+                                                       'user_id', 'rights'):
+      new_rights = effective.pop((repo_id, user_id), None)
+      if new_rights is None:
+        stale.append(pk)
+      elif new_rights != rights:
+        EffectiveRights.objects.filter(pk=pk).update(rights=new_rights)
+    for i in range(0, len(stale), 500):
+      EffectiveRights.objects.filter(pk__in=stale[i:i + 500]).delete()
+    EffectiveRights.objects.bulk_create([
+      EffectiveRights(repo_id=repo_id, user_id=user_id, rights=rights)
+      for (repo_id, user_id), rights in effective.items()
+    ])
+
+
+def remove(repo_ids=None, user_ids=None):
+  '''Remove the rows of deleted repositories or users.'''
+  if not settings.VCSREPO_MATERIALIZE_RIGHTS:
+    return
+  check_models()
+  from .models import EffectiveRights
+  qs = _filter(EffectiveRights.objects.all(), 'repo_id', repo_ids,
+               'user_id', user_ids)
+  qs.delete()
+
+
+def rebuild(batch_size=1000):
+  '''
+  Rebuild the whole table, ``batch_size`` repositories per transaction.
+  Returns the number of repositories processed.
+  '''
+  check_models()
+  from .models import EffectiveRights, Repo
+  from .views import get_user_model
+  pks = list(Repo.objects.order_by('pk').values_list('pk', flat=True))
+  for i in range(0, len(pks), batch_size):
+    batch = pks[i:i + batch_size]
+    _update(Repo.objects.filter(pk__gte=batch[0], pk__lte=batch[-1])
+            .values('pk'), None)
+  EffectiveRights.objects.exclude(repo_id__in=Repo.objects.values('pk')) \
+                         .delete()
+  users = get_user_model().objects.values('pk')
+  EffectiveRights.objects.exclude(user_id__in=users).delete()
+  return len(pks)
@@ -0,0 +1,89 @@
+# Copyright (c) 2014-2016, Clemson University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Clemson University nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A process-wide pool of opened ``anyvcs`` repositories.
+
+``anyvcs.open()`` probes the repository type and layout every time it is
+called, so ``Repo.repo`` takes handles from here instead of opening its own.
+Handles are keyed by ``(abspath, vcs)`` and the least recently used ones are
+dropped once there are more than ``VCSREPO_HANDLE_POOL_SIZE``.  ``models``
+evicts entries when repositories are moved or deleted.
+"""
+
+from . import settings
+import anyvcs
+import collections
+import threading
+
+_handles = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def _add(key, handle):
+  with _lock:
+    _handles[key] = handle
+    while len(_handles) > settings.VCSREPO_HANDLE_POOL_SIZE:
+      _handles.popitem(last=False)
+  return handle
+
+
+def open(path, vcs):
+  '''Return an opened handle for the `vcs` repository at `path`.'''
+  key = (path, vcs)
+  with _lock:
+    try:
+      handle = _handles.pop(key)
+    except KeyError:
+      pass
+    else:
+      _handles[key] = handle
+      return handle
+  # Open outside of the lock so that a slow probe does not block other
+  # threads.  If two threads race, both handles work and the last one wins.
+  return _add(key, anyvcs.open(path, vcs))
+
+
+def create(path, vcs):
+  '''Create a `vcs` repository at `path` and return its handle.'''
+  return _add((path, vcs), anyvcs.create(path, vcs))
+
+
+def evict(path, vcs=None):
+  '''Drop the handles for `path`, or only its `vcs` handle if given.'''
+  with _lock:
+    for key in list(_handles):
+      if key[0] == path and vcs in (None, key[1]):
+        del _handles[key]
+
+
+def clear():
+  '''Drop every handle.'''
+  with _lock:
+    _handles.clear()
@@ -0,0 +1,200 @@
+# Copyright (c) 2014-2016, Clemson University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Clemson University nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Limits on the number of VCS processes run by ``django-anyvcs-ssh``.
+
+Each limit is a directory of slot files under ``VCSREPO_ROOT``; a process
+holds a slot while it holds an flock on the slot file, so slots are released
+even if the process dies.  Processes waiting for a slot line up by creating a
+ticket file in the limit's queue directory.  A ticket may take a free slot
+when enough slots are free for every live ticket ahead of it, so that freed
+slots are handed out in queue order.  Tickets further back only watch the
+ticket `limit` places ahead of them, and look at the queue again once it is
+gone.
+"""
+
+import errno
+import fcntl
+import hashlib
+import os
+import time
+
+
+class QueueTimeout(Exception):
+  pass
+
+
+def _makedirs(path):
+  try:
+    os.makedirs(path)
+  except OSError as e:
+    if e.errno != errno.EEXIST:
+      raise
+
+
+def _trylock(path, create=True):
+  '''Return an fd holding an exclusive flock on `path`, or None.'''
+  try:
+    fd = os.open(path, os.O_RDWR | (os.O_CREAT if create else 0), 0o666)
+  except OSError as e:
+    if not create and e.errno == errno.ENOENT:
+      return None
+    raise
+  # The VCS command must not inherit the lock, or anything it leaves running,
+  # such as a detached git gc, would keep holding the slot.
+  fcntl.fcntl(fd, fcntl.F_SETFD,
+              fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+  try:
+    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+  except (IOError, OSError) as e:
+    os.close(fd)
+    if e.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+      return None
+    raise
+  return fd
+
+
+def _is_live(path):
+  '''Return whether the ticket at `path` exists and its owner is alive.'''
+  fd = _trylock(path, create=False)
+  if fd is None:
+    return os.path.exists(path)
+  os.close(fd)
+  return False
+
+
+class Semaphore(object):
+  poll_interval = 0.05
+
+  def __init__(self, path, limit):
+    self.path = path
+    self.limit = limit
+    self.queue_path = os.path.join(path, 'queue')
+
+  def _take_slot(self, ahead=0):
+    '''
+    Return an fd holding a free slot, or None.  A slot is only taken if at
+    least `ahead` other slots are free as well.
+    '''
+    fds = []
+    for i in range(self.limit):
+      fd = _trylock(os.path.join(self.path, 'slot%d' % i))
+      if fd is not None:
+        fds.append(fd)
+        if len(fds) > ahead:
+          break
+    fd = fds.pop(0) if len(fds) > ahead else None
+    for other in fds:
+      os.close(other)
+    return fd
+
+  def _tickets_ahead(self, name):
+    '''Return the live tickets ahead of the ticket `name`, oldest first.'''
+    result = []
+    for other in sorted(os.listdir(self.queue_path)):
+      if other >= name:
+        break
+      if other.startswith('.'):
+        continue
+      path = os.path.join(self.queue_path, other)
+      fd = _trylock(path, create=False)
+      if fd is None:
+        if os.path.exists(path):
+          result.append(other)
+        continue
+      # Nobody holds the ticket, so its owner is gone.
+      try:
+        os.unlink(path)
+      except OSError:
+        pass
+      os.close(fd)
+    return result
+
+  def acquire(self, timeout=None, on_wait=None):
+    '''
+    Wait for a slot and return a file descriptor which holds it.  If the slot
+    is not available immediately, `on_wait` is called once before waiting.
+    Raises QueueTimeout if no slot became available within `timeout` seconds.
+    '''
+    _makedirs(self.queue_path)
+    fd = self._take_slot()
+    if fd is not None and not os.listdir(self.queue_path):
+      return fd
+    if fd is not None:
+      os.close(fd)
+    if on_wait is not None:
+      on_wait()
+    # The ticket is locked before it is put in the queue, so that it is never
+    # mistaken for the ticket of a dead process.
+    name = '%017.6f-%d' % (time.time(), os.getpid())
+    ticket_path = os.path.join(self.queue_path, name)
+    tmp_path = os.path.join(self.queue_path, '.' + name)
+    ticket = _trylock(tmp_path)
+    os.rename(tmp_path, ticket_path)
+    deadline = None if timeout is None else time.time() + timeout
+    try:
+      while True:
+        ahead = self._tickets_ahead(name)
+        if len(ahead) < self.limit:
+          fd = self._take_slot(len(ahead))
+          if fd is not None:
+            return fd
+          watch = None
+        else:
+          # This ticket cannot take a slot before the one `limit` places ahead
+          # of it has left the queue.
+          watch = os.path.join(self.queue_path, ahead[-self.limit])
+        while True:
+          if deadline is not None and time.time() >= deadline:
+            raise QueueTimeout()
+          time.sleep(self.poll_interval)
+          if watch is None or not _is_live(watch):
+            break
+    finally:
+      os.unlink(ticket_path)
+      os.close(ticket)
+
+  def release(self, fd):
+    os.close(fd)
+
+
+def get_semaphores(repo_name):
+  '''Return the configured semaphores which apply to a repository.'''
+  from . import settings
+  root = os.path.join(settings.VCSREPO_ROOT, '.dispatch-slots')
+  result = []
+  if repo_name and settings.VCSREPO_DISPATCH_MAX_REPO_PROCESSES:
+    h = hashlib.sha1(repo_name.encode('utf-8')).hexdigest()
+    limit = settings.VCSREPO_DISPATCH_MAX_REPO_PROCESSES
+    result.append(Semaphore(os.path.join(root, 'repo', h), limit))
+  if settings.VCSREPO_DISPATCH_MAX_PROCESSES:
+    limit = settings.VCSREPO_DISPATCH_MAX_PROCESSES
+    result.append(Semaphore(os.path.join(root, 'global'), limit))
+  return result
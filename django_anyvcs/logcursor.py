@@ -0,0 +1,291 @@
+# Copyright (c) 2014-2016, Clemson University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Clemson University nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Resumable walks of the commit log, for the ``log_page`` view.
+
+Each page of log entries comes with an opaque cursor from which the walk is
+resumed, without walking the earlier pages again.  The cursor holds the walk
+parameters, with revisions resolved to commit ids so that later pages are not
+affected by new commits, and enough of the state of the walk to resume it:
+
+* A first-parent git walk from a single commit follows one chain, so the
+  cursor holds the first entry of the next page and the walk starts there.
+  Otherwise git's order depends on commit dates and on the order in which the
+  walk met each commit, which a set of commits to resume from does not
+  capture when dates are skewed or equal.  So the cursor holds the commits
+  the walk starts from and the number of entries already returned, and git
+  skips those entries without formatting them.
+* hg walks in revision number order, so the cursor holds the last entry.
+* Without a revision range, anyvcs lists a Subversion log from the history
+  of a single path, so the cursor holds the revision and path of the first
+  entry of the next page and the history is resumed there.  A revision range
+  is a difference of merge histories which anyvcs sorts afterwards, so the
+  cursor holds the number of entries already returned and that walk is
+  repeated.  The log entries themselves come from the anyvcs commit cache.
+"""
+
+from anyvcs.common import CommitLogEntry, command, parse_isodate
+import base64
+import json
+import re
+
+hex_rx = re.compile(r'^[0-9a-f]{40}$')
+
+
+def encode_cursor(state):
+  data = json.dumps(state, sort_keys=True, separators=(',', ':'))
+  return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, vcs):
+  '''Return the walk state in `cursor`, or raise ValueError if it is bad.'''
+  try:
+    state = json.loads(base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+  except (TypeError, ValueError, UnicodeError):
+    raise ValueError('Invalid cursor')
+  if not isinstance(state, dict) or state.get('vcs') != vcs:
+    raise ValueError('Invalid cursor')
+  if vcs == 'git' and 'heads' in state:
+    skip = state.get('skip')
+    if not isinstance(skip, int) or isinstance(skip, bool) or skip < 0:
+      raise ValueError('Invalid cursor')
+  if vcs == 'svn' and 'next' in state:
+    # The path ends up on the command line, so it must not look like an option.
+    if not isinstance(state['next'], list) or len(state['next']) != 2:
+      raise ValueError('Invalid cursor')
+    rev, path = state['next']
+    if not isinstance(rev, int) or isinstance(rev, bool) or rev < 0:
+      raise ValueError('Invalid cursor')
+    if not isinstance(path, basestring) or not path.startswith('/'):
+      raise ValueError('Invalid cursor')
+  # Commit ids end up on the command line, so make sure they are only that.
+  for key in ('heads', 'exclude'):
+    if not all(isinstance(x, basestring) and hex_rx.match(x)
+               for x in state.get(key, [])):
+      raise ValueError('Invalid cursor')
+  for key in ('base', 'end', 'last'):
+    if state.get(key) is not None and not hex_rx.match(state[key]):
+      raise ValueError('Invalid cursor')
+  return state
+
+
+def _split_revrange(revrange):
+  if revrange is None:
+    return None, None
+  if not isinstance(revrange, (tuple, list)) or len(revrange) != 2:
+    raise ValueError('Log pages need a revision range, not a revision')
+  for rev in revrange:
+    if isinstance(rev, basestring) and rev.startswith('-'):
+      raise ValueError('Invalid revision: %s' % rev)
+  return revrange
+
+
+def _git_commits(vcsrepo, *args):
+  from anyvcs.git import GIT
+  # Unsorted, so that the walk meets the commits in the same order as with
+  # the original arguments.
+  cmd = [GIT, 'rev-list', '--no-walk=unsorted'] + list(args)
+  return command(cmd, cwd=vcsrepo.path).decode('ascii').split()
+
+
+def _git_log(vcsrepo, state, limit):
+  '''
+  Return up to `limit` log entries of the walk described by `state`, after
+  the first ``state['skip']``.  The arguments are those anyvcs passes to
+  ``git log``, with revisions resolved to commit ids.
+  '''
+  from anyvcs.git import GIT
+  cmd = [GIT, 'log', '-z', '--pretty=format:%H%n%P%n%ai%n%an <%ae>%n%B',
+         '--encoding=none', '--skip=%d' % state['skip'], '-%d' % limit]
+  if state['firstparent']:
+    cmd.append('--first-parent')
+  if state['merges'] is not None:
+    cmd.append('--merges' if state['merges'] else '--no-merges')
+  # As for a..b, the excluded commits come first.
+  cmd.extend('^' + x for x in state['exclude'])
+  cmd.extend(state['heads'])
+  if state['path']:
+    cmd.extend(['--', type(vcsrepo).cleanPath(state['path'])])
+  output = command(cmd, cwd=vcsrepo.path)
+  entries = []
+  for log in output.decode(vcsrepo.encoding, 'replace').split('\0'):
+    if not log:
+      continue
+    rev, parents, date, author, message = log.split('\n', 4)
+    entries.append(CommitLogEntry(rev, parents.split(), parse_isodate(date),
+                                  author, message))
+  return entries
+
+
+def _git_page(repo, state, limit):
+  vcsrepo = repo.repo
+  if 'heads' not in state:
+    start, end = _split_revrange(state['revrange'])
+    if start is not None and end is None:
+      end = 'HEAD'  # As in git, a..
+    if vcsrepo.empty():
+      return [], None
+    state['heads'] = (_git_commits(vcsrepo, '--all') if end is None else
+                      _git_commits(vcsrepo, end))
+    state['exclude'] = [] if start is None else _git_commits(vcsrepo, start)
+    state['skip'] = 0
+  # One more entry tells whether there is another page.
+  entries = _git_log(vcsrepo, state, limit + 1)
+  if len(entries) <= limit:
+    return entries, None
+  if state['firstparent'] and len(state['heads']) == 1:
+    state['heads'] = [entries[limit].rev]
+    state['skip'] = 0
+  else:
+    state['skip'] += limit
+  return entries[:limit], state
+
+
+def _hg_page(repo, state, limit):
+  from anyvcs.hg import HG, parse_hgdate
+  vcsrepo = repo.repo
+  if 'end' not in state:
+    start, end = _split_revrange(state['revrange'])
+    state['base'] = None if start is None else vcsrepo.canonical_rev(start)
+    state['end'] = None if end is None else vcsrepo.canonical_rev(end)
+  revset = 'all()'
+  if state['end']:
+    revset = 'ancestors(%s)' % state['end']
+  if state['base']:
+    if state['end']:
+      revset += ' - ancestors(%s)' % state['base']
+    else:
+      revset = 'descendants(%s)' % state['base']
+  if state.get('last'):
+    revset = '(%s) and (:%s - %s)' % (revset, state['last'], state['last'])
+  cmd = [HG, 'log', '--debug', '-l', str(limit), '-r',
+         'sort(%s, -rev)' % revset,
+         '--template={node}\\0{parents}\\0{date|hgdate}\\0{author|nonempty}'
+         '\\0{desc|tabindent|nonempty}\\0\\0']
+  if state['firstparent']:
+    cmd.append('--follow-first')
+  if state['merges'] is not None:
+    cmd.append('--only-merges' if state['merges'] else '--no-merges')
+  if state['path']:
+    cmd.extend(['--', type(vcsrepo).cleanPath(state['path'])])
+  output = command(cmd, cwd=vcsrepo.path).decode(vcsrepo.encoding, 'replace')
+  entries = []
+  for log in output.split('\0\0')[:-1]:
+    rev, parents, date, author, message = log.split('\0', 4)
+    parents = [x.split(':')[1] for x in parents.split()
+               if not x.startswith('-1:')]
+    message = message.replace('\n\t', '\n')
+    entries.append(CommitLogEntry(rev, parents, parse_hgdate(date), author,
+                                  message))
+  if len(entries) < limit:
+    return entries, None
+  state['last'] = entries[-1].rev
+  return entries, state
+
+
+def _svn_history(vcsrepo, rev, path, limit):
+  '''Return up to `limit` ``(rev, path)`` entries of the history of `path`.'''
+  from anyvcs.svn import SVNLOOK
+  cmd = [SVNLOOK, 'history', '.', '-r', str(rev), path, '-l', str(limit)]
+  output = command(cmd, cwd=vcsrepo.path).decode(vcsrepo.encoding, 'replace')
+  result = []
+  for line in output.splitlines()[2:]:
+    rev, path = line.split(None, 1)
+    result.append([int(rev), path])
+  return result
+
+
+def _svn_history_page(repo, state, limit):
+  vcsrepo = repo.repo
+  if 'next' not in state:
+    path = '/' + type(vcsrepo).cleanPath(state['path'] or '')
+    state['next'] = [vcsrepo.youngest(), path]
+  merges = state['merges']
+  entries = []
+  while state['next'] is not None and len(entries) < limit:
+    rev, path = state['next']
+    count = limit - len(entries)
+    # One more entry is where the next page starts.
+    history = _svn_history(vcsrepo, rev, path, count + 1)
+    state['next'] = history[count] if len(history) > count else None
+    for rev, path in history[:count]:
+      # This is how anyvcs makes the entries of a log without a revision range.
+      entry = vcsrepo._logentry(rev, path)
+      if merges is None or merges == (len(entry.parents) > 1):
+        entries.append(entry)
+  if state['next'] is None:
+    return entries, None
+  return entries, state
+
+
+def _svn_page(repo, state, limit):
+  vcsrepo = repo.repo
+  if state['revrange'] is None:
+    return _svn_history_page(repo, state, limit)
+  if 'youngest' not in state:
+    _split_revrange(state['revrange'])
+    state['youngest'] = vcsrepo.youngest()
+    state['seen'] = 0
+  # Entries newer than the first page are skipped, so ask for more of them.
+  seen = state['seen']
+  extra = vcsrepo.youngest() - state['youngest']
+  entries = vcsrepo.log(revrange=state['revrange'], limit=seen + limit + extra,
+                        firstparent=state['firstparent'],
+                        merges=state['merges'], path=state['path'])
+  entries = [x for x in entries if x.rev <= state['youngest']][seen:]
+  entries = entries[:limit]
+  if len(entries) < limit:
+    return entries, None
+  state['seen'] = seen + len(entries)
+  return entries, state
+
+
+def log_page(repo, limit, cursor=None, revrange=None, firstparent=False,
+             merges=None, path=None):
+  '''
+  Return up to `limit` log entries of `repo` and the cursor of the next page,
+  or None after the last page.  The other arguments are those of ``log()``,
+  and are ignored when resuming from `cursor`.
+  '''
+  if cursor is None:
+    state = {
+      'vcs': repo.vcs,
+      'revrange': revrange,
+      'firstparent': firstparent,
+      'merges': merges,
+      'path': path,
+    }
+  else:
+    state = decode_cursor(cursor, repo.vcs)
+  if int(limit) < 1:
+    raise ValueError('limit must be positive')
+  page = {'git': _git_page, 'hg': _hg_page, 'svn': _svn_page}[repo.vcs]
+  entries, state = page(repo, state, int(limit))
+  return entries, encode_cursor(state) if state else None
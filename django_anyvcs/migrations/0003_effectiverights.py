@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_anyvcs', '0002_repo_disk_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectiveRights',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('repo_id', models.IntegerField()),
+                ('user_id', models.IntegerField(db_index=True)),
+                ('rights', models.CharField(max_length=2, choices=[('-', 'Deny'), ('r', 'Read-Only'), ('rw', 'Read-Write')])),
+            ],
+            options={
+                'db_table': 'anyvcs_effectiverights',
+                'verbose_name': 'Effective Access Rights',
+                'verbose_name_plural': 'Effective Access Rights',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='effectiverights',
+            unique_together=set([('repo_id', 'user_id')]),
+        ),
+    ]
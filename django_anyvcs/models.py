@@ -30,8 +30,7 @@
 from django.db import models
 from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.core.exceptions import ValidationError
-from . import settings
-import anyvcs
+from . import accesscache, effectiverights, handles, settings
 import os
 import re
 import shutil
@@ -121,6 +120,7 @@ class Repo(models.Model):
 
   def __init__(self, *args, **kwargs):
     super(Repo, self).__init__(*args, **kwargs)
+    self._old_name = self.name
     self._old_path = self.path
 
   def __unicode__(self):
@@ -132,11 +132,7 @@ class Repo(models.Model):
 
   @property
   def repo(self):
-    try:
-      return self._repo
-    except AttributeError:
-      self._repo = anyvcs.open(self.abspath, self.vcs)
-      return self._repo
+    return handles.open(self.abspath, self.vcs)
 
   @property
   def public_rights(self):
@@ -179,21 +175,31 @@ class Repo(models.Model):
   def post_save(self, created, **kwargs):
     if created:
       makedirs(self.abspath)
-      self._repo = anyvcs.create(self.abspath, self.vcs)
+      handles.create(self.abspath, self.vcs)
       self.recalculate_disk_size()
     elif self._old_path != self.path:
       makedirs(os.path.dirname(self.abspath))
       old_abspath = os.path.join(settings.VCSREPO_ROOT, self._old_path)
+      handles.evict(old_abspath)
       shutil.move(old_abspath, self.abspath)
       if not os.path.isabs(self._old_path):
         removedirs(os.path.dirname(old_abspath), settings.VCSREPO_ROOT)
     self._old_path = self.path
+    # UserRights and GroupRights save their repo, so this also covers changes
+    # in rights.
+    accesscache.invalidate(repo=self.name)
+    if self._old_name != self.name:
+      accesscache.invalidate(repo=self._old_name)
+      self._old_name = self.name
     if self.vcs == 'svn':
       self.update_svnserve()
     if created:  # To save the disk size to the database.
       self.save()
 
   def post_delete(self, **kwargs):
+    accesscache.invalidate(repo=self.name)
+    effectiverights.remove(repo_ids=[self.pk])
+    handles.evict(self.abspath)
     try:
       shutil.rmtree(self.abspath)
       removedirs(os.path.dirname(self.abspath), settings.VCSREPO_ROOT)
@@ -286,20 +292,39 @@ class Repo(models.Model):
         authz.write('* = r\n')
 
   def recalculate_disk_size(self):
-    disk_size = 0
-    for dirpath, dirnames, filenames in os.walk(self.abspath, topdown=True):
-      if settings.VCSREPO_IGNORE_PRIVATE:
-        dirnames[:] = [d for d in dirnames if d != '.private']
-      for f in filenames:
-        abspath = os.path.join(dirpath, f)
-        disk_size += os.path.getsize(abspath)
-    self.disk_size = disk_size
+    self.disk_size = settings.VCSREPO_DISK_SIZE_FUNCTION(self)
 
 # Repo signals
 post_save.connect(post_save_proxy, dispatch_uid=__name__, sender=Repo)
 post_delete.connect(post_delete_proxy, dispatch_uid=__name__, sender=Repo)
 
 
+class EffectiveRights(models.Model):
+  # Plain columns rather than foreign keys, so that rows recalculated while a
+  # repository or user is being deleted cannot violate constraints; they are
+  # removed afterwards by the post_delete handlers.
+  repo_id = models.IntegerField()
+  user_id = models.IntegerField(
+    db_index=True,
+  )
+  rights = models.CharField(
+    max_length=2,
+    choices=RIGHTS_CHOICES,
+  )
+
+  class Meta:
+    db_table = 'anyvcs_effectiverights'
+    unique_together = ('repo_id', 'user_id')
+    verbose_name = 'Effective Access Rights'
+    verbose_name_plural = 'Effective Access Rights'
+
+  def __unicode__(self):
+    return u'%s/%s' % (self.repo_id, self.user_id)
+
+
+if settings.VCSREPO_MATERIALIZE_RIGHTS:
+  effectiverights.check_models()
+
 if settings.VCSREPO_USE_USER_RIGHTS:
   class UserRights(models.Model):
     repo = models.ForeignKey(
@@ -334,11 +359,13 @@ if settings.VCSREPO_USE_USER_RIGHTS:
       return u'%s/%s' % (self.repo, self.user)
 
     def post_save(self, created, **kwargs):
+      effectiverights.update(repo_ids=[self.repo_id])
       self.repo.update_svnserve()
       self.repo.last_modified = self.last_modified
       self.repo.save()
 
     def post_delete(self, **kwargs):
+      effectiverights.update(repo_ids=[self.repo_id])
       try:
         self.repo.update_svnserve()
         self.repo.last_modified = self.last_modified
@@ -386,11 +413,13 @@ if settings.VCSREPO_USE_GROUP_RIGHTS:
       return u'%s/%s' % (self.repo, self.group)
 
     def post_save(self, created, **kwargs):
+      effectiverights.update(repo_ids=[self.repo_id])
       self.repo.update_svnserve()
       self.repo.last_modified = self.last_modified
       self.repo.save()
 
     def post_delete(self, **kwargs):
+      effectiverights.update(repo_ids=[self.repo_id])
       try:
         self.repo.update_svnserve()
         self.repo.last_modified = self.last_modified
@@ -410,10 +439,46 @@ if settings.VCSREPO_USE_GROUP_RIGHTS:
     from django.contrib.auth.models import User
 
     def group_member_changed(instance, action, **kwargs):
+      pk_set = kwargs.get('pk_set')
+      if action == 'pre_clear' and not kwargs.get('reverse'):
+        # pk_set is None when clearing, so remember the user's groups until
+        # post_clear
+        instance._anyvcs_cleared_groups = list(
+          instance.groups.values_list('pk', flat=True))
+      elif action == 'post_clear' and not kwargs.get('reverse'):
+        pk_set = instance.__dict__.pop('_anyvcs_cleared_groups', None)
       if action.startswith('post_'):
-        qs = GroupRights.objects.filter(group=instance, repo__vcs='svn')
-        for gr in qs.select_related('repo'):
+        if kwargs.get('reverse'):
+          qs = GroupRights.objects.filter(group=instance)
+        else:
+          # instance is a user, and pk_set holds the groups
+          qs = GroupRights.objects.filter(group__in=pk_set or ())
+        for gr in qs.filter(repo__vcs='svn').select_related('repo'):
           gr.repo.update_svnserve()
+        if not kwargs.get('reverse'):
+          if pk_set:
+            repos = GroupRights.objects.filter(group__in=pk_set)
+            effectiverights.update(repo_ids=repos.values('repo'),
+                                   user_ids=[instance.pk])
+          else:
+            effectiverights.update(user_ids=[instance.pk])
+        else:
+          repos = GroupRights.objects.filter(group=instance)
+          effectiverights.update(repo_ids=repos.values('repo'),
+                                 user_ids=pk_set)
+        if not kwargs.get('reverse'):
+          accesscache.invalidate(username=instance.username)
+        elif pk_set:
+          users = User.objects.filter(pk__in=pk_set)
+          for username in users.values_list('username', flat=True):
+            accesscache.invalidate(username=username)
+        else:
+          accesscache.invalidate()
 
     m2m_changed.connect(group_member_changed, dispatch_uid=__name__,
                         sender=User.groups.through)
+
+    def user_deleted(instance, **kwargs):
+      effectiverights.remove(user_ids=[instance.pk])
+
+    post_delete.connect(user_deleted, dispatch_uid=__name__, sender=User)
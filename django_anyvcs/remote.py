@@ -27,12 +27,34 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-import httplib
+import collections
+import contextlib
+import errno
+import hashlib
+import io
 import json
-from urlparse import urlparse
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
 from anyvcs.common import (PathDoesNotExist, BadFileType, attrdict,
                            CommitLogEntry)
 
+# Python 3 compatibility, so that aioremote can share this module.
+try:
+  import httplib
+  from urllib import urlencode
+  from urlparse import urlparse
+except ImportError:
+  import http.client as httplib
+  from urllib.parse import urlencode, urlparse
+try:
+  basestring
+except NameError:
+  basestring = unicode = str
+
 
 class BadResponse(Exception):
   def __init__(self, status, reason, content_type, body=None):
@@ -46,47 +68,719 @@ class BadResponse(Exception):
       self.status, self.reason, self.content_type)
 
 
+def iter_lines(f, bufsize=65536):
+  '''Yield the non-empty lines read from the file-like object `f`.'''
+  buf = b''
+  while True:
+    chunk = f.read(bufsize)
+    if not chunk:
+      break
+    lines = (buf + chunk).split(b'\n')
+    buf = lines.pop()
+    for line in lines:
+      if line:
+        yield line
+  if buf:
+    yield buf
+
+
+# Defaults of the connection pools made by VCSRepo.
+POOL_SIZE = 8
+POOL_IDLE_TIMEOUT = 60
+
+# Errors which mean that the server closed a kept alive connection.
+STALE_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+class ConnectionPool(object):
+  '''
+  A thread-safe pool of keep-alive connections to one host.  At most `size`
+  connections are open at once, and idle connections are closed after
+  `idle_timeout` seconds.
+  '''
+
+  def __init__(self, netloc, size=None, idle_timeout=None,
+               timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+    self.netloc = netloc
+    self.size = size or POOL_SIZE
+    self.idle_timeout = idle_timeout or POOL_IDLE_TIMEOUT
+    self.timeout = timeout
+    self._idle = []
+    self._lock = threading.Lock()
+    self._slots = threading.BoundedSemaphore(self.size)
+
+  def reap(self):
+    '''Close connections which have been idle for too long.'''
+    expired = time.time() - self.idle_timeout
+    with self._lock:
+      stale = [conn for conn, used in self._idle if used < expired]
+      self._idle = [(conn, used) for conn, used in self._idle
+                    if used >= expired]
+    for conn in stale:
+      conn.close()
+
+  def close(self):
+    '''Close all idle connections.'''
+    with self._lock:
+      idle, self._idle = self._idle, []
+    for conn, used in idle:
+      conn.close()
+
+  def _get(self):
+    self.reap()
+    with self._lock:
+      if self._idle:
+        return self._idle.pop()[0], True
+    return httplib.HTTPConnection(self.netloc, timeout=self.timeout), False
+
+  def _put(self, conn):
+    with self._lock:
+      self._idle.append((conn, time.time()))
+
+  def _send(self, conn, method, url, body, headers):
+    conn.request(method, url, body, headers)
+    return conn.getresponse()
+
+  @contextlib.contextmanager
+  def response(self, method, url, body=None, headers={}, idempotent=True):
+    '''
+    Send a request and return its response.  The connection goes back to the
+    pool when the block ends, if the response has been read.  Idempotent
+    requests which fail because the server closed a reused connection are
+    sent again on a new one.
+    '''
+    self._slots.acquire()
+    try:
+      conn, reused = self._get()
+      try:
+        response = self._send(conn, method, url, body, headers)
+      except (httplib.BadStatusLine, httplib.CannotSendRequest,
+              socket.error) as e:
+        conn.close()
+        http_error = isinstance(e, httplib.HTTPException)
+        stale = http_error or getattr(e, 'errno', None) in STALE_ERRNOS
+        if not (reused and stale and idempotent):
+          raise
+        conn = httplib.HTTPConnection(self.netloc, timeout=self.timeout)
+        response = self._send(conn, method, url, body, headers)
+      try:
+        yield response
+      finally:
+        if response.isclosed() and not response.will_close:
+          self._put(conn)
+        else:
+          conn.close()
+    finally:
+      self._slots.release()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def connection_pool(netloc):
+  '''Return the connection pool shared by repositories on `netloc`.'''
+  with _pools_lock:
+    try:
+      return _pools[netloc]
+    except KeyError:
+      pool = _pools[netloc] = ConnectionPool(netloc)
+      return pool
+
+
+hash_rx = re.compile(r'^[0-9a-f]{40}$')
+svn_rev_rx = re.compile(r'^(?:[^:]*:)?\d+$')
+
+# Revision arguments of the attributes whose results can be cached, by
+# ResultCache here and by the server's apicache.
+REVISION_ARGS = {
+  'ls': ('rev',),
+  'cat': ('rev',),
+  'readlink': ('rev',),
+  'log': ('revrange',),
+  'diff': ('rev_a', 'rev_b'),
+  'ancestor': ('rev1', 'rev2'),
+  'proplist': ('rev',),
+  'propget': ('rev',),
+}
+
+
+def is_immutable(vcs, rev):
+  '''Return whether `rev` names a fixed revision, without asking the server.'''
+  if isinstance(rev, bool):
+    return False
+  if vcs == 'svn' and isinstance(rev, int):
+    return True
+  rx = svn_rev_rx if vcs == 'svn' else hash_rx
+  return isinstance(rev, basestring) and bool(rx.match(rev))
+
+
+def encode_result(attr, data):
+  '''
+  Encode the result of `attr`, as received from the server, for ResultCache.
+  Results are stored as JSON, or as the raw contents for ``cat``, so that
+  reading a shared cache directory cannot run code.
+  '''
+  if attr == 'cat':
+    return data if isinstance(data, bytes) else data.encode('utf-8')
+  return json.dumps(data).encode('utf-8')
+
+
+def decode_result(attr, data):
+  '''Return the result encoded by `encode_result`.'''
+  if attr == 'cat':
+    return data
+  return json.loads(data.decode('utf-8'))
+
+
+class ResultCache(object):
+  '''
+  A cache of results which cannot change, for ``VCSRepo(cache=...)``.  Up to
+  `max_bytes` of encoded results are kept in memory, and the least recently
+  used ones are dropped.  If `path` is given, results are also written to
+  that directory, up to `max_disk_bytes`, so that other processes and later
+  runs can use them.
+  '''
+
+  def __init__(self, max_bytes=64 * 1024 * 1024, path=None,
+               max_disk_bytes=1024 * 1024 * 1024):
+    self.max_bytes = max_bytes
+    self.path = path
+    self.max_disk_bytes = max_disk_bytes
+    self.hits = self.disk_hits = self.misses = 0
+    self._entries = collections.OrderedDict()
+    self._size = 0
+    self._lock = threading.Lock()
+    if path is not None:
+      if not os.path.isdir(path):
+        os.makedirs(path)
+      self._disk_size = sum(size for name, size, mtime in self._files())
+
+  def stats(self):
+    '''Return the numbers of hits and misses, and the size in memory.'''
+    with self._lock:
+      return {
+        'hits': self.hits,
+        'disk_hits': self.disk_hits,
+        'misses': self.misses,
+        'entries': len(self._entries),
+        'bytes': self._size,
+      }
+
+  def _remember(self, key, data):
+    old = self._entries.pop(key, None)
+    if old is not None:
+      self._size -= len(old)
+    if len(data) > self.max_bytes:
+      return
+    self._entries[key] = data
+    self._size += len(data)
+    while self._size > self.max_bytes:
+      self._size -= len(self._entries.popitem(last=False)[1])
+
+  def _filename(self, key):
+    return os.path.join(self.path,
+                        hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+  def _files(self):
+    for name in os.listdir(self.path):
+      if name.startswith('.'):
+        continue
+      try:
+        st = os.stat(os.path.join(self.path, name))
+      except OSError:
+        continue
+      yield name, st.st_size, st.st_mtime
+
+  def _trim_disk(self):
+    files = sorted(self._files(), key=lambda x: x[2])
+    self._disk_size = sum(size for name, size, mtime in files)
+    for name, size, mtime in files:
+      if self._disk_size <= self.max_disk_bytes:
+        break
+      try:
+        os.unlink(os.path.join(self.path, name))
+      except OSError:
+        pass
+      self._disk_size -= size
+
+  def get(self, key):
+    '''Return the data stored for `key`, or None.'''
+    with self._lock:
+      data = self._entries.pop(key, None)
+      if data is not None:
+        self._entries[key] = data
+        self.hits += 1
+        return data
+    if self.path is not None:
+      filename = self._filename(key)
+      try:
+        with open(filename, 'rb') as f:
+          data = f.read()
+        os.utime(filename, None)
+      except (IOError, OSError):
+        data = None
+      if data is not None:
+        with self._lock:
+          self.hits += 1
+          self.disk_hits += 1
+          self._remember(key, data)
+        return data
+    with self._lock:
+      self.misses += 1
+    return None
+
+  def set(self, key, data):
+    '''Store the bytes `data` for `key`.'''
+    with self._lock:
+      self._remember(key, data)
+    if self.path is None or len(data) > self.max_disk_bytes:
+      return
+    fd, tmp = tempfile.mkstemp(prefix='.', dir=self.path)
+    with os.fdopen(fd, 'wb') as f:
+      f.write(data)
+    os.rename(tmp, self._filename(key))
+    with self._lock:
+      self._disk_size += len(data)
+      if self._disk_size > self.max_disk_bytes:
+        self._trim_disk()
+
+
+def raise_error(data):
+  '''Raise the anyvcs exception described by the error `data`, if known.'''
+  if data.get('module') == 'anyvcs.common':
+    klass = data.get('class')
+    args = data.get('args', [])
+    if klass == 'BadFileType':
+      raise BadFileType(*args)
+    if klass == 'PathDoesNotExist':
+      raise PathDoesNotExist(*args)
+
+
+class Future(object):
+  '''The result of a call in a `Batch`, available once the batch is sent.'''
+
+  def __init__(self):
+    self._done = False
+    self._result = None
+    self._exception = None
+
+  def _set(self, call):
+    try:
+      self._result = call()
+    except Exception as e:
+      self._exception = e
+    self._done = True
+
+  def done(self):
+    return self._done
+
+  def result(self):
+    '''Return the result of the call, or raise its exception.'''
+    if not self._done:
+      raise RuntimeError('The batch has not been sent')
+    if self._exception is not None:
+      raise self._exception
+    return self._result
+
+  def exception(self):
+    if not self._done:
+      raise RuntimeError('The batch has not been sent')
+    return self._exception
+
+
+class Batch(object):
+  '''
+  Calls on a repository which are sent in one request to the ``batch-call``
+  view.  The methods mirror those of `VCSRepo` but return a `Future`.  The
+  batch is sent when the ``with`` block ends without an exception, or by
+  `send`.  Results of ``cat`` are decoded as UTF-8 by the server, so binary
+  files are better read with ``VCSRepo.cat``.
+  '''
+
+  def __init__(self, repo):
+    self._repo = repo
+    self._calls = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.send()
+
+  def _add(self, attr, kwargs, convert, fallback):
+    future = Future()
+    key = self._repo._cache_key(attr, kwargs)
+    if key is not None:
+      data = self._repo._cache.get(key)
+      if data is not None:
+        result = decode_result(attr, data)
+        future._set(lambda: convert(result) if convert else result)
+        return future
+    self._calls.append((attr, kwargs, convert, fallback, key, future))
+    return future
+
+  def send(self):
+    '''Send the calls made since the last time, and set their futures.'''
+    calls, self._calls = self._calls, []
+    if not calls:
+      return
+    repo = self._repo
+    url = repo._path + 'batch-call'
+    body = json.dumps([{'attr': attr, 'kwargs': kwargs}
+                       for attr, kwargs, _, _, _, _ in calls])
+    headers = {'Content-Type': 'application/json'}
+    try:
+      results = repo._request('POST', url, body, headers)
+    except BadResponse as e:
+      if e.status != 404 or e.content_type == 'text/plain':
+        raise
+      # The server predates the batch-call view.
+      for attr, kwargs, convert, fallback, key, future in calls:
+        future._set(fallback)
+      return
+    for call, data in zip(calls, results):
+      attr, kwargs, convert, fallback, key, future = call
+
+      def result():
+        if 'error' in data:
+          raise_error(data['error'])
+          raise BadResponse(200, data['error'].get('class'),
+                            'application/json', json.dumps(data['error']))
+        return convert(data['result']) if convert else data['result']
+      future._set(result)
+      if key is not None and 'error' not in data:
+        repo._cache.set(key, encode_result(attr, data['result']))
+
+  def ls(self, rev, path, recursive=False, recursive_dirs=False,
+         directory=False, report=[]):
+    if isinstance(report, (tuple, list)):
+      report = ','.join(report)
+    kwargs = dict(rev=rev, path=path, recursive=recursive,
+                  recursive_dirs=recursive_dirs, directory=directory,
+                  report=report)
+    return self._add('ls', kwargs, ls_result,
+                     lambda: self._repo.ls(**kwargs))
+
+  def cat(self, rev, path):
+    def convert(result):
+      # Cached results are already bytes.
+      if isinstance(result, bytes):
+        return result
+      return result.encode('utf-8')
+    return self._add('cat', dict(rev=rev, path=path), convert,
+                     lambda: self._repo.cat(rev, path))
+
+  def readlink(self, rev, path):
+    return self._add('readlink', dict(rev=rev, path=path), None,
+                     lambda: self._repo.readlink(rev, path))
+
+  def branches(self):
+    return self._add('branches', {}, None, self._repo.branches)
+
+  def tags(self):
+    return self._add('tags', {}, None, self._repo.tags)
+
+  def heads(self):
+    return self._add('heads', {}, None, self._repo.heads)
+
+  def empty(self):
+    return self._add('empty', {}, None, self._repo.empty)
+
+  def log(self, revrange=None, limit=None, firstparent=False, merges=None,
+          path=None, follow=False):
+    kwargs = dict(revrange=revrange, limit=limit, firstparent=firstparent,
+                  merges=merges, path=path, follow=follow)
+    return self._add('log', kwargs, log_result,
+                     lambda: self._repo.log(**kwargs))
+
+  def diff(self, rev_a, rev_b, path=None):
+    kwargs = dict(rev_a=rev_a, rev_b=rev_b, path=path)
+    return self._add('diff', kwargs, None, lambda: self._repo.diff(**kwargs))
+
+  def ancestor(self, rev1, rev2):
+    return self._add('ancestor', dict(rev1=rev1, rev2=rev2), None,
+                     lambda: self._repo.ancestor(rev1, rev2))
+
+  def bookmarks(self):
+    return self._add('bookmarks', {}, None, lambda: self._repo.bookmarks())
+
+  def proplist(self, rev, path=None):
+    return self._add('proplist', dict(rev=rev, path=path), None,
+                     lambda: self._repo.proplist(rev, path))
+
+  def propget(self, prop, rev, path=None):
+    kwargs = dict(prop=prop, rev=rev, path=path)
+    return self._add('propget', kwargs, None,
+                     lambda: self._repo.propget(**kwargs))
+
+  def youngest(self):
+    return self._add('youngest', {}, None, lambda: self._repo.youngest())
+
+
+def encode_revrange(revrange):
+  '''
+  Encode a ``(rev1, rev2)`` revrange as the ``[rev1, rev2]`` list which the
+  server passes on to anyvcs.
+  '''
+  if isinstance(revrange, tuple):
+    return list(revrange)
+  return revrange
+
+
+def log_entry(data):
+  '''Make a CommitLogEntry, ignoring private attributes sent by the server.'''
+  return CommitLogEntry(**dict((k, v) for k, v in data.items()
+                               if not k.startswith('_')))
+
+
+def log_result(result):
+  '''Convert a ``log`` result, which is one entry or a list of them.'''
+  if isinstance(result, list):
+    return [log_entry(x) for x in result]
+  return log_entry(result)
+
+
+def ls_result(result):
+  return [attrdict(x) for x in result]
+
+
+class RemoteFile(io.RawIOBase):
+  '''
+  The contents of a file, read from the ``cat-raw`` view as they are needed.
+
+  Seeking ends the current response, and the next read asks for the rest of
+  the file from the new position with a ``Range`` header.  The file has a
+  connection of its own, so that holding it open does not take one from the
+  repository's pool.
+  '''
+
+  def __init__(self, repo, rev, path):
+    io.RawIOBase.__init__(self)
+    if isinstance(path, unicode):
+      path = path.encode('utf-8')
+    self._repo = repo
+    self._url = repo._path + 'cat-raw?' + urlencode({'rev': rev, 'path': path})
+    self._conn = httplib.HTTPConnection(repo._pool.netloc,
+                                        timeout=repo._pool.timeout)
+    self._response = None
+    self._pos = 0
+    self.size = None
+    self._open()
+
+  def _getresponse(self, headers):
+    try:
+      self._conn.request('GET', self._url, headers=headers)
+      return self._conn.getresponse()
+    except Exception:
+      self._conn.close()
+      raise
+
+  def _end_response(self):
+    if self._response is not None:
+      if not self._response.isclosed():
+        # The rest of the response is not wanted, so the connection cannot
+        # be reused.
+        self._conn.close()
+      self._response = None
+
+  def _open(self, byte_range=None):
+    '''Request the contents from the current position.'''
+    self._end_response()
+    headers = {}
+    if byte_range is not None:
+      headers['Range'] = 'bytes=%s' % byte_range
+    elif self._pos:
+      headers['Range'] = 'bytes=%d-' % self._pos
+    response = self._getresponse(headers)
+    if response.status == 206:
+      content_range = response.getheader('Content-Range')
+      self.size = int(content_range.rsplit('/', 1)[1])
+    elif response.status == 200:
+      length = response.getheader('Content-Length')
+      if length is not None:
+        self.size = int(length)
+      if self._pos and byte_range is None:
+        # The server ignored the range; skip to the position.
+        remaining = self._pos
+        while remaining > 0:
+          chunk = response.read(min(remaining, 65536))
+          if not chunk:
+            break
+          remaining -= len(chunk)
+    elif response.status == 416:
+      # The position is at or past the end of the file.
+      content_range = response.getheader('Content-Range')
+      self.size = int(content_range.rsplit('/', 1)[1])
+      response.read()
+      return
+    else:
+      try:
+        self._repo._getresponse(response)
+      finally:
+        self._conn.close()
+      raise BadResponse(response.status, response.reason,
+                        response.getheader('Content-Type'))
+    self._response = response
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def readinto(self, b):
+    if self._response is None:
+      if self.size is not None and self._pos >= self.size:
+        return 0
+      self._open()
+      if self._response is None:
+        return 0
+    data = self._response.read(len(b))
+    n = len(data)
+    if n == 0:
+      self._end_response()
+      self.size = self._pos
+      return 0
+    b[:n] = data
+    self._pos += n
+    return n
+
+  def tell(self):
+    return self._pos
+
+  def seek(self, offset, whence=io.SEEK_SET):
+    if whence == io.SEEK_CUR:
+      offset += self._pos
+    elif whence == io.SEEK_END:
+      if self.size is None:
+        # Ask for the first byte to learn the size.
+        pos = self._pos
+        self._open('0-0')
+        self._end_response()
+        self._pos = pos
+      offset += self.size
+    elif whence != io.SEEK_SET:
+      raise ValueError('invalid whence: %r' % (whence,))
+    if offset < 0:
+      raise ValueError('negative seek position %d' % offset)
+    if offset != self._pos:
+      self._end_response()
+      self._pos = offset
+    return self._pos
+
+  def close(self):
+    if not self.closed:
+      self._end_response()
+      self._conn.close()
+    io.RawIOBase.close(self)
+
+
 class VCSRepo(object):
-  def __init__(self, api_url):
+  vcs = None
+
+  def __init__(self, api_url, pool=None, cache=None):
     url = urlparse(api_url)
     assert url.scheme == 'http'
     self._url = url
-    self._conn = httplib.HTTPConnection(url.netloc)
+    self._pool = pool or connection_pool(url.netloc)
     self._path = url.path.rstrip('/') + '/'
+    self._cache = cache
+
+  def _cache_key(self, attr, kwargs):
+    '''Return the cache key of a call, or None if its result may change.'''
+    if self._cache is None or self.vcs is None:
+      return None
+    for name in REVISION_ARGS.get(attr, ()):
+      rev = kwargs[name]
+      if name == 'revrange':
+        revs = list(rev) if isinstance(rev, (tuple, list)) else [rev]
+        # A range must have a fixed end; (rev, None) means up to the heads.
+        if revs[-1] is None:
+          return None
+        revs = [r for r in revs if r is not None]
+      else:
+        revs = [rev]
+      if not all(is_immutable(self.vcs, r) for r in revs):
+        return None
+    data = [self._url.netloc, self._path, attr, kwargs]
+    return json.dumps(data, sort_keys=True)
+
+  def _cached(self, attr, kwargs, call, convert=None):
+    '''
+    Return the result of `call()` passed through `convert`.  The result is
+    taken from or kept in the cache if it cannot change.
+    '''
+    key = self._cache_key(attr, kwargs)
+    if key is None:
+      result = call()
+    else:
+      data = self._cache.get(key)
+      if data is not None:
+        result = decode_result(attr, data)
+      else:
+        result = call()
+        self._cache.set(key, encode_result(attr, result))
+    return convert(result) if convert else result
+
+  def _request(self, method, url, body=None, headers={}, **kwargs):
+    with self._pool.response(method, url, body, headers) as response:
+      return self._getresponse(response, **kwargs)
 
-  def _getresponse(self):
-    response = self._conn.getresponse()
+  def _getresponse(self, response, raw=False):
     ct = response.getheader('Content-Type')
+    if response.status == 200 and ct == 'application/x-ndjson':
+      return [json.loads(line) for line in iter_lines(response)]
     body = response.read()
     if response.status == 200:
+      if raw:
+        return body
       if ct == 'application/json':
         data = json.loads(body)
         return data
     if response.status == 400:
       if ct == 'application/json':
-        data = json.loads(body)
-        if data.get('module') == 'anyvcs.common':
-          klass = data.get('class')
-          args = data.get('args', [])
-          if klass == 'BadFileType':
-            raise BadFileType(*args)
-          if klass == 'PathDoesNotExist':
-            raise PathDoesNotExist(*args)
+        raise_error(json.loads(body))
     raise BadResponse(response.status, response.reason, ct, body)
 
   def _get(self, attr):
     method = 'GET'
     url = self._path + attr
-    self._conn.request(method, url)
-    return self._getresponse()
+    return self._request(method, url)
+
+  def _get_raw(self, attr, **params):
+    method = 'GET'
+    url = self._path + attr + '?' + urlencode(params)
+    return self._request(method, url, raw=True)
 
   def _post(self, attr, **kwargs):
     method = 'POST'
     url = self._path + attr
     body = json.dumps(kwargs)
     headers = {'Content-Type': 'application/json'}
-    self._conn.request(method, url, body, headers)
-    return self._getresponse()
+    return self._request(method, url, body, headers)
+
+  def _post_list(self, attr, **kwargs):
+    '''
+    Like `_post`, but ask for a list result as newline-delimited JSON, which
+    is parsed an entry at a time.
+    '''
+    method = 'POST'
+    url = self._path + attr
+    body = json.dumps(kwargs)
+    headers = {
+      'Content-Type': 'application/json',
+      'Accept': 'application/x-ndjson, application/json',
+    }
+    return self._request(method, url, body, headers)
+
+  def batch(self):
+    '''
+    Return a `Batch`, to use as ``with repo.batch() as b:``, which sends the
+    calls made on it in one request when the block ends.
+    '''
+    return Batch(self)
 
   @property
   def path(self):
@@ -96,16 +790,48 @@ class VCSRepo(object):
          directory=False, report=[]):
     if isinstance(report, (tuple, list)):
       report = ','.join(report)
-    result = self._post('ls', rev=rev, path=path, recursive=recursive,
-                        recursive_dirs=recursive_dirs, directory=directory,
-                        report=','.join(report))
-    return [attrdict(x) for x in result]
+    kwargs = dict(rev=rev, path=path, recursive=recursive,
+                  recursive_dirs=recursive_dirs, directory=directory,
+                  report=report)
+    return self._cached('ls', kwargs, lambda: self._post_list('ls', **kwargs),
+                        ls_result)
 
   def cat(self, rev, path):
-    return self._post('cat', rev=rev, path=path)
+    return self._cached('cat', dict(rev=rev, path=path),
+                        lambda: self._cat(rev, path))
+
+  def _cat(self, rev, path):
+    if isinstance(path, unicode):
+      path = path.encode('utf-8')
+    try:
+      return self._get_raw('cat-raw', rev=rev, path=path)
+    except BadResponse as e:
+      if e.status != 404 or e.content_type == 'text/plain':
+        raise
+    # The server predates the cat-raw view.
+    return self._post('cat', rev=rev, path=path).encode('utf-8')
+
+  def cat_stream(self, rev, path, buffer_size=io.DEFAULT_BUFFER_SIZE):
+    '''
+    Return a readable, seekable binary file of the contents of `path` at
+    `rev`, which are read from the server as they are needed.
+    '''
+    try:
+      raw = RemoteFile(self, rev, path)
+    except BadResponse as e:
+      if e.status != 404 or e.content_type == 'text/plain':
+        raise
+      # The server predates the cat-raw view.
+      data = self._post('cat', rev=rev, path=path)
+      if isinstance(data, unicode):
+        data = data.encode('utf-8')
+      return io.BytesIO(data)
+    return io.BufferedReader(raw, buffer_size)
 
   def readlink(self, rev, path):
-    return self._post('readlink', rev=rev, path=path)
+    kwargs = dict(rev=rev, path=path)
+    return self._cached('readlink', kwargs,
+                        lambda: self._post('readlink', **kwargs))
 
   def branches(self):
     return self._post('branches')
@@ -121,32 +847,58 @@ class VCSRepo(object):
 
   def log(self, revrange=None, limit=None, firstparent=False, merges=None,
           path=None, follow=False):
-    if isinstance(revrange, tuple):
-      revrange = ','.join(revrange)
-    result = self._post('log', revrange=revrange, limit=limit,
-                        firstparent=firstparent, merges=merges, path=path,
-                        follow=follow)
-    if isinstance(result, list):
-      return [CommitLogEntry(**x) for x in result]
-    else:
-      return CommitLogEntry(**result)
+    kwargs = dict(revrange=revrange, limit=limit, firstparent=firstparent,
+                  merges=merges, path=path, follow=follow)
+
+    def call():
+      revrange = encode_revrange(kwargs['revrange'])
+      return self._post_list('log', **dict(kwargs, revrange=revrange))
+    return self._cached('log', kwargs, call, log_result)
+
+  def log_page(self, cursor=None, limit=100, revrange=None, firstparent=False,
+               merges=None, path=None):
+    '''
+    Return up to `limit` log entries and the cursor of the next page, or None
+    after the last page.  The other arguments are ignored with a `cursor`.
+    '''
+    result = self._post('log-page', cursor=cursor, limit=limit,
+                        revrange=revrange, firstparent=firstparent,
+                        merges=merges, path=path)
+    return [log_entry(x) for x in result['log']], result['cursor']
+
+  def iter_log(self, revrange=None, firstparent=False, merges=None, path=None,
+               page_size=100):
+    '''Yield log entries, fetching `page_size` of them at a time.'''
+    entries, cursor = self.log_page(None, page_size, revrange, firstparent,
+                                    merges, path)
+    while True:
+      for entry in entries:
+        yield entry
+      if cursor is None:
+        return
+      entries, cursor = self.log_page(cursor, page_size)
 
   def diff(self, rev_a, rev_b, path=None):
-    return self._post('diff', rev_a=rev_a, rev_b=rev_b, path=path)
+    kwargs = dict(rev_a=rev_a, rev_b=rev_b, path=path)
+    return self._cached('diff', kwargs, lambda: self._post('diff', **kwargs))
 
   def ancestor(self, rev1, rev2):
-    return self._post('ancestor', rev1=rev1, rev2=rev2)
+    kwargs = dict(rev1=rev1, rev2=rev2)
+    return self._cached('ancestor', kwargs,
+                        lambda: self._post('ancestor', **kwargs))
 
 
 class GitRepo(VCSRepo):
   """Mirrors the functionality of anyvcs.git.GitRepo"""
 
-  pass
+  vcs = 'git'
 
 
 class HgRepo(VCSRepo):
   """Mirrors the functionality of anyvcs.hg.HgRepo"""
 
+  vcs = 'hg'
+
   def bookmarks(self):
     return self._post('bookmarks')
 
@@ -154,11 +906,17 @@ class HgRepo(VCSRepo):
 class SvnRepo(VCSRepo):
   """Mirrors the functionality of anyvcs.svn.SvnRepo"""
 
+  vcs = 'svn'
+
   def proplist(self, rev, path=None):
-    return self._post('proplist', rev=rev, path=path)
+    kwargs = dict(rev=rev, path=path)
+    return self._cached('proplist', kwargs,
+                        lambda: self._post('proplist', **kwargs))
 
   def propget(self, prop, rev, path=None):
-    return self._post('propget', prop=prop, rev=rev, path=path)
+    kwargs = dict(prop=prop, rev=rev, path=path)
+    return self._cached('propget', kwargs,
+                        lambda: self._post('propget', **kwargs))
 
   def youngest(self):
     return self._post('youngest')
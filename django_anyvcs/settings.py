@@ -47,7 +47,11 @@ VCSREPO_USER_MODEL = getattr(settings, 'VCSREPO_USER_MODEL',
                              getattr(settings, 'AUTH_USER_MODEL', 'auth.User'))
 VCSREPO_GROUP_MODEL = getattr(settings, 'VCSREPO_GROUP_MODEL', 'auth.Group')
 
+VCSREPO_MATERIALIZE_RIGHTS = getattr(settings, 'VCSREPO_MATERIALIZE_RIGHTS',
+                                     False)
 VCSREPO_RIGHTS_FUNCTION = getattr(settings, 'VCSREPO_RIGHTS_FUNCTION',
+                                  defaults.materialized_rights_function
+                                  if VCSREPO_MATERIALIZE_RIGHTS else
                                   defaults.rights_function)
 VCSREPO_USER_ACL_FUNCTION = getattr(settings, 'VCSREPO_USER_ACL_FUNCTION',
                                     defaults.user_acl_function
@@ -87,4 +91,27 @@ VCSREPO_URI_CONTEXT.setdefault('hostname', socket.gethostname())
 
 VCSREPO_RECALCULATE_DISK_SIZE = getattr(settings,
                                         'VCSREPO_RECALCULATE_DISK_SIZE', True)
+VCSREPO_DISK_SIZE_FUNCTION = getattr(settings, 'VCSREPO_DISK_SIZE_FUNCTION',
+                                     defaults.disk_size_function)
+VCSREPO_DEFER_DISK_SIZE = getattr(settings, 'VCSREPO_DEFER_DISK_SIZE', False)
 VCSREPO_IGNORE_PRIVATE = getattr(settings, 'VCSREPO_IGNORE_PRIVATE', True)
+VCSREPO_ACCESS_CACHE_TTL = getattr(settings, 'VCSREPO_ACCESS_CACHE_TTL', 0)
+VCSREPO_DISPATCH_MAX_PROCESSES = getattr(settings,
+                                         'VCSREPO_DISPATCH_MAX_PROCESSES', 0)
+VCSREPO_DISPATCH_MAX_REPO_PROCESSES = getattr(
+  settings, 'VCSREPO_DISPATCH_MAX_REPO_PROCESSES', 0)
+VCSREPO_DISPATCH_QUEUE_TIMEOUT = getattr(
+  settings, 'VCSREPO_DISPATCH_QUEUE_TIMEOUT', None)
+VCSREPO_GIT_BUNDLE_MIN_SIZE = getattr(settings, 'VCSREPO_GIT_BUNDLE_MIN_SIZE',
+                                      None)
+VCSREPO_GIT_BUNDLE_URI = getattr(settings, 'VCSREPO_GIT_BUNDLE_URI', None)
+VCSREPO_DISPATCH_TIMING_LOG = getattr(settings, 'VCSREPO_DISPATCH_TIMING_LOG',
+                                      None)
+VCSREPO_DISPATCH_STATSD = getattr(settings, 'VCSREPO_DISPATCH_STATSD', None)
+VCSREPO_DISPATCH_STATSD_PREFIX = getattr(
+  settings, 'VCSREPO_DISPATCH_STATSD_PREFIX', 'anyvcs.dispatch')
+VCSREPO_API_CACHE = getattr(settings, 'VCSREPO_API_CACHE', None)
+VCSREPO_API_CACHE_MAX_ENTRY_SIZE = getattr(
+  settings, 'VCSREPO_API_CACHE_MAX_ENTRY_SIZE', 1024 * 1024)
+VCSREPO_API_BATCH_THREADS = getattr(settings, 'VCSREPO_API_BATCH_THREADS', 4)
+VCSREPO_HANDLE_POOL_SIZE = getattr(settings, 'VCSREPO_HANDLE_POOL_SIZE', 128)
@@ -0,0 +1,94 @@
+# Copyright (c) 2014-2016, Clemson University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Clemson University nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Spool directories under ``VCSREPO_ROOT`` for work deferred by
+``django-anyvcs-ssh``.
+
+A spool holds one file per repository name, so scheduling the same work
+several times before it is processed only does it once.
+"""
+
+import errno
+import hashlib
+import os
+import tempfile
+
+
+def spool_path(spool):
+  from . import settings
+  return os.path.join(settings.VCSREPO_ROOT, '.%s-spool' % spool)
+
+
+def enqueue(spool, name):
+  from .models import makedirs
+  path = spool_path(spool)
+  makedirs(path)
+  filename = hashlib.sha1(name.encode('utf-8')).hexdigest()
+  fd, tmp = tempfile.mkstemp(dir=path, prefix='.tmp')
+  with os.fdopen(fd, 'wb') as f:
+    f.write(name.encode('utf-8'))
+  os.rename(tmp, os.path.join(path, filename))
+
+
+def spooled(spool):
+  '''
+  Return a list of ``(path, name)`` for every entry of a spool.  Callers
+  `claim()` the entry at `path` once they start processing it.
+  '''
+  path = spool_path(spool)
+  try:
+    filenames = sorted(os.listdir(path))
+  except OSError:
+    return []
+  result = []
+  for filename in filenames:
+    if filename.startswith('.'):
+      continue
+    entry_path = os.path.join(path, filename)
+    try:
+      with open(entry_path, 'rb') as f:
+        result.append((entry_path, f.read().decode('utf-8')))
+    except IOError:
+      pass
+  return result
+
+
+def claim(path):
+  '''
+  Remove the spool entry at `path`.  Returns False if another worker already
+  removed it, in which case that worker processes the entry.
+  '''
+  try:
+    os.unlink(path)
+  except OSError as e:
+    if e.errno != errno.ENOENT:
+      raise
+    return False
+  return True
@@ -28,26 +28,35 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from django.test import TestCase
+from django.test import LiveServerTestCase, TestCase
 from django.test.client import Client
 from django.http import Http404
 from django.contrib.auth.models import User, Group
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.core.urlresolvers import reverse
 from django.utils.encoding import DjangoUnicodeDecodeError
 from unittest import skipUnless
-from .models import Repo
+from .models import Repo, EffectiveRights
 from . import settings
-from django_anyvcs import dispatch, shortcuts
+from django_anyvcs import accesscache, apicache, bundles, dispatch, dispatchd
+from django_anyvcs import disksize
+from django_anyvcs import defaults, effectiverights, handles, limiter
+from django_anyvcs import logcursor
+from django_anyvcs import shortcuts
+from django_anyvcs import timing
+from anyvcs.common import BadFileType
 import anyvcs.git
 import anyvcs.hg
 import anyvcs.svn
+import base64
 import gzip
 import json
 import os
 import shutil
 import subprocess
+import sys
 import tempfile
+import time
 
 DEVNULL = open(os.devnull, 'wb')
 GIT = 'git'
@@ -487,6 +496,81 @@ class LookupTestCase(BaseTestCase):
         self.assertEqual(document['rights'], user_rights)
         repo.delete()
 
+  @skipUnless(
+    settings.VCSREPO_USE_GROUP_RIGHTS,
+    "not using GroupRights"
+  )
+  def test_group_rights_most_restrictive(self):
+    from .models import GroupRights
+    user = User.objects.create(username='user3')
+    groups = [Group.objects.create(name='group-%d' % i) for i in range(3)]
+    user.groups.add(*groups)
+    try:
+      for expected, granted in (('-', ('rw', '-', 'r')),
+                                ('r', ('rw', 'r', 'rw')),
+                                ('rw', ('rw', 'rw', 'rw'))):
+        repo = Repo.objects.create(name='repo', path='repo', vcs='git')
+        for group, rights in zip(groups, granted):
+          GroupRights.objects.create(repo=repo, group=group, rights=rights)
+        self.assertEqual(defaults.rights_function(repo, user), expected)
+        repo.delete()
+    finally:
+      user.delete()
+      for group in groups:
+        group.delete()
+
+  @skipUnless(
+    settings.VCSREPO_USE_USER_RIGHTS and settings.VCSREPO_USE_GROUP_RIGHTS,
+    "not using UserRights and GroupRights"
+  )
+  def test_rights_num_queries(self):
+    from .models import GroupRights
+    user = User.objects.create(username='user3')
+    groups = [Group.objects.create(name='group-%d' % i) for i in range(40)]
+    user.groups.add(*groups)
+    repo = Repo.objects.create(name='repo', path='repo', vcs='git')
+    try:
+      for group in groups:
+        GroupRights.objects.create(repo=repo, group=group, rights='rw')
+      with self.assertNumQueries(2):
+        self.assertEqual(defaults.rights_function(repo, user), 'rw')
+      client = Client()
+      url = reverse('django_anyvcs.views.access', args=(repo.name,))
+      with self.assertNumQueries(4):
+        response = client.get(url, {'u': user.username})
+      self.assertEqual(self._json(response)['rights'], 'rw')
+    finally:
+      repo.delete()
+      user.delete()
+      for group in groups:
+        group.delete()
+
+  def test_conditional_get(self):
+    from .models import UserRights
+    repo = Repo.objects.create(name='repo', path='repo', vcs='git')
+    client = Client()
+    url = reverse('django_anyvcs.views.access', args=(repo.name,))
+    response = client.get(url, {'u': self.user1.username})
+    self.assertEqual(self._json(response)['rights'], '-')
+    self.assertIn('ETag', response)
+    self.assertNotIn('Last-Modified', response)
+    etag = response['ETag']
+    response = client.get(url, {'u': self.user1.username},
+                          HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 304)
+    self.assertEqual(response.content, b'')
+    self.assertEqual(response['ETag'], etag)
+    response = client.get(url, {'u': self.user2.username},
+                          HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 304)
+    if settings.VCSREPO_USE_USER_RIGHTS:
+      UserRights.objects.create(repo=repo, user=self.user1, rights='r')
+      response = client.get(url, {'u': self.user1.username},
+                            HTTP_IF_NONE_MATCH=etag)
+      self.assertEqual(self._json(response)['rights'], 'r')
+      self.assertNotEqual(response['ETag'], etag)
+    repo.delete()
+
   def test_rights_function(self):
     repo = Repo.objects.create(
       name='repo',
@@ -511,6 +595,110 @@ class LookupTestCase(BaseTestCase):
       settings.VCSREPO_RIGHTS_FUNCTION = original_rights_function
 
 
+class BulkAccessTestCase(BaseTestCase):
+
+  def setUp(self):
+    super(BulkAccessTestCase, self).setUp()
+    self.users = [User.objects.create(username='user%d' % i)
+                  for i in range(3)]
+    self.group = Group.objects.create(name='group')
+    self.users[1].groups.add(self.group)
+    self.repos = [Repo.objects.create(name='repo%d' % i, path='repo%d' % i,
+                                      vcs=vcs, public_read=(i == 2))
+                  for i, vcs in enumerate(('git', 'hg', 'git'))]
+    if settings.VCSREPO_USE_USER_RIGHTS:
+      from .models import UserRights
+      UserRights.objects.create(repo=self.repos[0], user=self.users[0],
+                                rights='rw')
+      UserRights.objects.create(repo=self.repos[2], user=self.users[1],
+                                rights='-')
+    if settings.VCSREPO_USE_GROUP_RIGHTS:
+      from .models import GroupRights
+      GroupRights.objects.create(repo=self.repos[0], group=self.group,
+                                 rights='r')
+      GroupRights.objects.create(repo=self.repos[1], group=self.group,
+                                 rights='rw')
+    self.url = reverse('django_anyvcs.views.bulk_access')
+
+  def post(self, queries):
+    response = Client().post(self.url, json.dumps(queries),
+                             content_type='application/json')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response['Content-Type'], 'application/json')
+    if getattr(response, 'streaming', False):
+      content = b''.join(response.streaming_content)
+    else:
+      content = response.content
+    return json.loads(content.decode('ascii'))
+
+  def queries(self):
+    return [{'repo': repo.name, 'u': user and user.username}
+            for repo in self.repos for user in self.users + [None]]
+
+  def test_matches_access(self):
+    queries = self.queries()
+    records = self.post(queries)
+    self.assertEqual(len(queries), len(records))
+    client = Client()
+    for q, record in zip(queries, records):
+      url = reverse('django_anyvcs.views.access', args=(q['repo'],))
+      params = {'u': q['u']} if q['u'] else {}
+      response = client.get(url, params)
+      self.assertEqual(json.loads(response.content.decode('ascii')), record)
+
+  def test_materialized(self):
+    original_materialize = settings.VCSREPO_MATERIALIZE_RIGHTS
+    original_rights_function = settings.VCSREPO_RIGHTS_FUNCTION
+    settings.VCSREPO_MATERIALIZE_RIGHTS = True
+    settings.VCSREPO_RIGHTS_FUNCTION = defaults.materialized_rights_function
+    try:
+      effectiverights.rebuild()
+      records = self.post(self.queries())
+    finally:
+      settings.VCSREPO_MATERIALIZE_RIGHTS = original_materialize
+      settings.VCSREPO_RIGHTS_FUNCTION = original_rights_function
+    self.assertEqual(self.post(self.queries()), records)
+
+  def test_rights_function(self):
+    original_rights_function = settings.VCSREPO_RIGHTS_FUNCTION
+    settings.VCSREPO_RIGHTS_FUNCTION = lambda repo, user: 'rw'
+    try:
+      records = self.post(self.queries())
+    finally:
+      settings.VCSREPO_RIGHTS_FUNCTION = original_rights_function
+    self.assertEqual(set(['rw']), set(r['rights'] for r in records))
+
+  def test_errors(self):
+    records = self.post([
+      {'repo': 'missing'},
+      {'repo': 'repo0', 'u': 'missing'},
+      {'repo': 'repo0', 'vcs': 'hg'},
+      {'repo': 'repo0', 'vcs': 'git'},
+    ])
+    self.assertEqual(records[0],
+                     {'error': 'Repository does not exist: missing'})
+    self.assertEqual(records[1], {'error': 'User does not exist: missing'})
+    self.assertEqual(records[2], {'error': 'Repository does not exist: repo0'})
+    self.assertEqual(records[3]['path'], self.repos[0].abspath)
+
+  def test_bad_request(self):
+    client = Client()
+    for body in ('{', '{}', '[{"u": "user0"}]', '[{"repo": ["repo0"]}]',
+                 '[{"repo": "repo0", "u": ["user0"]}]'):
+      response = client.post(self.url, body, content_type='application/json')
+      self.assertEqual(response.status_code, 400)
+    self.assertEqual(client.get(self.url).status_code, 405)
+
+  def test_num_queries(self):
+    for i in range(20):
+      Repo.objects.create(name='more%d' % i, path='more%d' % i)
+    queries = [{'repo': repo.name, 'u': user.username}
+               for repo in Repo.objects.all() for user in self.users]
+    with self.assertNumQueries(5):
+      records = self.post(queries)
+    self.assertEqual(len(queries), len(records))
+
+
 class SvnAuthzTestCase(BaseTestCase):
   def setUp(self):
     try:
@@ -658,6 +846,25 @@ class SvnAuthzTestCase(BaseTestCase):
     self.assertTrue(self.config.has_option('/', g))
     self.assertEqual(self.config.get('/', g), 'r')
 
+  @skipUnless(all([
+    settings.VCSREPO_USE_GROUP_RIGHTS,
+    settings.VCSREPO_USER_MODEL == 'auth.User',
+    settings.VCSREPO_GROUP_MODEL == 'auth.Group',
+  ]), "not using GroupRights with auth.User and auth.Group")
+  def test_clear_user_groups(self):
+    from .models import GroupRights
+    GroupRights.objects.create(
+      repo=self.repo,
+      group=self.group1,
+      rights='r',
+    )
+    self.user1.groups.clear()
+    g = '@' + self.group1.name
+    self.config.read(self.authz)
+    self.assertTrue(self.config.has_section('groups'))
+    self.assertTrue(self.config.has_option('groups', g))
+    self.assertEqual(self.config.get('groups', g), '')
+
 
 class RepoUriTestCase(BaseTestCase):
   def test_svn(self):
@@ -813,6 +1020,54 @@ class RequestTestCase(BaseTestCase):
     expected = 'hg: cloning from bob/code'
     self.assertEqual(expected, result)
 
+  def _postprocess_pipe(self, request, text):
+    r, w = os.pipe()
+    os.write(w, text)
+    os.close(w)
+    try:
+      return list(request.iter_postprocess(r))
+    finally:
+      os.close(r)
+
+  def test_hg_postprocess_stream1(self):
+    '''Complete lines are rewritten and passed on separately'''
+    request = dispatch.get_request(['hg', '--repository', 'bob/code'])
+    request.data = {'rights': 'r', 'path': 'path/to/code'}
+    request.postprocess_bufsize = 4
+    result = self._postprocess_pipe(request, 'a path/to/code\nb\n')
+    self.assertEqual(['a bob/code\nb\n'], result)
+
+  def test_hg_postprocess_stream2(self):
+    '''Long output without line breaks never splits the path'''
+    request = dispatch.get_request(['hg', '--repository', 'bob/code'])
+    request.data = {'rights': 'r', 'path': 'path/to/code'}
+    text = 'x' * 10 + 'path/to/code' + 'y' * 3 + 'path/to/code'
+    for bufsize in range(1, len(text) + 1):
+      request.postprocess_bufsize = bufsize
+      result = self._postprocess_pipe(request, text)
+      expected = 'x' * 10 + 'bob/code' + 'y' * 3 + 'bob/code'
+      self.assertEqual(expected, ''.join(result))
+
+  def test_hg_postprocess_stream3(self):
+    '''The command's stderr is rewritten by run_command'''
+    try:
+      from StringIO import StringIO
+    except ImportError:
+      from io import StringIO
+    request = dispatch.get_request(['hg', '--repository', 'bob/code'])
+    request.data = {'rights': 'r', 'path': 'path/to/code'}
+    request.get_command = lambda: ['sh', '-c',
+                                   'echo path/to/code >&2; exit 3']
+    stderr = sys.stderr
+    sys.stderr = StringIO()
+    try:
+      rc = request.run_command()
+      output = sys.stderr.getvalue()
+    finally:
+      sys.stderr = stderr
+    self.assertEqual(3, rc)
+    self.assertEqual('bob/code\n', output)
+
   def test_git_write1(self):
     '''Writes can happen for git-receive-pack'''
     request = dispatch.get_request(['git-receive-pack', 'bob/code'])
@@ -835,6 +1090,50 @@ class RequestTestCase(BaseTestCase):
     request.add_data({'rights': 'r', 'path': 'path/to/code'})
     self.assertFalse(request.write)
 
+  def test_svn_write1(self):
+    '''Writes are not attributed to a repository for svnserve'''
+    request = dispatch.get_request(['svnserve', '-t'])
+    self.assertFalse(request.write)
+
+  def test_git_snapshot1(self):
+    '''Snapshots only change when refs change'''
+    repo = Repo(name='bob/code', vcs='git')
+    repo.full_clean()
+    repo.save()
+    request = dispatch.get_request(['git-receive-pack', 'bob/code'])
+    request.add_data({'rights': 'rw', 'path': repo.abspath})
+    before = request.snapshot()
+    self.assertEqual(before, request.snapshot())
+    wc = tempfile.mktemp()
+    subprocess.check_call([GIT, 'clone', '-q', repo.abspath, wc],
+                          stderr=DEVNULL)
+    setup_git(cwd=wc)
+    subprocess.check_call([GIT, 'commit', '-q', '--allow-empty', '-m', 'x'],
+                          cwd=wc)
+    subprocess.check_call([GIT, 'push', '-q', 'origin', 'HEAD:master'],
+                          cwd=wc, stdout=DEVNULL, stderr=DEVNULL)
+    shutil.rmtree(wc)
+    self.assertNotEqual(before, request.snapshot())
+
+  def test_hg_snapshot1(self):
+    '''Snapshots only change when changesets are added'''
+    repo = Repo(name='bob/code', vcs='hg')
+    repo.full_clean()
+    repo.save()
+    request = dispatch.get_request(['hg', '-R', 'bob/code'])
+    request.add_data({'rights': 'rw', 'path': repo.abspath})
+    before = request.snapshot()
+    self.assertEqual(before, request.snapshot())
+    wc = tempfile.mktemp()
+    subprocess.check_call(['hg', 'clone', '-q', repo.abspath, wc])
+    with open(os.path.join(wc, 'a'), 'w') as fp:
+      fp.write('a\n')
+    subprocess.check_call(['hg', 'commit', '-q', '-A', '-u', 'test', '-m',
+                           'x'], cwd=wc)
+    subprocess.check_call(['hg', 'push', '-q'], cwd=wc, stdout=DEVNULL)
+    shutil.rmtree(wc)
+    self.assertNotEqual(before, request.snapshot())
+
   def test_repo1(self):
     '''Repo property fetches objects by name appropriately'''
     repo = Repo(name='bob/code', vcs='hg')
@@ -844,6 +1143,1452 @@ class RequestTestCase(BaseTestCase):
     self.assertIsInstance(request.repo, Repo)
     self.assertEqual(repo.pk, request.repo.pk)
 
+  def test_load_local1(self):
+    '''In-process lookups fetch the repo once and reuse it'''
+    repo = Repo(name='bob/code', vcs='git', public_read=True)
+    repo.full_clean()
+    repo.save()
+    request = dispatch.get_request(['git-upload-pack', 'bob/code'])
+    request.load_local()
+    self.assertEqual('r', request.data['rights'])
+    self.assertEqual(repo.abspath, request.data['path'])
+    with self.assertNumQueries(0):
+      self.assertEqual(repo.pk, request.repo.pk)
+
+  def test_load_local2(self):
+    '''In-process lookups honor user rights'''
+    repo = Repo(name='bob/code', vcs='git')
+    repo.full_clean()
+    repo.save()
+    user = User.objects.create(username='bob')
+    request = dispatch.get_request(['git-receive-pack', 'bob/code'], 'bob')
+    original_rights_function = settings.VCSREPO_RIGHTS_FUNCTION
+    settings.VCSREPO_RIGHTS_FUNCTION = lambda r, u: 'rw' if u == user else '-'
+    try:
+      request.load_local()
+    finally:
+      settings.VCSREPO_RIGHTS_FUNCTION = original_rights_function
+    self.assertEqual('rw', request.data['rights'])
+    self.assertTrue(request.write)
+
+  def test_load_local3(self):
+    '''Missing repositories raise DispatchException'''
+    request = dispatch.get_request(['git-upload-pack', 'bob/code'])
+    self.assertRaises(dispatch.DispatchException, request.load_local)
+
+  def test_load_local4(self):
+    '''Missing users raise DispatchException'''
+    repo = Repo(name='bob/code', vcs='git')
+    repo.full_clean()
+    repo.save()
+    request = dispatch.get_request(['git-upload-pack', 'bob/code'], 'nobody')
+    self.assertRaises(dispatch.DispatchException, request.load_local)
+
+  def test_load_local5(self):
+    '''The vcs type of the repository must match the request'''
+    repo = Repo(name='bob/code', vcs='git', public_read=True)
+    repo.full_clean()
+    repo.save()
+    request = dispatch.get_request(['hg', '-R', 'bob/code'])
+    self.assertRaises(dispatch.DispatchException, request.load_local)
+
+
+class DispatchServerTestCase(BaseTestCase):
+
+  def setUp(self):
+    super(DispatchServerTestCase, self).setUp()
+    self.socket_path = os.path.join(settings.VCSREPO_ROOT, 'dispatch.sock')
+
+  def test_fd_passing(self):
+    '''File descriptors survive the trip across the socket'''
+    import socket
+    a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    r, w = os.pipe()
+    try:
+      dispatchd.send_fds(a, [w])
+      fd, = dispatchd.recv_fds(b, 1)
+      os.write(fd, b'hello')
+      os.close(fd)
+      self.assertEqual(b'hello', os.read(r, 5))
+    finally:
+      for x in (r, w):
+        os.close(x)
+      a.close()
+      b.close()
+
+  def test_client_dispatch(self):
+    '''Sessions run by the server write to the client's stderr'''
+    import threading
+    server = dispatchd.DispatchServer(self.socket_path)
+    thread = threading.Thread(target=server.handle_request)
+    thread.start()
+    err = tempfile.TemporaryFile()
+    try:
+      with open(os.devnull, 'r+b') as null:
+        fds = (null.fileno(), null.fileno(), err.fileno())
+        status = dispatchd.client_dispatch(self.socket_path, 'http://test',
+                                           None, 'rm -rf /', fds)
+      thread.join()
+      self.assertEqual(1, status)
+      err.seek(0)
+      self.assertIn(b'Command not allowed', err.read())
+    finally:
+      err.close()
+      server.server_close()
+
+
+class LimiterTestCase(BaseTestCase):
+
+  def setUp(self):
+    super(LimiterTestCase, self).setUp()
+    path = os.path.join(settings.VCSREPO_ROOT, 'slots')
+    self.semaphore = limiter.Semaphore(path, 2)
+    self.semaphore.poll_interval = 0.01
+
+  def test_limit(self):
+    '''Only `limit` slots are handed out'''
+    a = self.semaphore.acquire()
+    b = self.semaphore.acquire()
+    self.assertRaises(limiter.QueueTimeout, self.semaphore.acquire, 0.05)
+    self.semaphore.release(a)
+    c = self.semaphore.acquire(0.05)
+    self.semaphore.release(b)
+    self.semaphore.release(c)
+
+  def test_on_wait(self):
+    '''on_wait is called when the caller has to wait'''
+    waited = []
+    a = self.semaphore.acquire(on_wait=lambda: waited.append(1))
+    b = self.semaphore.acquire(on_wait=lambda: waited.append(1))
+    self.assertEqual([], waited)
+    self.assertRaises(limiter.QueueTimeout, self.semaphore.acquire, 0.05,
+                      lambda: waited.append(1))
+    self.assertEqual([1], waited)
+    self.semaphore.release(a)
+    self.semaphore.release(b)
+
+  def test_not_inherited(self):
+    '''Child processes do not keep holding the slot'''
+    a = self.semaphore.acquire()
+    b = self.semaphore.acquire()
+    cmd = [sys.executable, '-c', 'import time; time.sleep(30)']
+    p = subprocess.Popen(cmd)
+    try:
+      self.semaphore.release(a)
+      self.semaphore.release(self.semaphore.acquire(0.05))
+    finally:
+      p.kill()
+      p.wait()
+      self.semaphore.release(b)
+
+  def test_fifo(self):
+    '''Waiting processes ahead in the queue are served first'''
+    os.makedirs(self.semaphore.queue_path)
+    tickets = [os.path.join(self.semaphore.queue_path, '0.000000-%d' % i)
+               for i in (1, 2)]
+    fds = [limiter._trylock(ticket) for ticket in tickets]
+    try:
+      self.assertRaises(limiter.QueueTimeout, self.semaphore.acquire, 0.05)
+      os.close(fds.pop())
+      os.unlink(tickets[1])
+      a = self.semaphore.acquire(0.05)
+      self.assertRaises(limiter.QueueTimeout, self.semaphore.acquire, 0.05)
+      self.semaphore.release(a)
+    finally:
+      for fd in fds:
+        os.close(fd)
+
+  def test_throughput(self):
+    '''Freed slots are taken promptly by the processes waiting for them'''
+    start = time.time()
+    pids = []
+    for i in range(12):
+      pid = os.fork()
+      if pid == 0:
+        try:
+          fd = self.semaphore.acquire(10)
+          time.sleep(0.1)
+          self.semaphore.release(fd)
+        finally:
+          os._exit(0)
+      pids.append(pid)
+    for pid in pids:
+      os.waitpid(pid, 0)
+    self.assertLess(time.time() - start, 1.5)
+
+  def test_stale_ticket(self):
+    '''Tickets left behind by dead processes are ignored'''
+    os.makedirs(self.semaphore.queue_path)
+    ticket = os.path.join(self.semaphore.queue_path, '0.000000-1')
+    open(ticket, 'w').close()
+    self.semaphore.release(self.semaphore.acquire(0.05))
+    self.assertEqual([], os.listdir(self.semaphore.queue_path))
+
+  def test_request(self):
+    '''Requests fail with a DispatchException when the queue times out'''
+    original = (settings.VCSREPO_DISPATCH_MAX_REPO_PROCESSES,
+                settings.VCSREPO_DISPATCH_QUEUE_TIMEOUT)
+    settings.VCSREPO_DISPATCH_MAX_REPO_PROCESSES = 1
+    settings.VCSREPO_DISPATCH_QUEUE_TIMEOUT = 0
+    try:
+      request = dispatch.get_request(['git-upload-pack', 'bob/code'])
+      semaphores = limiter.get_semaphores('bob/code')
+      self.assertEqual(1, len(semaphores))
+      slots = request.acquire_slots()
+      with open(os.devnull, 'w') as null:
+        stderr = sys.stderr
+        sys.stderr = null
+        try:
+          self.assertRaises(dispatch.DispatchException,
+                            request.acquire_slots)
+        finally:
+          sys.stderr = stderr
+      for fd in slots:
+        os.close(fd)
+      for fd in request.acquire_slots():
+        os.close(fd)
+    finally:
+      (settings.VCSREPO_DISPATCH_MAX_REPO_PROCESSES,
+       settings.VCSREPO_DISPATCH_QUEUE_TIMEOUT) = original
+
+
+class TimingTestCase(BaseTestCase):
+
+  def setUp(self):
+    super(TimingTestCase, self).setUp()
+    self.original = (settings.VCSREPO_DISPATCH_TIMING_LOG,
+                     settings.VCSREPO_DISPATCH_STATSD)
+    self.log = os.path.join(settings.VCSREPO_ROOT, 'timing.log')
+    settings.VCSREPO_DISPATCH_TIMING_LOG = self.log
+
+  def tearDown(self):
+    (settings.VCSREPO_DISPATCH_TIMING_LOG,
+     settings.VCSREPO_DISPATCH_STATSD) = self.original
+    super(TimingTestCase, self).tearDown()
+
+  def dispatch(self, cmd, username=None):
+    with open(os.devnull, 'w') as null:
+      stderr = sys.stderr
+      sys.stderr = null
+      try:
+        self.assertRaises(SystemExit, dispatch.ssh_dispatch, None, username,
+                          cmd, 0)
+      finally:
+        sys.stderr = stderr
+    with open(self.log) as fp:
+      return [json.loads(line) for line in fp]
+
+  def test_bad_command(self):
+    '''Sessions which fail early are recorded'''
+    record, = self.dispatch('rm -rf /')
+    self.assertEqual(1, record['status'])
+    self.assertIsNone(record['repo'])
+    self.assertIn('startup', record['phases'])
+    self.assertNotIn('access', record['phases'])
+
+  def test_denied(self):
+    '''Phases and session details are recorded'''
+    Repo.objects.create(name='repo', path='repo', vcs='git')
+    record, = self.dispatch("git-upload-pack 'repo'", 'bob')
+    self.assertEqual('repo', record['repo'])
+    self.assertEqual('git', record['vcs'])
+    self.assertEqual('bob', record['user'])
+    self.assertFalse(record['write'])
+    self.assertIn('access', record['phases'])
+
+  def test_statsd(self):
+    import socket
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(5)
+    try:
+      settings.VCSREPO_DISPATCH_STATSD = '127.0.0.1:%d' % sock.getsockname()[1]
+      timer = timing.Timer()
+      timer.record('command', 0.25)
+      timer.emit(vcs='git')
+      data = sock.recv(4096).decode('ascii').split('\n')
+    finally:
+      sock.close()
+    expected = ['anyvcs.dispatch.git.sessions:1|c',
+                'anyvcs.dispatch.git.command:250|ms']
+    self.assertEqual(expected, data)
+
+  def test_statsd_misconfigured(self):
+    '''A bad statsd address is logged rather than raised'''
+    for address in ('localhost', 'localhost:port'):
+      settings.VCSREPO_DISPATCH_STATSD = address
+      timing.Timer().emit(vcs='git')
+
+
+class AccessCacheTestCase(BaseTestCase):
+
+  def setUp(self):
+    super(AccessCacheTestCase, self).setUp()
+    self.original_ttl = settings.VCSREPO_ACCESS_CACHE_TTL
+    settings.VCSREPO_ACCESS_CACHE_TTL = 60
+    self.cache = accesscache.get_access_cache()
+    self.data = {'rights': 'rw', 'vcs': 'git', 'path': '/path/to/code'}
+
+  def tearDown(self):
+    settings.VCSREPO_ACCESS_CACHE_TTL = self.original_ttl
+    super(AccessCacheTestCase, self).tearDown()
+
+  def test_disabled(self):
+    settings.VCSREPO_ACCESS_CACHE_TTL = 0
+    self.assertIsNone(accesscache.get_access_cache())
+
+  def test_get_set(self):
+    self.assertIsNone(self.cache.get('bob/code', 'git', 'bob'))
+    self.cache.set('bob/code', 'git', 'bob', self.data)
+    self.assertEqual(self.data, self.cache.get('bob/code', 'git', 'bob'))
+    self.assertIsNone(self.cache.get('bob/code', 'git', None))
+    self.assertIsNone(self.cache.get('bob/code', 'hg', 'bob'))
+
+  def test_expired(self):
+    cache = accesscache.AccessCache(self.cache.path, -1)
+    cache.set('bob/code', 'git', 'bob', self.data)
+    self.assertIsNone(cache.get('bob/code', 'git', 'bob'))
+
+  def test_invalidate_repo_save(self):
+    repo = Repo.objects.create(name='bob/code', path='repo', vcs='git')
+    self.cache.set('bob/code', 'git', 'bob', self.data)
+    repo.public_read = True
+    repo.save()
+    self.assertIsNone(self.cache.get('bob/code', 'git', 'bob'))
+
+  def test_invalidate_repo_rename(self):
+    repo = Repo.objects.create(name='bob/code', path='repo', vcs='git')
+    self.cache.set('bob/code', 'git', 'bob', self.data)
+    repo.name = 'bob/other'
+    repo.save()
+    self.assertIsNone(self.cache.get('bob/code', 'git', 'bob'))
+
+  def test_invalidate_repo_delete(self):
+    repo = Repo.objects.create(name='bob/code', path='repo', vcs='git')
+    self.cache.set('bob/code', 'git', 'bob', self.data)
+    repo.delete()
+    self.assertIsNone(self.cache.get('bob/code', 'git', 'bob'))
+
+  @skipUnless(
+    settings.VCSREPO_USE_USER_RIGHTS,
+    "not using UserRights"
+  )
+  def test_invalidate_user_rights(self):
+    from .models import UserRights
+    repo = Repo.objects.create(name='bob/code', path='repo', vcs='git')
+    user = User.objects.create(username='bob')
+    self.cache.set('bob/code', 'git', 'bob', self.data)
+    UserRights.objects.create(repo=repo, user=user, rights='r')
+    self.assertIsNone(self.cache.get('bob/code', 'git', 'bob'))
+
+  @skipUnless(
+    settings.VCSREPO_USE_GROUP_RIGHTS,
+    "not using GroupRights"
+  )
+  def test_invalidate_group_member(self):
+    user = User.objects.create(username='bob')
+    group = Group.objects.create(name='group')
+    self.cache.set('bob/code', 'git', 'bob', self.data)
+    self.cache.set('bob/code', 'git', 'alice', self.data)
+    group.user_set.add(user)
+    self.assertIsNone(self.cache.get('bob/code', 'git', 'bob'))
+    self.assertEqual(self.data, self.cache.get('bob/code', 'git', 'alice'))
+    self.cache.set('bob/code', 'git', 'bob', self.data)
+    user.groups.remove(group)
+    self.assertIsNone(self.cache.get('bob/code', 'git', 'bob'))
+
+  def test_load_access(self):
+    '''Cache hits do not contact the backend'''
+    self.cache.set('bob/code', 'git', 'bob', self.data)
+    request = dispatch.get_request(['git-receive-pack', 'bob/code'], 'bob')
+    with self.assertNumQueries(0):
+      dispatch.load_access(request, 'http://invalid.invalid/access')
+    self.assertEqual(self.data, request.data)
+    self.assertTrue(request.write)
+
+  def test_get_expired(self):
+    cache = accesscache.AccessCache(self.cache.path, -1)
+    cache.set('bob/code', 'git', 'bob', self.data)
+    self.assertIsNone(cache.get_expired('bob/code', 'git', 'bob'))
+    cache.set('bob/code', 'git', 'bob', self.data, '"abc"')
+    self.assertIsNone(cache.get('bob/code', 'git', 'bob'))
+    self.assertEqual((self.data, '"abc"'),
+                     cache.get_expired('bob/code', 'git', 'bob'))
+
+  def test_load_access_revalidate(self):
+    '''Expired entries are revalidated with their ETag'''
+    try:
+      from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    except ImportError:
+      from http.server import BaseHTTPRequestHandler, HTTPServer
+    import threading
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == '"abc"':
+          self.send_response(304)
+          self.end_headers()
+          return
+        content = json.dumps({'rights': 'r', 'vcs': 'git', 'path': '/new'})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', '"def"')
+        self.end_headers()
+        self.wfile.write(content.encode('ascii'))
+
+      def log_message(self, *args):
+        pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+      url = 'http://127.0.0.1:%d/access' % server.server_address[1]
+      cache = accesscache.AccessCache(self.cache.path, -1)
+      cache.set('bob/code', 'git', 'bob', self.data, '"abc"')
+      request = dispatch.get_request(['git-receive-pack', 'bob/code'], 'bob')
+      dispatch.load_access(request, url)
+      self.assertEqual(self.data, request.data)
+      self.assertEqual(self.data, self.cache.get('bob/code', 'git', 'bob'))
+      cache.set('bob/code', 'git', 'bob', self.data, '"xyz"')
+      request = dispatch.get_request(['git-receive-pack', 'bob/code'], 'bob')
+      dispatch.load_access(request, url)
+      self.assertEqual('/new', request.data['path'])
+      self.assertEqual('"def"', request.etag)
+      self.assertEqual(['"abc"', '"xyz"'], requests)
+    finally:
+      server.shutdown()
+      server.server_close()
+
+  def test_load_access_miss(self):
+    '''Cache misses are filled after the lookup'''
+    Repo.objects.create(name='bob/code', path='repo', vcs='git',
+                        public_read=True)
+    request = dispatch.get_request(['git-upload-pack', 'bob/code'])
+    dispatch.load_access(request, None)
+    self.assertEqual(request.data, self.cache.get('bob/code', 'git', None))
+
+
+@skipUnless(
+  settings.VCSREPO_USE_USER_RIGHTS and settings.VCSREPO_USE_GROUP_RIGHTS,
+  "not using UserRights and GroupRights"
+)
+class EffectiveRightsTestCase(BaseTestCase):
+
+  def setUp(self):
+    super(EffectiveRightsTestCase, self).setUp()
+    self.original_materialize = settings.VCSREPO_MATERIALIZE_RIGHTS
+    settings.VCSREPO_MATERIALIZE_RIGHTS = True
+    self.repo = Repo.objects.create(name='repo', path='repo', vcs='git')
+    self.user = User.objects.create(username='user')
+    self.group1 = Group.objects.create(name='group1')
+    self.group2 = Group.objects.create(name='group2')
+
+  def tearDown(self):
+    settings.VCSREPO_MATERIALIZE_RIGHTS = self.original_materialize
+    super(EffectiveRightsTestCase, self).tearDown()
+
+  def rows(self):
+    qs = EffectiveRights.objects.values_list('repo_id', 'user_id', 'rights')
+    return dict(((repo_id, user_id), rights)
+                for repo_id, user_id, rights in qs)
+
+  def rights(self):
+    return defaults.materialized_rights_function(self.repo, self.user)
+
+  def test_user_rights(self):
+    from .models import UserRights
+    ur = UserRights.objects.create(repo=self.repo, user=self.user, rights='r')
+    self.assertEqual(self.rows(), {(self.repo.pk, self.user.pk): 'r'})
+    ur.rights = 'rw'
+    ur.save()
+    self.assertEqual(self.rights(), 'rw')
+    ur.delete()
+    self.assertEqual(self.rows(), {})
+    self.assertEqual(self.rights(), '-')
+
+  def test_group_rights(self):
+    from .models import GroupRights
+    self.user.groups.add(self.group1)
+    gr = GroupRights.objects.create(repo=self.repo, group=self.group1,
+                                    rights='rw')
+    self.assertEqual(self.rights(), 'rw')
+    GroupRights.objects.create(repo=self.repo, group=self.group2, rights='r')
+    self.assertEqual(self.rights(), 'rw')
+    self.group2.user_set.add(self.user)
+    self.assertEqual(self.rights(), 'r')
+    self.user.groups.remove(self.group2)
+    self.assertEqual(self.rights(), 'rw')
+    gr.delete()
+    self.assertEqual(self.rights(), '-')
+    self.user.groups.add(self.group2)
+    self.assertEqual(self.rights(), 'r')
+    self.group2.user_set.clear()
+    self.assertEqual(self.rows(), {})
+
+  def test_user_overrides_group_rights(self):
+    from .models import UserRights, GroupRights
+    self.user.groups.add(self.group1)
+    GroupRights.objects.create(repo=self.repo, group=self.group1, rights='-')
+    ur = UserRights.objects.create(repo=self.repo, user=self.user,
+                                   rights='rw')
+    self.assertEqual(self.rights(), 'rw')
+    ur.delete()
+    self.assertEqual(self.rights(), '-')
+    self.repo.public_read = True
+    self.assertEqual(self.rights(), '-')
+    self.user.groups.clear()
+    self.assertEqual(self.rights(), 'r')
+
+  def test_delete(self):
+    from .models import UserRights, GroupRights
+    self.user.groups.add(self.group1)
+    GroupRights.objects.create(repo=self.repo, group=self.group1, rights='r')
+    UserRights.objects.create(repo=self.repo, user=self.user, rights='rw')
+    other = User.objects.create(username='other')
+    other.groups.add(self.group1)
+    self.assertEqual(len(self.rows()), 2)
+    self.user.delete()
+    self.assertEqual(self.rows(), {(self.repo.pk, other.pk): 'r'})
+    self.repo.delete()
+    self.assertEqual(self.rows(), {})
+
+  def test_rebuild(self):
+    from .models import UserRights, GroupRights
+    settings.VCSREPO_MATERIALIZE_RIGHTS = False
+    users = [User.objects.create(username='user%d' % i) for i in range(4)]
+    repos = [Repo.objects.create(name='repo%d' % i, path='repo%d' % i)
+             for i in range(3)]
+    users[0].groups.add(self.group1, self.group2)
+    users[1].groups.add(self.group1)
+    users[2].groups.add(self.group2)
+    for repo, g1, g2 in zip(repos, ('rw', 'r', '-'), ('r', 'rw', 'rw')):
+      GroupRights.objects.create(repo=repo, group=self.group1, rights=g1)
+      GroupRights.objects.create(repo=repo, group=self.group2, rights=g2)
+    UserRights.objects.create(repo=repos[2], user=users[0], rights='rw')
+    UserRights.objects.create(repo=repos[0], user=users[3], rights='-')
+    EffectiveRights.objects.create(repo_id=repos[1].pk, user_id=users[3].pk,
+                                   rights='rw')
+    settings.VCSREPO_MATERIALIZE_RIGHTS = True
+    self.assertEqual(effectiverights.rebuild(batch_size=2), 4)
+    for repo in repos:
+      for user in users:
+        self.assertEqual(defaults.materialized_rights_function(repo, user),
+                         defaults.rights_function(repo, user))
+    self.assertEqual(len(self.rows()), 10)
+
+  def test_custom_user_model(self):
+    original_user_model = settings.VCSREPO_USER_MODEL
+    settings.VCSREPO_USER_MODEL = 'accounts.User'
+    try:
+      self.assertRaises(ImproperlyConfigured, effectiverights.update,
+                        user_ids=[self.user.pk])
+      self.assertRaises(ImproperlyConfigured, effectiverights.rebuild)
+    finally:
+      settings.VCSREPO_USER_MODEL = original_user_model
+
+  def test_access_num_queries(self):
+    from .models import GroupRights
+    groups = [Group.objects.create(name='group-%d' % i) for i in range(40)]
+    self.user.groups.add(*groups)
+    for group in groups:
+      GroupRights.objects.create(repo=self.repo, group=group, rights='rw')
+    original_rights_function = settings.VCSREPO_RIGHTS_FUNCTION
+    settings.VCSREPO_RIGHTS_FUNCTION = defaults.materialized_rights_function
+    try:
+      client = Client()
+      url = reverse('django_anyvcs.views.access', args=(self.repo.name,))
+      with self.assertNumQueries(3):
+        response = client.get(url, {'u': self.user.username})
+      self.assertEqual(json.loads(response.content.decode())['rights'], 'rw')
+    finally:
+      settings.VCSREPO_RIGHTS_FUNCTION = original_rights_function
+
+
+def commit_file(repo, name, content):
+  '''Commit a file to a git or hg repository and return the new revision'''
+  wc = tempfile.mktemp()
+  try:
+    if repo.vcs == 'git':
+      subprocess.check_call([GIT, 'clone', '-q', repo.abspath, wc],
+                            stderr=DEVNULL)
+      setup_git(cwd=wc)
+    else:
+      subprocess.check_call(['hg', 'clone', '-q', repo.abspath, wc])
+    path = os.path.join(wc, name)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as fp:
+      fp.write(content)
+    if repo.vcs == 'git':
+      subprocess.check_call([GIT, 'add', '-A', '.'], cwd=wc)
+      subprocess.check_call([GIT, 'commit', '-q', '-m', name], cwd=wc)
+      subprocess.check_call([GIT, 'push', '-q', 'origin', 'HEAD'], cwd=wc,
+                            stderr=DEVNULL)
+    else:
+      subprocess.check_call(['hg', 'commit', '-q', '-A', '-u', 'test', '-m',
+                             name], cwd=wc)
+      subprocess.check_call(['hg', 'push', '-q'], cwd=wc, stdout=DEVNULL)
+  finally:
+    shutil.rmtree(wc)
+  return str(repo.repo.canonical_rev(repo.repo.heads()[0]))
+
+
+class CatTestCase(BaseTestCase):
+  '''
+  Test the cat-raw view.
+  '''
+
+  content = bytes(bytearray(range(256))) * 300
+
+  def setUp(self):
+    super(CatTestCase, self).setUp()
+    self.repo = Repo(name='repo', vcs='git')
+    self.repo.full_clean()
+    self.repo.save()
+    self.rev = commit_file(self.repo, 'dir/data.bin', self.content)
+    self.url = reverse('django_anyvcs.views.cat', args=(self.repo.name,))
+
+  def get(self, path='dir/data.bin', **headers):
+    response = Client().get(self.url, {'rev': self.rev, 'path': path},
+                            **headers)
+    if getattr(response, 'streaming', False):
+      content = b''.join(response.streaming_content)
+    else:
+      content = response.content
+    return response, content
+
+  def test_cat(self):
+    response, content = self.get()
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response['Content-Type'], 'application/octet-stream')
+    self.assertEqual(response['Content-Length'], str(len(self.content)))
+    self.assertEqual(response['Accept-Ranges'], 'bytes')
+    self.assertEqual(content, self.content)
+
+  def test_range(self):
+    size = len(self.content)
+    for header, start, end in (('bytes=0-9', 0, 9),
+                               ('bytes=70000-', 70000, size - 1),
+                               ('bytes=-10', size - 10, size - 1),
+                               ('bytes=100-999999', 100, size - 1)):
+      response, content = self.get(HTTP_RANGE=header)
+      self.assertEqual(response.status_code, 206)
+      self.assertEqual(response['Content-Range'],
+                       'bytes %d-%d/%d' % (start, end, size))
+      self.assertEqual(response['Content-Length'], str(end - start + 1))
+      self.assertEqual(content, self.content[start:end + 1])
+
+  def test_range_ignored(self):
+    for header in ('bytes=5-2', 'bytes=0-1,3-4', 'lines=1-2'):
+      response, content = self.get(HTTP_RANGE=header)
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(content, self.content)
+    response, content = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"x"')
+    self.assertEqual(response.status_code, 200)
+
+  def test_range_not_satisfiable(self):
+    for header in ('bytes=76800-', 'bytes=-0'):
+      response, content = self.get(HTTP_RANGE=header)
+      self.assertEqual(response.status_code, 416)
+      self.assertEqual(response['Content-Range'], 'bytes */76800')
+
+  def test_errors(self):
+    for path, klass in (('dir', 'BadFileType'),
+                        ('missing', 'PathDoesNotExist')):
+      response, content = self.get(path)
+      self.assertEqual(response.status_code, 400)
+      self.assertEqual(json.loads(content.decode('ascii'))['class'], klass)
+    response = Client().get(self.url)
+    self.assertEqual(response.status_code, 400)
+
+  def test_hg(self):
+    repo = Repo(name='hgrepo', vcs='hg')
+    repo.full_clean()
+    repo.save()
+    rev = commit_file(repo, 'data.bin', self.content)
+    url = reverse('django_anyvcs.views.cat', args=(repo.name,))
+    client = Client()
+    response = client.get(url, {'rev': rev, 'path': 'data.bin'})
+    self.assertEqual(response.status_code, 200)
+    self.assertNotIn('Content-Length', response)
+    self.assertEqual(b''.join(response.streaming_content), self.content)
+    response = client.get(url, {'rev': rev, 'path': 'data.bin'},
+                          HTTP_RANGE='bytes=-300')
+    self.assertEqual(response.status_code, 206)
+    self.assertEqual(response['Content-Range'], 'bytes 76500-76799/76800')
+    self.assertEqual(b''.join(response.streaming_content),
+                     self.content[-300:])
+    rev = commit_file(repo, '-r', b'option\n')
+    response = client.get(url, {'rev': rev, 'path': '-r'})
+    self.assertEqual(b''.join(response.streaming_content), b'option\n')
+
+
+class ApiCacheTestCase(BaseTestCase):
+  '''
+  Test the api_call result cache.
+  '''
+
+  def setUp(self):
+    super(ApiCacheTestCase, self).setUp()
+    self.original_cache = settings.VCSREPO_API_CACHE
+    self.original_max = settings.VCSREPO_API_CACHE_MAX_ENTRY_SIZE
+    settings.VCSREPO_API_CACHE = 'default'
+    apicache.get_cache().clear()
+    self.repo = Repo(name='repo', vcs='git')
+    self.repo.full_clean()
+    self.repo.save()
+    self.rev = commit_file(self.repo, 'a', b'hello\n')
+
+  def tearDown(self):
+    settings.VCSREPO_API_CACHE = self.original_cache
+    settings.VCSREPO_API_CACHE_MAX_ENTRY_SIZE = self.original_max
+    super(ApiCacheTestCase, self).tearDown()
+
+  def post(self, attr, **kwargs):
+    url = reverse('django_anyvcs.views.api_call', args=(self.repo.name, attr))
+    response = Client().post(url, json.dumps(kwargs),
+                             content_type='application/json')
+    return json.loads(response.content.decode('utf-8'))
+
+  def test_immutable(self):
+    self.assertTrue(apicache.is_immutable('git', self.rev))
+    self.assertFalse(apicache.is_immutable('git', 'master'))
+    self.assertFalse(apicache.is_immutable('hg', self.rev[:12]))
+    self.assertTrue(apicache.is_immutable('svn', 5))
+    self.assertTrue(apicache.is_immutable('svn', '5'))
+    self.assertTrue(apicache.is_immutable('svn', 'branches/b:5'))
+    self.assertFalse(apicache.is_immutable('svn', 'HEAD'))
+    self.assertFalse(apicache.is_immutable('svn', 'trunk'))
+
+  def test_resolve_kwargs(self):
+    def resolve(attr, **kwargs):
+      return apicache.resolve_kwargs(self.repo, attr, kwargs)
+    self.assertEqual(resolve('cat', rev='HEAD', path='a'),
+                     {'rev': self.rev, 'path': 'a'})
+    self.assertEqual(resolve('log', revrange=[None, 'HEAD']),
+                     {'revrange': [None, self.rev]})
+    self.assertEqual(resolve('diff', rev_a=None, rev_b=self.rev),
+                     {'rev_a': None, 'rev_b': self.rev})
+    self.assertIsNone(resolve('log'))
+    self.assertIsNone(resolve('log', revrange=None))
+    self.assertIsNone(resolve('log', revrange=[self.rev, None]))
+    self.assertIsNone(resolve('branches'))
+
+  def test_cached(self):
+    self.assertEqual(self.post('cat', rev='master', path='a'), 'hello\n')
+    key = apicache.cache_key(self.repo, 'cat', {'rev': self.rev, 'path': 'a'})
+    self.assertEqual(apicache.lookup(key), b'"hello\\n"')
+    apicache.store(key, b'"cached"')
+    self.assertEqual(self.post('cat', rev=self.rev, path='a'), 'cached')
+
+  def test_errors_not_cached(self):
+    result = self.post('cat', rev=self.rev, path='missing')
+    self.assertEqual(result['class'], 'PathDoesNotExist')
+    key = apicache.cache_key(self.repo, 'cat',
+                             {'rev': self.rev, 'path': 'missing'})
+    self.assertIsNone(apicache.lookup(key))
+
+  def test_max_entry_size(self):
+    settings.VCSREPO_API_CACHE_MAX_ENTRY_SIZE = 4
+    self.assertEqual(self.post('cat', rev=self.rev, path='a'), 'hello\n')
+    key = apicache.cache_key(self.repo, 'cat', {'rev': self.rev, 'path': 'a'})
+    self.assertIsNone(apicache.lookup(key))
+
+  def test_disabled(self):
+    settings.VCSREPO_API_CACHE = None
+    self.assertIsNone(apicache.get_cache())
+    self.assertEqual(self.post('cat', rev=self.rev, path='a'), 'hello\n')
+
+
+class ApiBatchTestCase(BaseTestCase):
+  '''
+  Test the batch-call view.
+  '''
+
+  def setUp(self):
+    super(ApiBatchTestCase, self).setUp()
+    self.repo = Repo(name='repo', vcs='git')
+    self.repo.full_clean()
+    self.repo.save()
+    self.rev = commit_file(self.repo, 'README', b'hello\n')
+    self.url = reverse('django_anyvcs.views.api_batch',
+                       args=(self.repo.name,))
+
+  def post(self, calls):
+    response = Client().post(self.url, json.dumps(calls),
+                             content_type='application/json')
+    self.assertEqual(response.status_code, 200)
+    return json.loads(response.content.decode('utf-8'))
+
+  def test_batch(self):
+    calls = [
+      {'attr': 'branches'},
+      {'attr': 'ls', 'kwargs': {'rev': self.rev, 'path': 'README',
+                                'directory': True}},
+      {'attr': 'cat', 'kwargs': {'rev': self.rev, 'path': 'README'}},
+      {'attr': 'cat', 'kwargs': {'rev': self.rev, 'path': 'missing'}},
+      {'attr': 'heads', 'kwargs': {'bad': 1}},
+      {'attr': 'missing'},
+      {'attr': '_command', 'kwargs': {'cmd': ['true']}},
+      {'attr': 'path'},
+    ]
+    original_threads = settings.VCSREPO_API_BATCH_THREADS
+    try:
+      for threads in (1, 4):
+        settings.VCSREPO_API_BATCH_THREADS = threads
+        results = self.post(calls)
+        self.assertEqual(len(calls), len(results))
+        self.assertEqual(results[0], {'result': ['master']})
+        self.assertEqual([e['type'] for e in results[1]['result']], ['f'])
+        self.assertEqual(results[2], {'result': 'hello\n'})
+        self.assertEqual(results[3]['error']['class'], 'PathDoesNotExist')
+        self.assertEqual(results[4]['error']['class'], 'TypeError')
+        self.assertEqual(results[5]['error']['class'], 'AttributeError')
+        self.assertEqual(results[6]['error']['class'], 'AttributeError')
+        self.assertEqual(results[7]['error']['class'], 'TypeError')
+    finally:
+      settings.VCSREPO_API_BATCH_THREADS = original_threads
+
+  def test_binary_cat(self):
+    '''A result which cannot be encoded fails only its own call'''
+    rev = commit_file(self.repo, 'data.bin', b'\xff\xfe\x00')
+    results = self.post([
+      {'attr': 'cat', 'kwargs': {'rev': rev, 'path': 'README'}},
+      {'attr': 'cat', 'kwargs': {'rev': rev, 'path': 'data.bin'}},
+    ])
+    self.assertEqual(results[0], {'result': 'hello\n'})
+    self.assertEqual(results[1]['error']['class'], 'UnicodeDecodeError')
+
+  def test_bad_request(self):
+    client = Client()
+    for body in ('[', '{}', '[{"kwargs": {}}]',
+                 '[{"attr": "ls", "kwargs": 1}]', '[{"attr": ["ls"]}]'):
+      response = client.post(self.url, body, content_type='application/json')
+      self.assertEqual(response.status_code, 400)
+    url = reverse('django_anyvcs.views.api_batch', args=('missing',))
+    response = client.post(url, '[]', content_type='application/json')
+    self.assertEqual(response.status_code, 404)
+
+
+class HandlePoolTestCase(BaseTestCase):
+  '''
+  Test the pool of opened repository handles.
+  '''
+
+  def setUp(self):
+    super(HandlePoolTestCase, self).setUp()
+    self.original_size = settings.VCSREPO_HANDLE_POOL_SIZE
+    handles.clear()
+
+  def tearDown(self):
+    settings.VCSREPO_HANDLE_POOL_SIZE = self.original_size
+    handles.clear()
+    super(HandlePoolTestCase, self).tearDown()
+
+  def test_shared(self):
+    repo = Repo(name='a', vcs='git')
+    repo.full_clean()
+    repo.save()
+    self.assertIs(repo.repo, Repo.objects.get(pk=repo.pk).repo)
+
+  def test_lru(self):
+    settings.VCSREPO_HANDLE_POOL_SIZE = 2
+    repos = []
+    for name in ('a', 'b', 'c'):
+      repo = Repo(name=name, vcs='git')
+      repo.full_clean()
+      repo.save()
+      repos.append(repo)
+    handles.clear()
+    a = repos[0].repo
+    b = repos[1].repo
+    self.assertIs(repos[0].repo, a)
+    repos[2].repo
+    self.assertIs(repos[0].repo, a)
+    self.assertIsNot(repos[1].repo, b)
+
+  def test_move(self):
+    repo = Repo(name='a', vcs='git')
+    repo.full_clean()
+    repo.save()
+    old = repo.repo
+    old_key = (repo.abspath, 'git')
+    self.assertIn(old_key, handles._handles)
+    repo.path = 'b'
+    repo.full_clean()
+    repo.save()
+    self.assertIsNot(repo.repo, old)
+    self.assertEqual(repo.repo.path, repo.abspath)
+    self.assertNotIn(old_key, handles._handles)
+
+  def test_delete(self):
+    repo = Repo(name='a', vcs='git')
+    repo.full_clean()
+    repo.save()
+    key = (repo.abspath, 'git')
+    repo.repo
+    self.assertIn(key, handles._handles)
+    repo.delete()
+    self.assertNotIn(key, handles._handles)
+
+
+class LogPageTestCase(BaseTestCase):
+  '''
+  Test resumable log walks.
+  '''
+
+  def setUp(self):
+    super(LogPageTestCase, self).setUp()
+    self.git = self.git_repo('git', range(1400000060, 1400000480, 60))
+
+  def git_repo(self, name, dates):
+    '''
+    Create a git repository named `name` with a side branch merged into
+    master, giving its seven commits the successive `dates`.
+    '''
+    repo = Repo(name=name, vcs='git')
+    repo.full_clean()
+    repo.save()
+    dates = iter(dates)
+    wc = tempfile.mkdtemp()
+    try:
+      subprocess.check_call([GIT, 'clone', '-q', repo.abspath, wc],
+                            stderr=DEVNULL)
+      setup_git(cwd=wc)
+
+      def commit(name, *args):
+        env = dict(os.environ)
+        date = '%d +0000' % next(dates)
+        env['GIT_AUTHOR_DATE'] = env['GIT_COMMITTER_DATE'] = date
+        if name:
+          with open(os.path.join(wc, name), 'w') as fp:
+            fp.write(name)
+          subprocess.check_call([GIT, 'add', name], cwd=wc)
+          args = ('commit', '-q', '-m', name)
+        subprocess.check_call([GIT] + list(args), cwd=wc, env=env,
+                              stdout=DEVNULL)
+      commit('a')
+      subprocess.check_call([GIT, 'checkout', '-q', '-b', 'side'], cwd=wc)
+      commit('b')
+      commit('c')
+      subprocess.check_call([GIT, 'checkout', '-q', 'master'], cwd=wc)
+      commit('d')
+      commit('b')
+      commit(None, 'merge', '-q', '--no-edit', 'side')
+      commit('e')
+      subprocess.check_call([GIT, 'push', '-q', 'origin', 'master', 'side'],
+                            cwd=wc, stderr=DEVNULL)
+    finally:
+      shutil.rmtree(wc)
+    return repo
+
+  def pages(self, repo, limit, **kwargs):
+    revs = []
+    entries, cursor = logcursor.log_page(repo, limit, **kwargs)
+    while True:
+      self.assertTrue(len(entries) <= limit)
+      revs.extend(x.rev for x in entries)
+      if cursor is None:
+        return revs
+      entries, cursor = logcursor.log_page(repo, limit, cursor)
+
+  def assertPages(self, repo, **kwargs):
+    expected = [x.rev for x in repo.repo.log(**kwargs)]
+    for limit in (1, 2, 3, 4, 100):
+      self.assertEqual(self.pages(repo, limit, **kwargs), expected)
+
+  def assertGitPages(self, repo):
+    self.assertPages(repo)
+    self.assertPages(repo, revrange=[None, 'master'])
+    self.assertPages(repo, revrange=['side', 'master'])
+    self.assertPages(repo, revrange=['side', None])
+    self.assertPages(repo, firstparent=True)
+    self.assertPages(repo, revrange=[None, 'master'], firstparent=True)
+    self.assertPages(repo, revrange=['side', 'master'], firstparent=True,
+                     path='b')
+    self.assertPages(repo, merges=True)
+    self.assertPages(repo, merges=False)
+    self.assertPages(repo, path='b')
+    self.assertPages(repo, path='b', firstparent=True)
+    self.assertPages(repo, revrange=['side', 'master'], path='b')
+
+  def test_git(self):
+    self.assertGitPages(self.git)
+
+  def test_git_dates(self):
+    '''Pages follow git's order when parents are not older than children'''
+    t = 1400000000
+    # The side branch is older than the commit it starts from.
+    self.assertGitPages(self.git_repo('skewed', [t + 300, t + 100, t + 200,
+                                                 t + 400, t + 500, t + 600,
+                                                 t + 700]))
+    self.assertGitPages(self.git_repo('reversed', range(t + 700, t, -100)))
+    self.assertGitPages(self.git_repo('equal', [t] * 7))
+
+  def test_git_new_commits(self):
+    entries, cursor = logcursor.log_page(self.git, 2)
+    expected = [x.rev for x in self.git.repo.log()][2:]
+    commit_file(self.git, 'f', b'f\n')
+    entries, cursor = logcursor.log_page(self.git, 100, cursor)
+    self.assertEqual([x.rev for x in entries], expected)
+
+  def test_git_first_parent(self):
+    '''First-parent walks resume from the first entry of the next page'''
+    kwargs = dict(revrange=[None, 'master'], firstparent=True)
+    expected = [x.rev for x in self.git.repo.log(**kwargs)]
+    entries, cursor = logcursor.log_page(self.git, 2, **kwargs)
+    state = json.loads(base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+    self.assertEqual(state['heads'], expected[2:3])
+    self.assertEqual(state['skip'], 0)
+
+  def test_hg(self):
+    repo = Repo(name='hg', vcs='hg')
+    repo.full_clean()
+    repo.save()
+    for name in 'abc':
+      commit_file(repo, name, name.encode('ascii'))
+    commit_file(repo, 'a', b'aa')
+    self.assertPages(repo)
+    self.assertPages(repo, revrange=[None, 'tip'])
+    self.assertPages(repo, revrange=['1', 'tip'])
+    self.assertPages(repo, path='a')
+
+  def test_svn(self):
+    repo = Repo(name='svn', vcs='svn')
+    repo.full_clean()
+    repo.save()
+    wc = tempfile.mkdtemp()
+    try:
+      subprocess.check_call(['svn', 'checkout', '-q',
+                             'file://' + repo.abspath, wc])
+      for name, content in (('a', 'a'), ('b', 'b'), ('a', 'aa'), ('c', 'c')):
+        path = os.path.join(wc, name)
+        new = not os.path.exists(path)
+        with open(path, 'w') as fp:
+          fp.write(content)
+        if new:
+          subprocess.check_call(['svn', 'add', '-q', path])
+        subprocess.check_call(['svn', 'commit', '-q', '-m', name, wc])
+    finally:
+      shutil.rmtree(wc)
+    self.assertPages(repo)
+    self.assertPages(repo, path='a')
+    self.assertPages(repo, revrange=[None, 3])
+
+  def test_bad_cursor(self):
+    entries, cursor = logcursor.log_page(self.git, 1)
+    self.assertRaises(ValueError, logcursor.log_page, self.git, 1, 'x')
+    state = json.loads(base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+    for key, value in (('heads', ['--output=x']), ('skip', -1)):
+      bad = dict(state)
+      bad[key] = value
+      cursor = logcursor.encode_cursor(bad)
+      self.assertRaises(ValueError, logcursor.log_page, self.git, 1, cursor)
+    for bad in ([1, '--x'], [-1, '/'], [1]):
+      cursor = logcursor.encode_cursor({'vcs': 'svn', 'next': bad})
+      self.assertRaises(ValueError, logcursor.decode_cursor, cursor, 'svn')
+    self.assertRaises(ValueError, logcursor.log_page, self.git, 1,
+                      revrange='master')
+    self.assertRaises(ValueError, logcursor.log_page, self.git, 0)
+
+  def test_view(self):
+    url = reverse('django_anyvcs.views.log_page', args=('git',))
+    response = Client().post(url, json.dumps({'limit': 4}),
+                             content_type='application/json')
+    self.assertEqual(response.status_code, 200)
+    data = json.loads(response.content.decode('utf-8'))
+    self.assertEqual(len(data['log']), 4)
+    response = Client().post(url, json.dumps({'cursor': data['cursor']}),
+                             content_type='application/json')
+    data2 = json.loads(response.content.decode('utf-8'))
+    self.assertEqual([x['rev'] for x in data['log'] + data2['log']],
+                     [x.rev for x in self.git.repo.log()])
+    self.assertIsNone(data2['cursor'])
+    response = Client().post(url, json.dumps({'cursor': 'x'}),
+                             content_type='application/json')
+    self.assertEqual(response.status_code, 400)
+
+
+class RemoteTestCase(LiveServerTestCase):
+  '''
+  Test django_anyvcs.remote against the web API.
+  '''
+
+  def setUp(self):
+    self.original_root = settings.VCSREPO_ROOT
+    settings.VCSREPO_ROOT = tempfile.mkdtemp(prefix='anyvcs-test.')
+    self.repo = Repo(name='repo', vcs='git')
+    self.repo.full_clean()
+    self.repo.save()
+    self.content = bytes(bytearray(range(256))) * 300
+    self.rev = commit_file(self.repo, 'data.bin', self.content)
+    url = reverse('django_anyvcs.views.api_call', args=('repo', 'x'))
+    self.api_url = self.live_server_url + url[:-1]
+
+  def tearDown(self):
+    Repo.objects.all().delete()
+    shutil.rmtree(settings.VCSREPO_ROOT)
+    settings.VCSREPO_ROOT = self.original_root
+
+  def test_cat(self):
+    from .remote import GitRepo
+    repo = GitRepo(self.api_url)
+    self.assertEqual(repo.cat(self.rev, 'data.bin'), self.content)
+    self.assertRaises(BadFileType, repo.cat, self.rev, '/')
+
+  def test_cat_stream(self):
+    from anyvcs.common import PathDoesNotExist
+    from .remote import GitRepo
+    repo = GitRepo(self.api_url)
+    f = repo.cat_stream(self.rev, 'data.bin')
+    self.assertEqual(f.read(10), self.content[:10])
+    self.assertEqual(f.seek(70000), 70000)
+    self.assertEqual(f.read(100), self.content[70000:70100])
+    f.seek(-50, os.SEEK_END)
+    self.assertEqual(f.read(), self.content[-50:])
+    self.assertEqual(f.tell(), len(self.content))
+    self.assertEqual(f.read(), b'')
+    f.seek(0)
+    chunks = iter(lambda: f.read(1000), b'')
+    self.assertEqual(b''.join(chunks), self.content)
+    f.close()
+    self.assertRaises(PathDoesNotExist, repo.cat_stream, self.rev, 'missing')
+
+  def test_cat_stream_hg(self):
+    from .remote import HgRepo
+    hgrepo = Repo(name='hgrepo', vcs='hg')
+    hgrepo.full_clean()
+    hgrepo.save()
+    rev = commit_file(hgrepo, 'data.bin', self.content)
+    commit_file(hgrepo, 'empty', b'')
+    url = reverse('django_anyvcs.views.api_call', args=('hgrepo', 'x'))
+    repo = HgRepo(self.live_server_url + url[:-1])
+    f = repo.cat_stream(rev, 'data.bin')
+    f.seek(-3, os.SEEK_END)
+    self.assertEqual(f.read(), self.content[-3:])
+    f.seek(1000)
+    self.assertEqual(f.read(3), self.content[1000:1003])
+    f.close()
+    f = repo.cat_stream('tip', 'empty')
+    self.assertEqual(f.seek(0, os.SEEK_END), 0)
+    self.assertEqual(f.read(), b'')
+    f.close()
+
+  def test_ndjson(self):
+    rev2 = commit_file(self.repo, 'b', b'b\n')
+    url = reverse('django_anyvcs.views.api_call', args=('repo', 'log'))
+    response = Client().post(url, '{}', content_type='application/json',
+                             HTTP_ACCEPT='application/x-ndjson')
+    self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+    lines = b''.join(response.streaming_content).splitlines()
+    self.assertEqual([json.loads(x.decode('utf-8'))['rev'] for x in lines],
+                     [rev2, self.rev])
+    response = Client().post(url, json.dumps({'revrange': rev2}),
+                             content_type='application/json',
+                             HTTP_ACCEPT='application/x-ndjson')
+    self.assertEqual(response['Content-Type'], 'application/json')
+    self.assertEqual(json.loads(response.content.decode('utf-8'))['rev'],
+                     rev2)
+
+  def test_log_revrange(self):
+    from .remote import GitRepo
+    rev2 = commit_file(self.repo, 'b', b'b\n')
+    repo = GitRepo(self.api_url)
+    log = repo.log(revrange=(self.rev, rev2))
+    self.assertEqual([x.rev for x in log], [rev2])
+
+  def test_iter_log(self):
+    from .remote import GitRepo
+    commit_file(self.repo, 'b', b'b\n')
+    commit_file(self.repo, 'c', b'c\n')
+    repo = GitRepo(self.api_url)
+    expected = [x.rev for x in self.repo.repo.log()]
+    self.assertEqual([x.rev for x in repo.iter_log(page_size=2)], expected)
+    entries, cursor = repo.log_page(limit=1, path='b')
+    self.assertEqual([x.rev for x in entries], expected[1:2])
+    self.assertIsNone(cursor)
+
+  def test_cache(self):
+    from .remote import GitRepo, ResultCache
+    cache = ResultCache()
+    repo = GitRepo(self.api_url, cache=cache)
+    for i in range(2):
+      self.assertEqual(repo.cat(self.rev, 'data.bin'), self.content)
+      self.assertEqual(repo.log(revrange=self.rev).rev, self.rev)
+      self.assertEqual(repo.cat('master', 'data.bin'), self.content)
+      self.assertEqual(repo.log(revrange=[None, self.rev])[0].rev, self.rev)
+    self.assertEqual(cache.stats()['hits'], 3)
+    self.assertEqual(cache.stats()['misses'], 3)
+
+  def test_cache_disk(self):
+    from .remote import GitRepo, ResultCache
+    path = tempfile.mkdtemp(prefix='anyvcs-test.')
+    try:
+      repo = GitRepo(self.api_url, cache=ResultCache(path=path))
+      entries = repo.ls(self.rev, 'data.bin', directory=True,
+                        report=['size'])
+      entry = repo.log(revrange=self.rev)
+      # A new cache reads the entries, stored as JSON, from the directory.
+      cache = ResultCache(path=path)
+      repo = GitRepo(self.api_url, cache=cache)
+      ls = repo.ls(self.rev, 'data.bin', directory=True, report=['size'])
+      self.assertEqual(ls, entries)
+      self.assertEqual(ls[0].size, len(self.content))
+      self.assertEqual(repo.log(revrange=self.rev).message, entry.message)
+      self.assertEqual(cache.stats()['disk_hits'], 2)
+      for name in os.listdir(path):
+        with open(os.path.join(path, name), 'rb') as f:
+          json.loads(f.read().decode('utf-8'))
+    finally:
+      shutil.rmtree(path)
+
+  def test_batch(self):
+    from anyvcs.common import PathDoesNotExist
+    from .remote import GitRepo, ResultCache
+    rev2 = commit_file(self.repo, 'a.txt', b'hello\n')
+    repo = GitRepo(self.api_url, cache=ResultCache())
+    requests = []
+    request = repo._request
+
+    def count(*args, **kwargs):
+      requests.append(args[1])
+      return request(*args, **kwargs)
+    repo._request = count
+    with repo.batch() as b:
+      branches = b.branches()
+      cat = b.cat(rev2, 'a.txt')
+      ls = b.ls(rev2, 'data.bin', directory=True, report=['size'])
+      missing = b.cat(rev2, 'missing')
+      log = b.log(revrange=rev2)
+      self.assertFalse(branches.done())
+      self.assertRaises(RuntimeError, branches.result)
+    self.assertEqual(len(requests), 1)
+    self.assertEqual(branches.result(), ['master'])
+    self.assertEqual(cat.result(), b'hello\n')
+    self.assertEqual(ls.result()[0].size, len(self.content))
+    self.assertRaises(PathDoesNotExist, missing.result)
+    self.assertEqual(log.result().rev, rev2)
+    with repo.batch() as b:
+      cat = b.cat(rev2, 'a.txt')
+      self.assertTrue(cat.done())
+    self.assertEqual(cat.result(), b'hello\n')
+    self.assertEqual(len(requests), 1)
+
+  def test_log_ls(self):
+    from .remote import GitRepo
+    rev2 = commit_file(self.repo, 'b', b'b\n')
+    repo = GitRepo(self.api_url)
+    self.assertEqual([x.rev for x in repo.log()], [rev2, self.rev])
+    self.assertEqual(repo.log(revrange=rev2).rev, rev2)
+    entries = repo.ls(rev2, 'b', directory=True)
+    self.assertEqual([x.type for x in entries], ['f'])
+
+
+class ConnectionPoolTestCase(TestCase):
+  '''
+  Test the keep-alive connection pool of django_anyvcs.remote.
+  '''
+
+  def setUp(self):
+    try:
+      from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+      from SocketServer import ThreadingMixIn
+    except ImportError:
+      from http.server import BaseHTTPRequestHandler, HTTPServer
+      from socketserver import ThreadingMixIn
+    import threading
+    import time
+    test = self
+    self.connections = []
+    self.close = False
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length')))
+        test.connections.append(self.client_address)
+        time.sleep(0.01)
+        content = json.dumps(['master']).encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        # Close without telling the client, like an idle timeout would.
+        self.close_connection = test.close
+
+      def log_message(self, *args):
+        pass
+
+    class Server(ThreadingMixIn, HTTPServer):
+      daemon_threads = True
+
+    self.server = Server(('127.0.0.1', 0), Handler)
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    self.netloc = '127.0.0.1:%d' % self.server.server_address[1]
+    self.url = 'http://%s/api/repo' % self.netloc
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    from . import remote
+    remote.connection_pool(self.netloc).close()
+
+  def test_reuse(self):
+    from .remote import GitRepo, HgRepo
+    git, hg = GitRepo(self.url), HgRepo(self.url)
+    self.assertIs(git._pool, hg._pool)
+    for repo in (git, hg, git):
+      self.assertEqual(repo.branches(), ['master'])
+    self.assertEqual(len(self.connections), 3)
+    self.assertEqual(len(set(self.connections)), 1)
+
+  def test_stale(self):
+    from .remote import GitRepo
+    self.close = True
+    repo = GitRepo(self.url)
+    for i in range(3):
+      self.assertEqual(repo.branches(), ['master'])
+    self.assertEqual(len(self.connections), 3)
+    self.assertEqual(len(set(self.connections)), 3)
+
+  def test_threads(self):
+    from .remote import ConnectionPool, GitRepo
+    import threading
+    repo = GitRepo(self.url, ConnectionPool(self.netloc, size=2))
+    results = []
+
+    def run():
+      for i in range(3):
+        results.append(repo.branches())
+    threads = [threading.Thread(target=run) for i in range(6)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(results, [['master']] * 18)
+    self.assertTrue(len(set(self.connections)) <= 2)
+    self.assertEqual(len(repo._pool._idle), len(set(self.connections)))
+    repo._pool.close()
+
+  def test_reap(self):
+    from .remote import ConnectionPool, GitRepo
+    import time
+    pool = ConnectionPool(self.netloc, idle_timeout=0.01)
+    GitRepo(self.url, pool).branches()
+    self.assertEqual(len(pool._idle), 1)
+    time.sleep(0.02)
+    pool.reap()
+    self.assertEqual(len(pool._idle), 0)
+
+
+class ResultCacheTestCase(TestCase):
+  '''
+  Test the client-side result cache of django_anyvcs.remote.
+  '''
+
+  def setUp(self):
+    self.path = tempfile.mkdtemp(prefix='anyvcs-test.')
+
+  def tearDown(self):
+    shutil.rmtree(self.path)
+
+  def test_immutable(self):
+    from .remote import is_immutable
+    self.assertTrue(is_immutable('git', 'a' * 40))
+    self.assertFalse(is_immutable('git', 'master'))
+    self.assertFalse(is_immutable('hg', None))
+    self.assertTrue(is_immutable('svn', 5))
+    self.assertTrue(is_immutable('svn', 'trunk:5'))
+    self.assertFalse(is_immutable('svn', 'HEAD'))
+
+  def test_lru(self):
+    from .remote import ResultCache
+    cache = ResultCache(max_bytes=10)
+    cache.set('a', b'aaaa')
+    cache.set('b', b'bbbb')
+    self.assertEqual(cache.get('a'), b'aaaa')
+    cache.set('c', b'cccc')
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(cache.get('a'), b'aaaa')
+    cache.set('d', b'd' * 11)
+    self.assertIsNone(cache.get('d'))
+    self.assertEqual(cache.stats(), {'hits': 2, 'disk_hits': 0, 'misses': 2,
+                                     'entries': 2, 'bytes': 8})
+
+  def test_disk(self):
+    from .remote import ResultCache
+    cache = ResultCache(max_bytes=10, path=self.path, max_disk_bytes=20)
+    cache.set('a', b'a' * 8)
+    cache.set('b', b'b' * 8)
+    self.assertEqual(cache.get('a'), b'a' * 8)
+    self.assertEqual(cache.stats()['disk_hits'], 1)
+    cache = ResultCache(path=self.path, max_disk_bytes=20)
+    self.assertEqual(cache.get('b'), b'b' * 8)
+    os.utime(cache._filename('a'), (0, 0))
+    cache.set('c', b'c' * 8)
+    self.assertIsNone(cache.get('a'))
+    self.assertEqual(cache.get('c'), b'c' * 8)
+    self.assertEqual(len(os.listdir(self.path)), 2)
+
+
+@skipUnless(sys.version_info >= (3, 5), 'aioremote needs Python 3.5')
+class AsyncRemoteTestCase(LiveServerTestCase):
+  '''
+  Test django_anyvcs.aioremote against the web API.
+  '''
+
+  def setUp(self):
+    import asyncio
+    self.original_root = settings.VCSREPO_ROOT
+    settings.VCSREPO_ROOT = tempfile.mkdtemp(prefix='anyvcs-test.')
+    self.repo = Repo(name='repo', vcs='git')
+    self.repo.full_clean()
+    self.repo.save()
+    self.rev = commit_file(self.repo, 'a', b'hello\n')
+    url = reverse('django_anyvcs.views.api_call', args=('repo', 'x'))
+    self.api_url = self.live_server_url + url[:-1]
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+
+  def tearDown(self):
+    self.loop.close()
+    Repo.objects.all().delete()
+    shutil.rmtree(settings.VCSREPO_ROOT)
+    settings.VCSREPO_ROOT = self.original_root
+
+  def test_calls(self):
+    from anyvcs.common import PathDoesNotExist
+    from .aioremote import AsyncGitRepo
+    repo = AsyncGitRepo(self.api_url)
+    run = self.loop.run_until_complete
+    self.assertEqual(run(repo.branches()), ['master'])
+    self.assertEqual(run(repo.cat(self.rev, 'a')), b'hello\n')
+    self.assertEqual([x.rev for x in run(repo.log())], [self.rev])
+    self.assertRaises(PathDoesNotExist, run, repo.cat(self.rev, 'missing'))
+
+  def test_log_revrange(self):
+    from .aioremote import AsyncGitRepo
+    rev2 = commit_file(self.repo, 'b', b'b\n')
+    repo = AsyncGitRepo(self.api_url)
+    log = self.loop.run_until_complete(repo.log(revrange=(self.rev, rev2)))
+    self.assertEqual([x.rev for x in log], [rev2])
+
+  def test_gather(self):
+    import asyncio
+    from .aioremote import AsyncGitRepo
+    repo = AsyncGitRepo(self.api_url)
+    calls = [repo.cat(self.rev, 'a') for i in range(10)]
+    results = self.loop.run_until_complete(asyncio.gather(*calls))
+    self.assertEqual(results, [b'hello\n'] * 10)
+
 
 class PristineTestCase(BaseTestCase):
   '''
@@ -1190,6 +2935,244 @@ class DiskSizeTestCase(BaseTestCase):
       settings.VCSREPO_IGNORE_PRIVATE = ignore
 
 
+class IncrementalDiskSizeTestCase(BaseTestCase):
+  '''
+  Test disksize.incremental_disk_size().
+  '''
+
+  def setUp(self):
+    super(IncrementalDiskSizeTestCase, self).setUp()
+    self.repo = Repo(name='repo', vcs='git')
+    self.repo.full_clean()
+    self.repo.save()
+    self.objects = os.path.join(self.repo.abspath, 'objects', 'ab')
+    os.makedirs(self.objects)
+    self.path = os.path.join(self.objects, 'cdef')
+    with open(self.path, 'w') as fp:
+      fp.write('X' * 10)
+    self.settle()
+
+  def settle(self):
+    '''Make the object directory old enough to be indexed'''
+    # Whole seconds, so that setting the mtime again does not round it.
+    t = int(os.stat(self.objects).st_mtime) - 100
+    os.utime(self.objects, (t, t))
+
+  def full_size(self):
+    from .defaults import disk_size_function
+    return disk_size_function(self.repo)
+
+  def test_matches_full_walk(self):
+    size = disksize.incremental_disk_size(self.repo)
+    self.assertEqual(self.full_size(), size)
+    self.assertEqual(size, disksize.incremental_disk_size(self.repo))
+
+  def test_unchanged_directory_not_rescanned(self):
+    '''Files are not stat()ed in unchanged immutable directories'''
+    size = disksize.incremental_disk_size(self.repo)
+    mtime = os.stat(self.objects).st_mtime
+    with open(self.path, 'a') as fp:
+      fp.write('X' * 5)
+    os.utime(self.objects, (mtime, mtime))
+    self.assertEqual(size, disksize.incremental_disk_size(self.repo))
+
+  def test_changed_directory_rescanned(self):
+    '''New files in an immutable directory are counted'''
+    size = disksize.incremental_disk_size(self.repo)
+    with open(os.path.join(self.objects, 'new'), 'w') as fp:
+      fp.write('X' * 5)
+    self.assertEqual(size + 5, disksize.incremental_disk_size(self.repo))
+
+  def test_mutable_files(self):
+    '''Files outside immutable directories are always stat()ed'''
+    size = disksize.incremental_disk_size(self.repo)
+    with open(os.path.join(self.repo.abspath, 'config'), 'a') as fp:
+      fp.write('X' * 5)
+    self.assertEqual(size + 5, disksize.incremental_disk_size(self.repo))
+
+  def test_disk_size_function(self):
+    '''The estimator can replace the default disk size function'''
+    original = settings.VCSREPO_DISK_SIZE_FUNCTION
+    settings.VCSREPO_DISK_SIZE_FUNCTION = disksize.incremental_disk_size
+    try:
+      self.repo.recalculate_disk_size()
+    finally:
+      settings.VCSREPO_DISK_SIZE_FUNCTION = original
+    self.assertEqual(self.full_size(), self.repo.disk_size)
+
+
+class GitBundleTestCase(BaseTestCase):
+  '''
+  Test pre-generated git clone bundles.
+  '''
+
+  def setUp(self):
+    super(GitBundleTestCase, self).setUp()
+    self.repo = Repo(name='repo', vcs='git')
+    self.repo.full_clean()
+    self.repo.save()
+    self.original_uri = settings.VCSREPO_GIT_BUNDLE_URI
+
+  def tearDown(self):
+    settings.VCSREPO_GIT_BUNDLE_URI = self.original_uri
+    super(GitBundleTestCase, self).tearDown()
+
+  def commit(self):
+    wc = tempfile.mktemp()
+    cmd = [GIT, 'clone', '-q', self.repo.abspath, wc]
+    subprocess.check_call(cmd, stderr=DEVNULL)
+    setup_git(cwd=wc)
+    with open(os.path.join(wc, 'a'), 'w') as fp:
+      fp.write('hello\n')
+    subprocess.check_call([GIT, 'add', 'a'], cwd=wc)
+    subprocess.check_call([GIT, 'commit', '-q', '-m', 'commit'], cwd=wc)
+    cmd = [GIT, 'push', '-q', 'origin', 'HEAD:master']
+    subprocess.check_call(cmd, cwd=wc, stdout=DEVNULL, stderr=DEVNULL)
+    shutil.rmtree(wc)
+
+  def config(self, key):
+    cmd = [GIT, 'config', key]
+    return subprocess.check_output(cmd, cwd=self.repo.abspath).strip()
+
+  def test_empty(self):
+    '''Empty repositories have no bundle'''
+    self.assertFalse(bundles.create_bundle(self.repo))
+    path = bundles.bundle_path(self.repo.abspath)
+    self.assertPathNotExists(path)
+
+  def test_create(self):
+    '''Bundles are valid and are advertised if configured'''
+    self.commit()
+    settings.VCSREPO_GIT_BUNDLE_URI = 'http://example.com/{name}.bundle'
+    self.assertTrue(bundles.create_bundle(self.repo))
+    path = bundles.bundle_path(self.repo.abspath)
+    cmd = [GIT, 'bundle', 'verify', path]
+    subprocess.check_call(cmd, cwd=self.repo.abspath, stdout=DEVNULL,
+                          stderr=DEVNULL)
+    self.assertEqual(b'http://example.com/repo.bundle',
+                     self.config('bundle.clone.uri'))
+    bundles.remove_bundle(self.repo)
+    self.assertPathNotExists(path)
+    self.assertRaises(subprocess.CalledProcessError, self.config,
+                      'bundle.clone.uri')
+
+  def test_view(self):
+    self.commit()
+    url = reverse('django_anyvcs.views.bundle', args=(self.repo.name,))
+    response = self.client.get(url)
+    self.assertEqual(404, response.status_code)
+    self.assertEqual(405, self.client.post(url).status_code)
+    bundles.create_bundle(self.repo)
+    response = self.client.get(url)
+    self.assertEqual(200, response.status_code)
+    with open(bundles.bundle_path(self.repo.abspath), 'rb') as fp:
+      self.assertEqual(fp.read(), b''.join(response.streaming_content))
+
+  def test_refresh(self):
+    '''Only repositories with a bundle are refreshed after a push'''
+    from .spool import spooled
+    self.commit()
+    bundles.schedule_refresh(self.repo.name, self.repo.abspath)
+    self.assertEqual([], spooled('git-bundle'))
+    bundles.create_bundle(self.repo)
+    bundles.schedule_refresh(self.repo.name, self.repo.abspath)
+    self.assertEqual(1, bundles.process())
+    self.assertEqual([], spooled('git-bundle'))
+
+  def test_refresh_failure(self):
+    '''Refreshes which fail are scheduled again'''
+    from .spool import spooled
+    self.commit()
+    bundles.create_bundle(self.repo)
+    bundles.schedule_refresh(self.repo.name, self.repo.abspath)
+    original = bundles.GIT
+    bundles.GIT = os.path.join(settings.VCSREPO_ROOT, 'missing-git')
+    try:
+      self.assertEqual(0, bundles.process())
+    finally:
+      bundles.GIT = original
+    self.assertEqual(['repo'], [name for path, name in spooled('git-bundle')])
+
+  def test_min_size(self):
+    '''Repositories over the size threshold get a bundle'''
+    self.commit()
+    self.assertEqual(0, bundles.process(min_size=2 ** 40))
+    self.assertEqual(1, bundles.process(min_size=0))
+    self.assertPathExists(bundles.bundle_path(self.repo.abspath))
+    self.assertEqual(0, bundles.process(min_size=0))
+
+  def test_command(self):
+    from django.core.management import call_command
+    self.commit()
+    call_command('anyvcs_git_bundles', 'repo', verbosity=0)
+    self.assertPathExists(bundles.bundle_path(self.repo.abspath))
+
+
+class DeferredDiskSizeTestCase(BaseTestCase):
+  '''
+  Test the disk size spool used by dispatch.
+  '''
+
+  def setUp(self):
+    super(DeferredDiskSizeTestCase, self).setUp()
+    self.repo = Repo(name='repo', vcs='git')
+    self.repo.full_clean()
+    self.repo.save()
+
+  def test_enqueue(self):
+    '''Repeated requests for a repository are coalesced'''
+    disksize.enqueue('repo')
+    disksize.enqueue('repo')
+    disksize.enqueue('other')
+    self.assertEqual(['other', 'repo'], sorted(disksize.pending()))
+
+  def test_process(self):
+    '''Processing the spool updates the database and empties the spool'''
+    path = os.path.join(self.repo.abspath, 'test-file')
+    with open(path, 'w') as fp:
+      fp.write('X' * 40)
+    disk_size = Repo.objects.get(pk=self.repo.pk).disk_size
+    disksize.enqueue('repo')
+    disksize.enqueue('deleted')
+    self.assertEqual(1, disksize.process())
+    self.assertEqual([], disksize.pending())
+    repo = Repo.objects.get(pk=self.repo.pk)
+    self.assertEqual(40 + disk_size, repo.disk_size)
+
+  def test_claimed(self):
+    '''Entries removed by another worker are skipped'''
+    from . import spool
+    disksize.enqueue('repo')
+    original = spool.spooled
+    entries = original('disk-size')
+    spool.claim(entries[0][0])
+    spool.spooled = lambda name: entries
+    try:
+      self.assertEqual(0, disksize.process())
+    finally:
+      spool.spooled = original
+
+  def test_failure(self):
+    '''Repositories whose recalculation fails are scheduled again'''
+    def fail(repo):
+      raise OSError('failed')
+    original = settings.VCSREPO_DISK_SIZE_FUNCTION
+    settings.VCSREPO_DISK_SIZE_FUNCTION = fail
+    disksize.enqueue('repo')
+    try:
+      self.assertEqual(0, disksize.process())
+    finally:
+      settings.VCSREPO_DISK_SIZE_FUNCTION = original
+    self.assertEqual(['repo'], disksize.pending())
+
+  def test_command(self):
+    '''The management command processes the spool'''
+    from django.core.management import call_command
+    disksize.enqueue('repo')
+    call_command('anyvcs_disk_size', verbosity=0)
+    self.assertEqual([], disksize.pending())
+
+
 def setup_git(**kw):
   cmd = [GIT, 'config', 'user.name', 'Test User']
   subprocess.check_call(cmd, **kw)
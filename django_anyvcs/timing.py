@@ -0,0 +1,106 @@
+# Copyright (c) 2014-2016, Clemson University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Clemson University nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Per-phase timing of ``django-anyvcs-ssh`` sessions.
+
+Durations are always measured, which costs a few calls to ``time.time()``;
+they are only written out if ``VCSREPO_DISPATCH_TIMING_LOG`` or
+``VCSREPO_DISPATCH_STATSD`` is set.
+"""
+
+from contextlib import contextmanager
+import json
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Timer(object):
+  def __init__(self, started=None):
+    '''
+    `started` is the time the process started, if the startup phase should be
+    included.
+    '''
+    self.start = time.time()
+    self.phases = []
+    if started is not None:
+      self.record('startup', self.start - started)
+
+  def record(self, name, seconds):
+    self.phases.append((name, seconds))
+
+  @contextmanager
+  def phase(self, name):
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.record(name, time.time() - start)
+
+  def emit(self, **info):
+    '''
+    Write the recorded phases, along with the fields in `info`, to the
+    configured sinks.
+    '''
+    from . import settings
+    if settings.VCSREPO_DISPATCH_TIMING_LOG:
+      record = dict(info)
+      record['time'] = self.start
+      record['total'] = time.time() - self.start
+      record['phases'] = dict(self.phases)
+      line = json.dumps(record, sort_keys=True) + '\n'
+      try:
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        fd = os.open(settings.VCSREPO_DISPATCH_TIMING_LOG, flags, 0o666)
+        try:
+          os.write(fd, line.encode('utf-8'))
+        finally:
+          os.close(fd)
+      except (IOError, OSError):
+        logger.warning('Could not write timing log', exc_info=True)
+    if settings.VCSREPO_DISPATCH_STATSD:
+      prefix = settings.VCSREPO_DISPATCH_STATSD_PREFIX
+      if info.get('vcs'):
+        prefix += '.' + info['vcs']
+      lines = ['%s.sessions:1|c' % prefix]
+      for name, seconds in self.phases:
+        lines.append('%s.%s:%d|ms' % (prefix, name, seconds * 1000))
+      try:
+        host, port = settings.VCSREPO_DISPATCH_STATSD.rsplit(':', 1)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+          sock.sendto('\n'.join(lines).encode('ascii'), (host, int(port)))
+        finally:
+          sock.close()
+      except (socket.error, ValueError):
+        logger.warning('Could not send timing to statsd', exc_info=True)
@@ -34,5 +34,10 @@ except ImportError:
 
 urlpatterns = patterns('django_anyvcs.views',
   url(r'^access/(?P<repo>.+)$', 'access'),  # noqa
+  url(r'^access-bulk$', 'bulk_access'),
+  url(r'^bundle/(?P<repo>.+)$', 'bundle'),
+  url(r'^api/(?P<repo>.+)/cat-raw$', 'cat'),
+  url(r'^api/(?P<repo>.+)/batch-call$', 'api_batch'),
+  url(r'^api/(?P<repo>.+)/log-page$', 'log_page'),
   url(r'^api/(?P<repo>.+)/(?P<attr>\w+)$', 'api_call'),
 )
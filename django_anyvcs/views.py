@@ -27,12 +27,20 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from django.http import HttpResponse, HttpResponseNotFound
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import HttpResponseNotFound
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from . import settings
+from . import apicache, settings
 from .models import Repo
+import hashlib
 import json
+import os
+import posixpath
+import re
+import types
 
 try:
   from django.contrib.auth import get_user_model
@@ -42,6 +50,12 @@ except ImportError:
   def get_user_model():
     return User
 
+try:
+  from django.http import StreamingHttpResponse
+except ImportError:
+  # Django 1.4 sends the iterator as a regular response.
+  StreamingHttpResponse = HttpResponse
+
 
 class DictEncoder(json.JSONEncoder):
   def default(self, o):
@@ -59,11 +73,86 @@ def JsonResponse(data, *args, **kwargs):
   return HttpResponse(json, *args, **kwargs)
 
 
-def repo_access_data(repo, user):
-  rights = settings.VCSREPO_RIGHTS_FUNCTION(repo, user)
+def repo_access_data(repo, user, rights=None):
+  if rights is None:
+    rights = settings.VCSREPO_RIGHTS_FUNCTION(repo, user)
   return {'rights': rights, 'vcs': repo.vcs, 'path': repo.abspath}
 
 
+def bulk_rights(repos, users):
+  '''
+  Return a dict mapping ``(repo.pk, user.pk)`` to rights for pairs given
+  rights by user or group rights, using a fixed number of queries.  Other
+  pairs have public rights.  Returns None if a custom VCSREPO_RIGHTS_FUNCTION
+  is in use, which must be called for each pair.
+  '''
+  from . import defaults, effectiverights
+  repo_ids = [repo.pk for repo in repos]
+  user_ids = [user.pk for user in users]
+  if settings.VCSREPO_RIGHTS_FUNCTION is defaults.rights_function:
+    if not user_ids:
+      return {}
+    return effectiverights.compute(repo_ids, user_ids)
+  if settings.VCSREPO_RIGHTS_FUNCTION is defaults.materialized_rights_function:
+    if not user_ids:
+      return {}
+    return effectiverights.lookup(repo_ids, user_ids)
+  return None
+
+
+def is_access_query(q):
+  '''Return whether `q` is a well-formed query for ``bulk_access``.'''
+  return isinstance(q, dict) and all(
+    isinstance(x, basestring) for x in (q.get('repo'), q.get('u') or ''))
+
+
+def bulk_access_data(queries):
+  '''
+  Return the access data for each of `queries`, dicts with the keys
+  ``repo`` and optionally ``u`` and ``vcs`` as accepted by the access view.
+  Lookups which fail are answered with a dict with an ``error`` key.
+  '''
+  UserModel = get_user_model()
+  usernames = set(q['u'] for q in queries if q.get('u'))
+  users = {}
+  if usernames:
+    for user in UserModel.objects.filter(username__in=usernames):
+      users[user.username] = user
+  repos = {}
+  for repo in Repo.objects.filter(name__in=set(q['repo'] for q in queries)):
+    repos[repo.name] = repo
+  rights = bulk_rights(repos.values(), users.values())
+  records = []
+  for q in queries:
+    username = q.get('u')
+    user = users.get(username) if username else None
+    repo = repos.get(q['repo'])
+    if username and user is None:
+      records.append({'error': 'User does not exist: %s' % username})
+    elif repo is None or (q.get('vcs') and q['vcs'] != repo.vcs):
+      records.append({'error': 'Repository does not exist: %s' % q['repo']})
+    elif rights is None:
+      records.append(repo_access_data(repo, user))
+    else:
+      r = None
+      if user is not None:
+        r = rights.get((repo.pk, user.pk))
+      if r is None:
+        r = 'r' if repo.public_read else '-'
+      records.append(repo_access_data(repo, user, r))
+  return records
+
+
+def iter_bulk_access(queries, batch_size=400):
+  # Batches keep the number of query parameters within database limits.
+  yield '['
+  for i in range(0, len(queries), batch_size):
+    records = bulk_access_data(queries[i:i + batch_size])
+    for j, record in enumerate(records):
+      yield (',\n' if i + j else '\n') + dictencoder.encode(record)
+  yield '\n]\n'
+
+
 def access(request, repo):
   username = request.GET.get('u')
   user = None
@@ -86,7 +175,367 @@ def access(request, repo):
     message = 'Repository does not exist: %s\n' % repo
     return HttpResponseNotFound(message, content_type='text/plain')
   data = repo_access_data(repo, user)
-  return JsonResponse(data)
+  # The ETag is derived from the data rather than from modification times,
+  # as group membership changes are not timestamped.  For the same reason no
+  # Last-Modified header is sent.  The rights are resolved either way, so a
+  # 304 only saves sending the body.
+  content = json.dumps(data, sort_keys=True).encode('utf-8')
+  etag = hashlib.sha1(content).hexdigest()
+  if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+    response = HttpResponseNotModified()
+  else:
+    response = JsonResponse(data)
+  response['ETag'] = quote_etag(etag)
+  return response
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def bulk_access(request):
+  try:
+    queries = json.load(request)
+  except ValueError:
+    return HttpResponseBadRequest('Invalid JSON\n', content_type='text/plain')
+  if not isinstance(queries, list) or not all(map(is_access_query, queries)):
+    message = 'Expected a list of objects with a repo key\n'
+    return HttpResponseBadRequest(message, content_type='text/plain')
+  return StreamingHttpResponse(iter_bulk_access(queries),
+                               content_type='application/json')
+
+
+@require_http_methods(["GET"])
+def bundle(request, repo):
+  from .bundles import bundle_path
+  from wsgiref.util import FileWrapper
+  try:
+    repo = Repo.objects.get(name=repo, vcs='git')
+  except Repo.DoesNotExist:
+    message = 'Repository does not exist: %s\n' % repo
+    return HttpResponseNotFound(message, content_type='text/plain')
+  try:
+    f = open(bundle_path(repo.abspath), 'rb')
+  except IOError:
+    message = 'Bundle does not exist: %s\n' % repo.name
+    return HttpResponseNotFound(message, content_type='text/plain')
+  response = StreamingHttpResponse(FileWrapper(f),
+                                   content_type='application/x-git-bundle')
+  response['Content-Length'] = os.fstat(f.fileno()).st_size
+  return response
+
+
+range_rx = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+  '''
+  Return the first and last byte of a single byte range of a file of `size`
+  bytes, or None if the whole file should be sent.  Raises ValueError if the
+  range cannot be satisfied.
+  '''
+  m = range_rx.match(header.strip())
+  if not m or m.group(1, 2) == ('', ''):
+    return None
+  first, last = m.group(1, 2)
+  if not first:
+    start = max(0, size - int(last))
+    end = size - 1
+    if not int(last):
+      raise ValueError(header)
+  else:
+    start = int(first)
+    end = size - 1
+    if last:
+      if int(last) < start:
+        return None
+      end = min(int(last), end)
+  if start > end:
+    raise ValueError(header)
+  return start, end
+
+
+def cat_command(repo, rev, path):
+  '''
+  Return the command which writes the contents of `path` at `rev` to stdout,
+  and the size of the file if it is known without reading it.  Raises the
+  exceptions of ``cat()`` if `path` is not a file.
+  '''
+  from anyvcs.common import BadFileType
+  vcsrepo = repo.repo
+  path = type(vcsrepo).cleanPath(path)
+  if repo.vcs == 'svn':
+    rev, prefix = vcsrepo._maprev(rev)
+    path = type(vcsrepo).cleanPath(posixpath.join(prefix, path))
+  else:
+    rev = vcsrepo.canonical_rev(rev)
+  report = ('size',) if repo.vcs == 'git' else ()
+  ls = vcsrepo.ls(rev, path, directory=True, report=report)
+  if len(ls) != 1 or ls[0].get('type') != 'f':
+    raise BadFileType(rev, path)
+  epath = path.encode(vcsrepo.encoding)
+  if repo.vcs == 'git':
+    from anyvcs.git import GIT
+    cmd = [GIT, 'cat-file', 'blob', rev.encode('ascii') + b':' + epath]
+  elif repo.vcs == 'hg':
+    from anyvcs.hg import HG
+    cmd = [HG, 'cat', '-r', str(rev), '--', epath]
+  else:
+    from anyvcs.svn import SVNLOOK
+    cmd = [SVNLOOK, 'cat', '-r', str(rev), '--', '.', epath]
+  return cmd, ls[0].get('size')
+
+
+def iter_output(f, start=0, length=None, close=None, bufsize=65536):
+  '''
+  Yield `length` bytes (or everything) of the file `f` from offset `start`,
+  skipping ahead by reading if it cannot seek.  `close` is called at the end.
+  '''
+  try:
+    if start:
+      try:
+        f.seek(start)
+      except (AttributeError, IOError):
+        while start:
+          chunk = f.read(min(bufsize, start))
+          if not chunk:
+            return
+          start -= len(chunk)
+    while length is None or length > 0:
+      n = bufsize if length is None else min(bufsize, length)
+      chunk = f.read(n)
+      if not chunk:
+        break
+      if length is not None:
+        length -= len(chunk)
+      yield chunk
+  finally:
+    if close is not None:
+      close()
+
+
+@require_http_methods(["GET"])
+def cat(request, repo):
+  import subprocess
+  try:
+    repo = Repo.objects.get(name=repo)
+  except Repo.DoesNotExist:
+    message = 'Repository does not exist: %s\n' % repo
+    return HttpResponseNotFound(message, content_type='text/plain')
+  rev = request.GET.get('rev')
+  path = request.GET.get('path')
+  if rev is None or path is None:
+    message = 'rev and path are required\n'
+    return HttpResponseBadRequest(message, content_type='text/plain')
+  try:
+    cmd, size = cat_command(repo, rev, path)
+  except Exception as e:
+    return JsonResponse(exception_data(e), status=400)
+  # There are no validators to compare If-Range to, so a range is only sent
+  # for unconditional requests.
+  range_header = request.META.get('HTTP_RANGE')
+  if 'HTTP_IF_RANGE' in request.META:
+    range_header = None
+  devnull = open(os.devnull, 'wb')
+  proc = subprocess.Popen(cmd, cwd=repo.repo.path, stdout=subprocess.PIPE,
+                          stderr=devnull)
+  devnull.close()
+
+  def close():
+    proc.stdout.close()
+    if proc.poll() is None:
+      proc.kill()
+    proc.wait()
+  f = proc.stdout
+  if range_header and size is None:
+    # The size of Mercurial and Subversion files is not known without reading
+    # them, so they are spooled to disk first.
+    import tempfile
+    f = tempfile.TemporaryFile()
+    for chunk in iter_output(proc.stdout, close=close):
+      f.write(chunk)
+    size = f.tell()
+    f.seek(0)
+    close = f.close
+  byte_range = None
+  if range_header:
+    try:
+      byte_range = parse_range(range_header, size)
+    except ValueError:
+      close()
+      response = HttpResponse(status=416)
+      response['Content-Range'] = 'bytes */%d' % size
+      return response
+  if byte_range is None:
+    content = iter_output(f, close=close)
+    response = StreamingHttpResponse(content,
+                                     content_type='application/octet-stream')
+  else:
+    start, end = byte_range
+    content = iter_output(f, start, end - start + 1, close=close)
+    response = StreamingHttpResponse(content, status=206,
+                                     content_type='application/octet-stream')
+    response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    size = end - start + 1
+  if size is not None:
+    response['Content-Length'] = size
+  response['Accept-Ranges'] = 'bytes'
+  return response
+
+
+def exception_data(e):
+  import traceback
+  return {
+    'module': type(e).__module__,
+    'class': type(e).__name__,
+    'args': e.args,
+    'str': str(e),
+    'traceback': traceback.format_exc(),
+  }
+
+
+def iter_ndjson(data, key=None):
+  '''
+  Yield the entries of the list `data` as newline-delimited JSON.  If `key` is
+  given, the list is stored in the result cache once it has all been sent,
+  unless it is larger than ``VCSREPO_API_CACHE_MAX_ENTRY_SIZE``.  Entries are
+  encoded one at a time, but `data` is already complete, because anyvcs
+  methods return lists.
+  '''
+  parts, size = [], 2
+  for item in data:
+    line = dictencoder.encode(item)
+    if key is not None:
+      size += len(line) + 2
+      if size > settings.VCSREPO_API_CACHE_MAX_ENTRY_SIZE:
+        key = parts = None
+      else:
+        parts.append(line)
+    yield line + '\n'
+  if key is not None:
+    apicache.store(key, '[' + ', '.join(parts) + ']')
+
+
+def call_attr(repo, name, kwargs, stream=False):
+  '''
+  Call the method `name` of the repository with `kwargs`, using the result
+  cache.  Returns the JSON encoded result and True, or the encoded exception
+  data and False.  If `stream` is true and the result is a list, it is
+  returned as an ``iter_ndjson`` generator instead.
+  '''
+  key = None
+  try:
+    if name.startswith('_'):
+      raise AttributeError('Attribute does not exist: %s' % name)
+    attr = getattr(repo.repo, name)
+    if not callable(attr):
+      raise TypeError('Attribute is not callable: %s' % name)
+    if apicache.get_cache() is not None:
+      resolved = apicache.resolve_kwargs(repo, name, kwargs)
+      if resolved is not None:
+        kwargs = resolved
+        key = apicache.cache_key(repo, name, kwargs)
+        content = apicache.lookup(key)
+        if content is not None:
+          if stream and content.startswith('['):
+            return iter_ndjson(json.loads(content)), True
+          return content, True
+    data = attr(**kwargs)
+    if stream and isinstance(data, (list, tuple)):
+      return iter_ndjson(data, key), True
+    # Encoding fails for results which cannot be represented as JSON, such as
+    # the contents of binary files.
+    content = dictencoder.encode(data)
+  except Exception as e:
+    data = exception_data(e)
+    try:
+      return dictencoder.encode(data), False
+    except UnicodeError:
+      # The arguments hold bytes which are not UTF-8, such as the contents
+      # which failed to encode.
+      data['args'] = [repr(x) for x in e.args]
+      return dictencoder.encode(data), False
+  if key is not None:
+    apicache.store(key, content)
+  return content, True
+
+
+# Methods which only read the repository, and may run in parallel.
+PARALLEL_ATTRS = frozenset([
+  'ancestor', 'blame', 'bookmarks', 'branches', 'canonical_rev', 'cat',
+  'changed', 'compose_rev', 'diff', 'empty', 'heads', 'log', 'ls', 'pdiff',
+  'propget', 'proplist', 'readlink', 'tags', 'youngest',
+])
+
+
+def is_batch_call(c):
+  '''Return whether `c` is a well-formed call for ``api_batch``.'''
+  return isinstance(c, dict) and all([
+    isinstance(c.get('attr'), basestring),
+    isinstance(c.get('kwargs', {}), dict),
+  ])
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_batch(request, repo):
+  try:
+    repo = Repo.objects.get(name=repo)
+  except Repo.DoesNotExist:
+    message = 'Repository does not exist: %s\n' % repo
+    return HttpResponseNotFound(message, content_type='text/plain')
+  try:
+    calls = json.load(request)
+  except ValueError:
+    return HttpResponseBadRequest('Invalid JSON\n', content_type='text/plain')
+  if not isinstance(calls, list) or not all(map(is_batch_call, calls)):
+    message = 'Expected a list of objects with attr and kwargs keys\n'
+    return HttpResponseBadRequest(message, content_type='text/plain')
+
+  def run(call):
+    return call_attr(repo, call['attr'], call.get('kwargs') or {})
+  repo.repo  # Open the repository once, before any threads start.
+  results = [None] * len(calls)
+  parallel = [i for i, c in enumerate(calls) if c['attr'] in PARALLEL_ATTRS]
+  threads = min(settings.VCSREPO_API_BATCH_THREADS, len(parallel))
+  if threads > 1:
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(threads)
+    try:
+      jobs = [calls[i] for i in parallel]
+      for i, result in zip(parallel, pool.map(run, jobs)):
+        results[i] = result
+    finally:
+      pool.close()
+      pool.join()
+  for i, call in enumerate(calls):
+    if results[i] is None:
+      results[i] = run(call)
+  content = ',\n'.join('{"%s": %s}' % ('result' if ok else 'error', content)
+                       for content, ok in results)
+  return HttpResponse('[' + content + ']\n', content_type='application/json')
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def log_page(request, repo):
+  from .logcursor import log_page
+  try:
+    repo = Repo.objects.get(name=repo)
+  except Repo.DoesNotExist:
+    message = 'Repository does not exist: %s\n' % repo
+    return HttpResponseNotFound(message, content_type='text/plain')
+  try:
+    kwargs = json.load(request)
+  except ValueError:
+    return HttpResponseBadRequest('Invalid JSON\n', content_type='text/plain')
+  if not isinstance(kwargs, dict):
+    message = 'Expected an object of log arguments\n'
+    return HttpResponseBadRequest(message, content_type='text/plain')
+  kwargs.setdefault('limit', 100)
+  try:
+    entries, cursor = log_page(repo, **kwargs)
+  except Exception as e:
+    return JsonResponse(exception_data(e), status=400)
+  return JsonResponse({'log': entries, 'cursor': cursor})
 
 
 @csrf_exempt
@@ -101,24 +550,18 @@ def api_call(request, repo, attr):
   if not hasattr(repo.repo, attr):
     message = 'Attribute does not exist'
     return HttpResponseNotFound(message, content_type='text/plain')
-  attr = getattr(repo.repo, attr)
+  name, attr = attr, getattr(repo.repo, attr)
   if request.method == 'POST':
     if not isinstance(attr, Callable):
       message = 'Attribute is not callable'
       return HttpResponseNotFound(message, content_type='text/plain')
     kwargs = json.load(request)
-    try:
-      data = attr(**kwargs)
-    except Exception as e:
-      import traceback
-      data = {
-        'module': type(e).__module__,
-        'class': type(e).__name__,
-        'args': e.args,
-        'str': str(e),
-        'traceback': traceback.format_exc(),
-      }
-      return JsonResponse(data, status=400)
-    return JsonResponse(data)
+    stream = 'application/x-ndjson' in request.META.get('HTTP_ACCEPT', '')
+    content, ok = call_attr(repo, name, kwargs, stream)
+    if isinstance(content, types.GeneratorType):
+      return StreamingHttpResponse(content,
+                                   content_type='application/x-ndjson')
+    return HttpResponse(content, status=200 if ok else 400,
+                        content_type='application/json')
   else:
     return JsonResponse(attr)
@@ -28,7 +28,20 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import sys
 from setuptools import setup
+from setuptools.command.build_py import build_py
+
+
+class BuildPy(build_py):
+  def find_package_modules(self, package, package_dir):
+    modules = build_py.find_package_modules(self, package, package_dir)
+    if sys.version_info < (3, 5):
+      # aioremote uses async/await syntax, which older versions cannot
+      # compile.
+      modules = [m for m in modules if m[:2] != ('django_anyvcs', 'aioremote')]
+    return modules
+
 
 README = open(os.path.join(os.path.dirname(__file__), 'README.rst')).read()
 
@@ -41,6 +54,7 @@ setup(
   name='django-anyvcs',
   version=__version__,  # noqa
   packages=['django_anyvcs'],
+  cmdclass={'build_py': BuildPy},
   include_package_data=True,
   license='BSD',
   description='A Django app providing homogeneous management of VCS systems.',
@@ -68,6 +82,8 @@ setup(
   entry_points={
     'console_scripts': [
       'django-anyvcs-ssh = django_anyvcs.dispatch:main',
+      'django-anyvcs-sshd = django_anyvcs.dispatchd:server_main',
+      'django-anyvcs-ssh-client = django_anyvcs.dispatchd:client_main',
     ],
   },
 )